@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_backends
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures encrypt and decrypt throughput and the resulting cookie size of
+    the keyczar backend and the AES-GCM and ChaCha20-Poly1305 backends.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_backends.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import timeit
+
+from flask_encryptedsession.backends import AEADBackend, KeyczarBackend
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+NUMBER = 5000
+HEADER = '1.1700000000'
+
+
+def ops(func):
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    return NUMBER / seconds
+
+
+def main():
+    backends = [
+        ('keyczar', KeyczarBackend(KEYS_DIR)),
+        ('aes-gcm', AEADBackend(KEYS_DIR, 'aes-gcm')),
+        ('chacha20-poly1305', AEADBackend(KEYS_DIR, 'chacha20-poly1305')),
+    ]
+    print '%-18s %7s %12s %12s %8s' % ('backend', 'payload', 'encrypt/s',
+                                        'decrypt/s', 'cookie')
+    for size in (64, 512, 4096):
+        payload = os.urandom(size)
+        for name, backend in backends:
+            ciphertext = backend.encrypt(payload, HEADER)
+            print '%-18s %7d %12.0f %12.0f %8d' % (
+                name, size,
+                ops(lambda: backend.encrypt(payload, HEADER)),
+                ops(lambda: backend.decrypt(ciphertext, HEADER)),
+                len(ciphertext))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_batch
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the throughput of :func:`decode_cookies` with an increasing
+    number of worker processes.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_batch.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import time
+from multiprocessing import cpu_count
+
+from flask_encryptedsession.batch import decode_cookies, encode_cookies
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+COOKIES = 20000
+
+
+def main():
+    sessions = [{'user_id': i, 'csrf_token': 'a' * 40}
+                for i in xrange(COOKIES)]
+    cookies = [result.cookie for result in encode_cookies(sessions, KEYS_DIR)]
+    print '%d cookies, %d CPUs' % (COOKIES, cpu_count())
+    processes = 1
+    while processes <= max(2, cpu_count()):
+        start = time.time()
+        for _ in decode_cookies(cookies, KEYS_DIR, processes=processes):
+            pass
+        elapsed = time.time() - start
+        print '%2d processes %10.0f cookies/s' % (processes,
+                                                   COOKIES / elapsed)
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
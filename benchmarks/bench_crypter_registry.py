@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_crypter_registry
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares passing a keys location string to :class:`EncryptedCookie`
+    with passing a :class:`keyczar.Crypter` instance, and with reading the
+    keys on every call the way string locations used to be handled.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_crypter_registry.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import timeit
+
+from keyczar import keyczar
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+NUMBER = 2000
+
+
+def bench(label, func):
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    print '%-36s %8.1f us/op' % (label, seconds / NUMBER * 1e6)
+
+
+def main():
+    crypter = keyczar.Crypter.Read(KEYS_DIR)
+    data = {'user_id': 42, 'csrf_token': 'a' * 40}
+    value = EncryptedCookie(data, crypter).serialize()
+
+    bench('serialize, Crypter.Read per call',
+          lambda: EncryptedCookie(
+              data, keyczar.Crypter.Read(KEYS_DIR)).serialize())
+    bench('serialize, string path',
+          lambda: EncryptedCookie(data, KEYS_DIR).serialize())
+    bench('serialize, Crypter instance',
+          lambda: EncryptedCookie(data, crypter).serialize())
+    bench('unserialize, Crypter.Read per call',
+          lambda: EncryptedCookie.unserialize(
+              value, keyczar.Crypter.Read(KEYS_DIR)))
+    bench('unserialize, string path',
+          lambda: EncryptedCookie.unserialize(value, KEYS_DIR))
+    bench('unserialize, Crypter instance',
+          lambda: EncryptedCookie.unserialize(value, crypter))
+
+
+if __name__ == '__main__':
+    main()
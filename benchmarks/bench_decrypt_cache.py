@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_decrypt_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares :meth:`EncryptedCookie.unserialize` with and without a
+    :class:`DecryptCache` for a cookie that is sent back unchanged.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_decrypt_cache.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import timeit
+
+from keyczar import keyczar
+
+from flask_encryptedsession.cache import DecryptCache
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+NUMBER = 2000
+
+SESSIONS = [
+    ('small', {'user_id': 42, '_permanent': True}),
+    ('flashes', {'user_id': 42, 'csrf_token': 'a' * 40,
+                 '_flashes': [('message', 'Saved.')] * 3}),
+    ('large', dict(('key%d' % i, 'x' * 40) for i in range(40))),
+]
+
+
+def bench(label, func):
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    print '%-24s %8.1f us/op' % (label, seconds / NUMBER * 1e6)
+
+
+def main():
+    crypter = keyczar.Crypter.Read(KEYS_DIR)
+    for name, data in SESSIONS:
+        value = EncryptedCookie(data, crypter).serialize()
+        cache = DecryptCache()
+        bench('%s uncached' % name,
+              lambda: EncryptedCookie.unserialize(value, crypter))
+        bench('%s cached' % name,
+              lambda: EncryptedCookie.unserialize(value, crypter, cache))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_offload
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures how long a single threaded event loop stalls while sessions
+    are opened and saved, inline and with
+    :class:`~flask_encryptedsession.offload.OffloadingSessionInterface`.
+
+    The loop is a small cooperative scheduler.  A ticker task wants to run
+    every millisecond and records how late it runs; request tasks open a
+    session from a 4KB cookie, change it and save it.  Inline, every
+    request blocks the loop for the whole crypto work; offloaded, the loop
+    only waits for results that are ready.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_offload.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import time
+
+import flask
+from werkzeug.test import EnvironBuilder
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.offload import (
+    BoundedExecutor, InlineResult, OffloadingSessionInterface)
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+DURATION = 2.0
+TICK = 0.001
+CONCURRENT_REQUESTS = 8
+
+
+def ticker(lags, deadline):
+    due = time.time() + TICK
+    while time.time() < deadline:
+        now = time.time()
+        if now >= due:
+            lags.append(now - due)
+            due = now + TICK
+        yield None
+
+
+def requests(app, interface, value, offload, counter, deadline):
+    # tasks interleave, so they cannot use Flask's request context
+    environ = EnvironBuilder(
+        headers=[('Cookie', 'session=' + value)]).get_environ()
+    while time.time() < deadline:
+        request = app.request_class(environ)
+        if offload:
+            result = interface.open_session_async(app, request)
+        else:
+            result = InlineResult(interface.open_session, (app, request))
+        while not result.ready():
+            yield None
+        session = result.get()
+        session['counter'] = session.get('counter', 0) + 1
+        response = app.response_class()
+        if offload:
+            result = interface.save_session_async(app, session, response)
+        else:
+            result = InlineResult(interface.save_session,
+                                  (app, session, response))
+        while not result.ready():
+            yield None
+        result.get()
+        counter.append(1)
+        yield None
+
+
+def run_loop(tasks):
+    while tasks:
+        for task in list(tasks):
+            try:
+                task.next()
+            except StopIteration:
+                tasks.remove(task)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    app = flask.Flask(__name__)
+    data = dict(('key%d' % i, 'x' * 40) for i in range(60))
+    value = EncryptedCookie(data, KEYS_DIR).serialize()
+    executor = BoundedExecutor(threads=4, max_pending=CONCURRENT_REQUESTS)
+    interface = OffloadingSessionInterface(KEYS_DIR, executor=executor)
+    print 'cookie size %d bytes, %d concurrent requests' % (
+        len(value), CONCURRENT_REQUESTS)
+    for label, offload in (('inline', False), ('offloaded', True)):
+        lags = []
+        counter = []
+        deadline = time.time() + DURATION
+        tasks = [ticker(lags, deadline)] + [
+            requests(app, interface, value, offload, counter, deadline)
+            for _ in range(CONCURRENT_REQUESTS)]
+        run_loop(tasks)
+        print '%-10s %6.0f req/s  loop lag p50 %6.3f ms  p99 %6.3f ms  ' \
+              'max %6.3f ms' % (
+                  label, len(counter) / DURATION,
+                  percentile(lags, 0.5) * 1000,
+                  percentile(lags, 0.99) * 1000, max(lags) * 1000)
+    executor.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_rejects
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures what rejecting a bad cookie costs with
+    :meth:`EncryptedCookie.unserialize`: random garbage, a cookie encrypted
+    with an unknown key and a forged cookie, with and without a
+    :class:`~flask_encryptedsession.cache.NegativeCache`.  A valid cookie
+    is measured for comparison.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_rejects.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import os.path
+import timeit
+
+from flask_encryptedsession.cache import NegativeCache
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.keys import get_crypter
+
+
+TESTS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests')
+KEYS_DIR = os.path.join(TESTS_DIR, 'testkeys')
+KEYS_DIR_BADKEY = os.path.join(TESTS_DIR, 'testkeys_badkey')
+
+NUMBER = 5000
+
+
+def us_per_op(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER * 1e6
+
+
+def main():
+    crypter = get_crypter(KEYS_DIR)
+
+    class CachingCookie(EncryptedCookie):
+        negative_cache = NegativeCache()
+
+    valid = EncryptedCookie({'user_id': 42}, crypter).serialize()
+    forged = valid[:-2] + (valid[-2] == 'A' and 'B' or 'A') + valid[-1]
+    cookies = [
+        ('valid', valid),
+        ('garbage', os.urandom(60).encode('base64').replace('\n', '')),
+        ('unknown key', EncryptedCookie(
+            {'user_id': 42}, get_crypter(KEYS_DIR_BADKEY)).serialize()),
+        ('forged', forged),
+    ]
+    print '%-16s %14s %14s' % ('', 'unserialize', 'negative cache')
+    for name, value in cookies:
+        print '%-16s %11.2f us %11.2f us' % (
+            name,
+            us_per_op(lambda: EncryptedCookie.unserialize(value, crypter)),
+            us_per_op(lambda: CachingCookie.unserialize(value, crypter)))
+
+
+if __name__ == '__main__':
+    main()
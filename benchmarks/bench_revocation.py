@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_revocation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures what checking session ids against a
+    :class:`~flask_encryptedsession.revocation.RevocationList` with 100000
+    revoked ids adds to loading a cookie: the check for an id that was not
+    revoked (the Bloom filter only), for a revoked id (Bloom filter and
+    SQLite lookup) and :meth:`EncryptedCookie.unserialize` with and without
+    the check.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_revocation.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import os.path
+import shutil
+import tempfile
+import timeit
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.revocation import RevocationList
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+NUMBER = 20000
+REVOKED = 100000
+
+
+def us_per_op(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER * 1e6
+
+
+def main():
+    tempdir = tempfile.mkdtemp()
+    try:
+        revoked = RevocationList(os.path.join(tempdir, 'revoked.db'))
+        connection = revoked._connection()
+        with connection:
+            connection.executemany(
+                'INSERT INTO revoked_sessions (session_id) VALUES (?)',
+                (('id%d' % i,) for i in xrange(REVOKED)))
+        revoked.compact()
+
+        class PlainCookie(EncryptedCookie):
+            session_ids = True
+
+        class RevocableCookie(PlainCookie):
+            revocation_list = revoked
+
+        value = PlainCookie({'user_id': 42}, KEYS_DIR).serialize()
+        print '%d revoked ids, Bloom filter of %d KB with %d hashes' % (
+            len(revoked), revoked._bloom.size // 8192, revoked._bloom.hashes)
+        print '%-32s %8.2f us' % ('check, not revoked', us_per_op(
+            lambda: revoked.is_revoked('not-revoked')))
+        print '%-32s %8.2f us' % ('check, revoked', us_per_op(
+            lambda: revoked.is_revoked('id42')))
+        print '%-32s %8.2f us' % ('unserialize', us_per_op(
+            lambda: PlainCookie.unserialize(value, KEYS_DIR)))
+        print '%-32s %8.2f us' % ('unserialize with revocation', us_per_op(
+            lambda: RevocableCookie.unserialize(value, KEYS_DIR)))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
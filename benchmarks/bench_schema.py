@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_schema
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares a session class with a declared
+    :class:`~flask_encryptedsession.schema.SessionSchema` to the dict based
+    session class: the size of the payload and the cookie, the time to
+    dump and load the payload alone and to serialize and unserialize the
+    complete cookie, for each serializer.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_schema.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import timeit
+
+from flask_encryptedsession.encryptedsession import EncryptedCookieSession
+from flask_encryptedsession.keys import get_crypter
+from flask_encryptedsession.schema import Field, SessionSchema
+from flask_encryptedsession.serializers import (
+    MsgpackSerializer, PickleSerializer, TaggedBinarySerializer, msgpack)
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+NUMBER = 5000
+
+SCHEMA = SessionSchema([
+    Field('user_id', (int, long)),
+    Field('csrf_token', str),
+    Field('_permanent', bool, False),
+    Field('_fresh', bool, False),
+    Field('locale', str, 'en'),
+    Field('login_time', (int, long)),
+    Field('cart_items', (int, long), 0),
+    Field('_flashes', list),
+])
+
+SESSION = {
+    'user_id': 1234567,
+    'csrf_token': '9f86d081884c7d659a2feaa0c55ad015',
+    '_permanent': True,
+    '_fresh': True,
+    'locale': 'de',
+    'login_time': 1398947400,
+    'cart_items': 3,
+}
+
+
+def us_per_op(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER * 1e6
+
+
+def main():
+    crypter = get_crypter(KEYS_DIR)
+    serializers = [PickleSerializer(), TaggedBinarySerializer()]
+    if msgpack is not None:
+        serializers.append(MsgpackSerializer())
+    print '%-30s %8s %8s %10s %10s %10s %10s' % (
+        '', 'payload', 'cookie', 'dump', 'load', 'serialize', 'unserialize')
+    for serializer in serializers:
+        dict_class = type('DictSession', (EncryptedCookieSession,),
+                          {'serializer': serializer})
+        schema_class = SCHEMA.session_class(dict_class)
+        for name, cls in (('dict', dict_class), ('schema', schema_class)):
+            session = cls(SESSION, crypter)
+            value = session.serialize()
+            payload = session._dumps()
+            print '%-30s %8d %8d %7.2f us %7.2f us %7.2f us %7.2f us' % (
+                '%s, %s' % (serializer.__class__.__name__, name),
+                len(payload), len(value),
+                us_per_op(session._dumps),
+                us_per_op(lambda: cls._loads(payload)),
+                us_per_op(session.serialize),
+                us_per_op(lambda: cls.unserialize(value, crypter)))
+
+
+if __name__ == '__main__':
+    main()
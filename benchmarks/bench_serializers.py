@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_serializers
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Payload size and dump/load speed of every serializer across a few
+    realistic session shapes.  ``legacy`` is the untagged protocol 0 pickle
+    that older versions wrote, ``zlib`` the size after compression.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_serializers.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import cPickle as pickle
+import timeit
+
+from flask_encryptedsession import serializers
+from flask_encryptedsession.serializers import (
+    JSONSerializer, MsgpackSerializer, PickleSerializer,
+    TaggedBinarySerializer, compress_payload)
+
+
+NUMBER = 5000
+
+SESSIONS = [
+    ('login', {'user_id': 42, '_permanent': True,
+               'csrf_token': 'f3a9c2' * 7}),
+    ('flashes', {'user_id': 42, 'csrf_token': 'f3a9c2' * 7,
+                 '_flashes': [('message', u'Your changes were saved.'),
+                              ('error', u'Please try again.')]}),
+    ('cart', {'user_id': 42, 'cart': [{'sku': 'SKU-%04d' % i, 'qty': i % 3,
+                                       'price': 9.99} for i in range(15)],
+              'currency': 'EUR'}),
+    ('flags', dict(('feature_%d' % i, i % 2 == 0) for i in range(60))),
+]
+
+
+class LegacyPickle(object):
+    def dumps(self, obj):
+        return pickle.dumps(obj)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+def main():
+    codecs = [('legacy', LegacyPickle()), ('pickle', PickleSerializer()),
+              ('json', JSONSerializer()), ('binary', TaggedBinarySerializer())]
+    if serializers.msgpack is not None:
+        codecs.append(('msgpack', MsgpackSerializer()))
+    print '%-8s %-8s %7s %7s %10s %10s' % ('session', 'codec', 'bytes',
+                                           'zlib', 'dumps us', 'loads us')
+    for name, session in SESSIONS:
+        for codec_name, codec in codecs:
+            data = codec.dumps(session)
+            dumps = min(timeit.repeat(lambda: codec.dumps(session),
+                                      number=NUMBER, repeat=3))
+            loads = min(timeit.repeat(lambda: codec.loads(data),
+                                      number=NUMBER, repeat=3))
+            print '%-8s %-8s %7d %7d %10.1f %10.1f' % (
+                name, codec_name, len(data), len(compress_payload(data)),
+                dumps / NUMBER * 1e6, loads / NUMBER * 1e6)
+
+
+if __name__ == '__main__':
+    main()
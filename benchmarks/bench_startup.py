@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_startup
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures how long importing the session interface takes and how long a
+    forked worker process needs until it has served its first session:
+
+    ``cold``
+        the master only imported Flask; every worker imports this package,
+        reads the keys and handles a session.
+    ``preloaded``
+        the master imported this package and read the keys with
+        :func:`~flask_encryptedsession.keys.preload` before forking, as a
+        gunicorn ``on_starting`` hook would.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_startup.py
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import os.path
+import subprocess
+import sys
+import time
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+WORKERS = 4
+RUNS = 5
+
+IMPORT_TIME = '''
+import time
+import flask
+start = time.time()
+import flask_encryptedsession.encryptedsession
+print time.time() - start
+'''
+
+
+def import_time():
+    """The best time of importing the interface in a fresh interpreter in
+    which Flask was already imported.
+    """
+    # import the package from where this process would import it
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    times = []
+    for _ in range(RUNS):
+        process = subprocess.Popen([sys.executable, '-c', IMPORT_TIME],
+                                   stdout=subprocess.PIPE, env=env,
+                                   cwd=os.path.dirname(__file__) or None)
+        times.append(float(process.communicate()[0]))
+    return min(times)
+
+
+def serve_first_session():
+    import flask
+    from flask_encryptedsession.encryptedsession import (
+        EncryptedCookieSessionInterface)
+    app = flask.Flask(__name__)
+    app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR)
+
+    @app.route('/')
+    def index():
+        flask.session['x'] = 42
+        return ''
+    app.test_client().get('/')
+
+
+def worker_startup(preloaded):
+    """Fork the workers one after another and return the time each one
+    took from the fork to its first session.
+    """
+    times = []
+    for _ in range(WORKERS):
+        read, write = os.pipe()
+        start = time.time()
+        pid = os.fork()
+        if not pid:
+            os.close(read)
+            serve_first_session()
+            os.write(write, repr(time.time() - start))
+            os._exit(0)
+        os.close(write)
+        elapsed = float(os.read(read, 64))
+        os.close(read)
+        os.waitpid(pid, 0)
+        times.append(elapsed)
+    return times
+
+
+def main():
+    print 'import time: %.1f ms' % (import_time() * 1000)
+    import flask
+    for label in ('cold', 'preloaded'):
+        if label == 'preloaded':
+            try:
+                from flask_encryptedsession.keys import preload
+            except ImportError:
+                print 'preloaded: not supported by this version'
+                continue
+            import flask_encryptedsession.encryptedsession
+            preload(KEYS_DIR)
+        times = worker_startup(label == 'preloaded')
+        print '%-10s worker startup: mean %.1f ms, max %.1f ms' % (
+            label, sum(times) / len(times) * 1000, max(times) * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.bench_threads
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A multi-threaded stress test of one shared
+    :class:`EncryptedCookieSessionInterface`, as a threaded WSGI server uses
+    it.  Every thread keeps its own session and, for a fixed time, opens
+    it, increments a counter in it and saves it, then checks that the next
+    request sees exactly the incremented counter.  The report shows the
+    round trips per second for 1 to N threads, the speedup over one thread
+    and the number of sessions that came back wrong, which must be 0.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ PYTHONPATH=. python benchmarks/bench_threads.py --threads 1,2,4,8
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import multiprocessing
+import optparse
+import os.path
+import threading
+import time
+
+import flask
+from werkzeug.test import EnvironBuilder
+
+from flask_encryptedsession.backends import AEADBackend
+from flask_encryptedsession.cache import DecryptCache
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+
+def make_interfaces():
+    interfaces = [('keyczar', EncryptedCookieSessionInterface(KEYS_DIR)),
+                  ('keyczar+cache', EncryptedCookieSessionInterface(
+                      KEYS_DIR, decrypt_cache=DecryptCache()))]
+    try:
+        interfaces.append(('aes-gcm', EncryptedCookieSessionInterface(
+            AEADBackend(KEYS_DIR))))
+    except RuntimeError:
+        pass
+    return interfaces
+
+
+def worker(app, interface, index, deadline, results):
+    data = dict(('key%d' % i, 'thread %d' % index) for i in range(20))
+    cookie = None
+    count = errors = 0
+    while time.time() < deadline:
+        headers = []
+        if cookie is not None:
+            headers.append(('Cookie', 'session=' + cookie))
+        environ = EnvironBuilder(headers=headers).get_environ()
+        with app.request_context(environ):
+            session = interface.open_session(app, flask.request)
+            if cookie is None:
+                session.update(data)
+            elif session.get('count') != count or \
+                    session.get('key0') != data['key0']:
+                errors += 1
+            count += 1
+            session['count'] = count
+            response = app.response_class()
+            interface.save_session(app, session, response)
+        cookie = response.headers['Set-Cookie'].split(';')[0][8:]
+    results.append((count, errors))
+
+
+def run(interface, threads, duration):
+    app = flask.Flask(__name__)
+    results = []
+    deadline = time.time() + duration
+    workers = [threading.Thread(target=worker, args=(
+        app, interface, index, deadline, results))
+        for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (sum(count for count, _ in results) / duration,
+            sum(errors for _, errors in results))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--threads', default='1,2,4,8',
+                      help='comma separated thread counts '
+                           '(default: %default)')
+    parser.add_option('--duration', type='float', default=2.0,
+                      help='seconds per run (default: %default)')
+    options, args = parser.parse_args()
+    thread_counts = [int(count) for count in options.threads.split(',')]
+    print '%d CPUs' % multiprocessing.cpu_count()
+    print '%-14s %7s %12s %8s %7s' % ('interface', 'threads', 'sessions/s',
+                                      'speedup', 'errors')
+    for name, interface in make_interfaces():
+        single = None
+        for threads in thread_counts:
+            rate, errors = run(interface, threads, options.duration)
+            if single is None:
+                single = rate
+            print '%-14s %7d %12.0f %7.2fx %7d' % (
+                name, threads, rate, rate / single, errors)
+
+
+if __name__ == '__main__':
+    main()
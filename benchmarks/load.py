@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.load
+    ~~~~~~~~~~~~~~~
+
+    A load harness that measures what the encrypted session costs per
+    request under concurrent traffic.
+
+    A small Flask app is served by the Werkzeug server on a local port and
+    driven by client threads.  Each client follows one of these patterns:
+
+    ``read``
+        gets a session once and then only reads it.
+    ``write``
+        changes the session on every request.
+    ``large``
+        keeps a session of about 3KB and changes it on every request.
+    ``bad``
+        sends a cookie that does not decrypt.
+
+    The same traffic runs twice, with :class:`EncryptedCookieSessionInterface`
+    and with a session interface that does nothing, and the report shows
+    throughput and latency percentiles for both.  The time spent inside
+    `open_session` and `save_session` is measured as well.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ export PYTHONPATH=.
+        $ python benchmarks/load.py --clients read=8,write=2,large=1,bad=1 \\
+            --requests 200
+
+    Everything runs locally, no network access is needed.
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import httplib
+import json
+import optparse
+import os
+import os.path
+import threading
+import time
+from base64 import urlsafe_b64encode
+from Cookie import SimpleCookie
+
+import flask
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+
+
+KEYS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests', 'testkeys')
+
+KINDS = ['read', 'write', 'large', 'bad']
+
+
+class _PlainSession(dict, SessionMixin):
+    pass
+
+
+class NoSessionInterface(SessionInterface):
+    """Hands out empty sessions and never sets a cookie, which is the
+    baseline the encrypted session is compared to.
+    """
+
+    def open_session(self, app, request):
+        return _PlainSession()
+
+    def save_session(self, app, session, response):
+        pass
+
+
+class TimedInterface(object):
+    """Wraps a session interface and adds up the time spent in it."""
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.lock = threading.Lock()
+        self.seconds = 0.0
+        self.calls = 0
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                self.seconds += elapsed
+                self.calls += 1
+
+    def open_session(self, app, request):
+        return self._timed(self.interface.open_session, app, request)
+
+    def save_session(self, app, session, response):
+        return self._timed(self.interface.save_session, app, session,
+                           response)
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def make_app(interface):
+    app = flask.Flask(__name__)
+    app.session_interface = interface
+
+    @app.route('/read')
+    def read():
+        return str(flask.session.get('counter', 0))
+
+    @app.route('/write')
+    def write():
+        flask.session['counter'] = flask.session.get('counter', 0) + 1
+        return str(flask.session['counter'])
+
+    @app.route('/large')
+    def large():
+        if 'items' not in flask.session:
+            flask.session['items'] = [urlsafe_b64encode(os.urandom(30))
+                                      for _ in range(75)]
+        flask.session['counter'] = flask.session.get('counter', 0) + 1
+        return str(flask.session['counter'])
+
+    return app
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class Client(threading.Thread):
+    """Sends `requests` requests following the pattern of `kind`."""
+
+    def __init__(self, port, kind, requests):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.kind = kind
+        self.requests = requests
+        self.cookie = None
+        self.latencies = []
+        self.errors = 0
+
+    def request(self, path):
+        headers = {}
+        if self.cookie:
+            headers['Cookie'] = 'session=' + self.cookie
+        start = time.time()
+        connection = httplib.HTTPConnection('127.0.0.1', self.port)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        elapsed = time.time() - start
+        if response.status != 200:
+            self.errors += 1
+        set_cookie = response.getheader('set-cookie')
+        if set_cookie:
+            morsel = SimpleCookie(set_cookie).get('session')
+            if morsel is not None:
+                self.cookie = morsel.value
+        return elapsed
+
+    def run(self):
+        if self.kind == 'read':
+            self.request('/write')
+            path = '/read'
+        elif self.kind == 'bad':
+            self.cookie = '1.%d.%s' % (time.time() + 3600,
+                                       urlsafe_b64encode(os.urandom(90)))
+            path = '/read'
+        else:
+            path = '/' + self.kind
+        for _ in xrange(self.requests):
+            self.latencies.append(self.request(path))
+
+
+def run_load(interface, clients, requests):
+    """Serve the app with `interface` and drive it with `clients`, a list
+    of ``(kind, count)`` pairs.  Returns the report as a dict.
+    """
+    timed = TimedInterface(interface)
+    server = make_server('127.0.0.1', 0, make_app(timed), threaded=True,
+                         request_handler=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        threads = []
+        for kind, count in clients:
+            for _ in range(count):
+                threads.append(Client(server.server_port, kind, requests))
+        start = time.time()
+        for client in threads:
+            client.start()
+        for client in threads:
+            client.join()
+        elapsed = time.time() - start
+    finally:
+        server.shutdown()
+
+    report = {'seconds': elapsed, 'kinds': {}}
+    latencies = []
+    for kind in KINDS:
+        values = [latency for client in threads if client.kind == kind
+                  for latency in client.latencies]
+        if not values:
+            continue
+        latencies.extend(values)
+        report['kinds'][kind] = {
+            'requests': len(values),
+            'errors': sum(client.errors for client in threads
+                          if client.kind == kind),
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+        }
+    report['requests'] = len(latencies)
+    report['throughput'] = len(latencies) / elapsed
+    report['p50_ms'] = percentile(latencies, 0.5) * 1000
+    report['p99_ms'] = percentile(latencies, 0.99) * 1000
+    report['session_ms_per_request'] = \
+        timed.seconds / max(1, len(latencies)) * 1000
+    return report
+
+
+def print_report(label, report):
+    print '%s: %d requests, %.0f req/s, p50 %.2f ms, p99 %.2f ms, ' \
+          'session %.3f ms/request' % (
+              label, report['requests'], report['throughput'],
+              report['p50_ms'], report['p99_ms'],
+              report['session_ms_per_request'])
+    for kind in KINDS:
+        stats = report['kinds'].get(kind)
+        if stats is not None:
+            print '    %-6s %6d requests %4d errors  p50 %7.2f ms  ' \
+                  'p99 %7.2f ms' % (kind, stats['requests'], stats['errors'],
+                                    stats['p50_ms'], stats['p99_ms'])
+
+
+def parse_clients(value):
+    clients = []
+    for part in value.split(','):
+        kind, _, count = part.partition('=')
+        if kind not in KINDS:
+            raise optparse.OptionValueError('unknown client kind %r' % kind)
+        clients.append((kind, int(count or 1)))
+    return clients
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('--clients', default='read=6,write=2,large=1,bad=1',
+                      help='the client mix as kind=threads pairs '
+                           '(default: %default)')
+    parser.add_option('-n', '--requests', type='int', default=200,
+                      help='requests per client (default: %default)')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='also write the reports to this JSON file')
+    options = parser.parse_args(argv)[0]
+    clients = parse_clients(options.clients)
+
+    reports = {}
+    for label, interface in (
+            ('off', NoSessionInterface()),
+            ('on', EncryptedCookieSessionInterface(KEYS_DIR))):
+        reports[label] = run_load(interface, clients, options.requests)
+        print_report('session interface %s' % label, reports[label])
+
+    on, off = reports['on'], reports['off']
+    print
+    print 'overhead: p50 %+.2f ms, p99 %+.2f ms, throughput %+.1f%%' % (
+        on['p50_ms'] - off['p50_ms'], on['p99_ms'] - off['p99_ms'],
+        (on['throughput'] / off['throughput'] - 1) * 100)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(reports, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
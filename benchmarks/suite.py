@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.suite
+    ~~~~~~~~~~~~~~~~
+
+    Measures the cost of the encrypt/serialize hot path and writes the
+    results to a JSON file so runs on different commits can be compared.
+
+    Every case runs for each payload size, each bundled keyset and with the
+    keys passed as a :class:`keyczar.Crypter` instance and as a location
+    string.  The cases are:
+
+    ``serialize``
+        :meth:`EncryptedCookie.serialize`.
+    ``unserialize``
+        :meth:`EncryptedCookie.unserialize`.
+    ``load_save_cookie``
+        :meth:`EncryptedCookie.load_cookie` from a request followed by a
+        forced :meth:`EncryptedCookie.save_cookie` into a response.
+    ``session_round_trip``
+        :meth:`EncryptedCookieSessionInterface.open_session`, a change to
+        the session and :meth:`EncryptedCookieSessionInterface.save_session`.
+
+    Run from the repository root, with the package on the path (or
+    installed with ``pip install -e .``)::
+
+        $ export PYTHONPATH=.
+        $ python benchmarks/suite.py -o before.json
+        $ python benchmarks/suite.py -o after.json --compare before.json
+
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import optparse
+import os.path
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+import flask
+from keyczar import keyczar
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request, Response
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+
+
+TESTS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'flask_encryptedsession', 'tests')
+
+KEYSETS = ['testkeys', 'testkeys_badkey']
+
+PAYLOAD_SIZES = [0, 64, 256, 1024, 4096]
+
+COOKIE_NAME = 'session'
+
+
+def make_data(size):
+    """Return a session dict that pickles to roughly `size` bytes."""
+    if not size:
+        return {}
+    data = {'user_id': 42}
+    index = 0
+    while len(EncryptedCookie(data)._dumps()) < size:
+        data['key%d' % index] = 'x' * min(64, size)
+        index += 1
+    return data
+
+
+def make_request(value):
+    builder = EnvironBuilder(headers=[
+        ('Cookie', '%s=%s' % (COOKIE_NAME, value))])
+    return Request(builder.get_environ())
+
+
+def bench_serialize(keys, data, value):
+    return lambda: EncryptedCookie(data, keys).serialize()
+
+
+def bench_unserialize(keys, data, value):
+    return lambda: EncryptedCookie.unserialize(value, keys)
+
+
+def bench_load_save_cookie(keys, data, value):
+    request = make_request(value)
+
+    def run():
+        cookie = EncryptedCookie.load_cookie(request, COOKIE_NAME, keys)
+        cookie.save_cookie(Response(), COOKIE_NAME, force=True)
+    return run
+
+
+def bench_session_round_trip(keys, data, value):
+    app = flask.Flask(__name__)
+    interface = EncryptedCookieSessionInterface(keys)
+    environ = make_request(value).environ
+
+    def run():
+        with app.request_context(environ):
+            session = interface.open_session(app, flask.request)
+            session['counter'] = session.get('counter', 0) + 1
+            interface.save_session(app, session, Response())
+    return run
+
+
+CASES = [
+    ('serialize', bench_serialize),
+    ('unserialize', bench_unserialize),
+    ('load_save_cookie', bench_load_save_cookie),
+    ('session_round_trip', bench_session_round_trip),
+]
+
+
+def measure(func, number, repeat):
+    """Return the best time per call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / \
+        number * 1e6
+
+
+def git_revision():
+    try:
+        process = subprocess.Popen(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    output = process.communicate()[0]
+    if process.returncode:
+        return None
+    return output.strip()
+
+
+def run(number, repeat, cases=None):
+    results = []
+    for keyset in KEYSETS:
+        location = os.path.join(TESTS_DIR, keyset)
+        crypter = keyczar.Crypter.Read(location)
+        for size in PAYLOAD_SIZES:
+            data = make_data(size)
+            value = EncryptedCookie(data, crypter).serialize()
+            for key_type, keys in (('crypter', crypter), ('path', location)):
+                for case, factory in CASES:
+                    if cases and case not in cases:
+                        continue
+                    us = measure(factory(keys, data, value), number, repeat)
+                    results.append({
+                        'case': case,
+                        'keyset': keyset,
+                        'keys': key_type,
+                        'payload_size': size,
+                        'cookie_size': len(value),
+                        'us_per_op': round(us, 2),
+                    })
+                    print '%-20s %-16s %-8s %5d %10.1f us/op' % (
+                        case, keyset, key_type, size, us)
+    return results
+
+
+def _result_key(result):
+    return (result['case'], result['keyset'], result['keys'],
+            result['payload_size'])
+
+
+def compare(results, baseline):
+    """Print the change of every case relative to `baseline`."""
+    old = dict((_result_key(result), result['us_per_op'])
+               for result in baseline['results'])
+    print
+    print 'compared to %s' % (baseline.get('revision') or 'baseline')
+    for result in results:
+        before = old.get(_result_key(result))
+        if not before:
+            continue
+        print '%-20s %-16s %-8s %5d %+7.1f%%' % (
+            _result_key(result) + (
+                (result['us_per_op'] - before) / before * 100,))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('-o', '--output', default='benchmark-results.json',
+                      help='the JSON file to write (default: %default)')
+    parser.add_option('-n', '--number', type='int', default=500,
+                      help='calls per timing run (default: %default)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='timing runs per case, the best one counts '
+                           '(default: %default)')
+    parser.add_option('-c', '--case', action='append', type='choice',
+                      choices=[case for case, _ in CASES],
+                      help='only run this case, may be given repeatedly')
+    parser.add_option('--compare', metavar='FILE',
+                      help='a previous output file to compare against')
+    args = parser.parse_args(argv)[0]
+
+    results = run(args.number, args.repeat, args.case)
+    report = {
+        'revision': git_revision(),
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'number': args.number,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.backends
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Crypto backends encrypt and decrypt cookie payloads.
+
+    :class:`KeyczarBackend` wraps a :class:`keyczar.Crypter` and is used by
+    default.  :class:`AEADBackend` uses AES-GCM or ChaCha20-Poly1305 from the
+    `cryptography` package, which encrypts and authenticates in a single
+    pass and produces shorter cookies.  Its keys are derived from the same
+    keyczar keyset, so switching engines does not need new keys::
+
+        from flask_encryptedsession.backends import AEADBackend
+
+        app.session_interface = EncryptedCookieSessionInterface(
+            AEADBackend("/tmp/keys", algorithm='aes-gcm'))
+
+    The AEAD backend still decrypts cookies written by keyczar, so existing
+    sessions survive the switch.
+
+    Every backend output starts with a format byte: ``0`` is keyczar,
+    ``1`` AES-GCM and ``2`` ChaCha20-Poly1305.  The next four bytes are the
+    keyczar hash of the key that was used, which is what identifies keys
+    here (see :meth:`CryptoBackend.key_id`).
+
+    To rotate to a new keyset while cookies encrypted with the old one are
+    still around, pass an ordered list of keysets.  The first one encrypts,
+    all of them decrypt::
+
+        app.session_interface = EncryptedCookieSessionInterface(
+            ["/tmp/keys-2013", "/tmp/keys-2012"])
+
+    A list is turned into a :class:`KeyRing`, which finds the keyset of a
+    cookie by the key hash instead of trying every keyset in turn.
+
+    :meth:`CryptoBackend.check` rejects ciphertexts that cannot have been
+    produced by a backend, because of their length, alphabet, format byte
+    or key hash, without any crypto.  Cookies are checked before they are
+    decrypted, so garbage is cheap to reject.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import string
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from flask_encryptedsession.keys import get_crypter
+
+# set by _import_cryptography when the first AEADBackend is created,
+# importing the package takes longer than importing everything else
+AESGCM = ChaCha20Poly1305 = HKDF = hashes = default_backend = None
+
+
+#: the format byte of keyczar output.
+KEYCZAR_FORMAT = '\x00'
+
+#: maps algorithm names to their format byte.
+AEAD_FORMATS = {
+    'aes-gcm': '\x01',
+    'chacha20-poly1305': '\x02',
+}
+
+_NONCE_SIZE = 12
+_KEY_HASH_SIZE = 4
+
+#: the characters of web safe base64.
+_B64_ALPHABET = string.ascii_letters + string.digits + '-_'
+
+
+def _b64_length(size):
+    """The length of `size` bytes in base64 without padding."""
+    return (size * 4 + 2) // 3
+
+
+def b64encode(data):
+    """Web safe base64 without padding, as used by keyczar."""
+    return urlsafe_b64encode(data).rstrip('=')
+
+
+def b64decode(data):
+    return urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class InvalidCiphertext(ValueError):
+    """Raised by :meth:`CryptoBackend.check`.  `reason` is ``'malformed'``
+    or ``'unknown_key'``.
+    """
+
+    def __init__(self, reason, message):
+        ValueError.__init__(self, message)
+        self.reason = reason
+
+
+class CryptoBackend(object):
+    """The interface of crypto backends.
+
+    `associated_data` is authenticated along with the payload but not
+    encrypted; decryption fails if it differs from what was passed when
+    encrypting.
+    """
+
+    #: the format bytes of the ciphertexts the backend decrypts.  Empty
+    #: if the backend does not tell.
+    formats = frozenset()
+
+    #: the length of the shortest ciphertext the backend decrypts.
+    min_ciphertext_length = 0
+
+    def encrypt(self, data, associated_data=None):
+        """Encrypt `data` and return a web safe string."""
+        raise NotImplementedError()
+
+    def decrypt(self, ciphertext, associated_data=None):
+        """Decrypt `ciphertext` or raise an exception if it cannot be
+        decrypted or authenticated.
+        """
+        raise NotImplementedError()
+
+    def key_ids(self):
+        """Return the ids of all keys this backend can decrypt with."""
+        raise NotImplementedError()
+
+    def ciphertext_length(self, size, associated_data=None):
+        """Return the length of the ciphertext :meth:`encrypt` returns for
+        `size` bytes of data, or `None` if the backend cannot tell without
+        encrypting.
+        """
+        return None
+
+    @property
+    def primary_key_id(self):
+        """The id of the key new ciphertexts are encrypted with."""
+        raise NotImplementedError()
+
+    def key_id(self, ciphertext):
+        """Return the id of the key `ciphertext` claims to be encrypted
+        with, without decrypting it.  Raises `ValueError` if the ciphertext
+        is too short.
+        """
+        header = b64decode(ciphertext[:8])
+        if len(header) < 1 + _KEY_HASH_SIZE:
+            raise ValueError('ciphertext too short')
+        return b64encode(header[1:1 + _KEY_HASH_SIZE])
+
+    def check(self, ciphertext):
+        """Check that `ciphertext` could have been produced with one of the
+        keys of this backend, without decrypting it, and return the key
+        id.  Raises :class:`InvalidCiphertext` if it is too short, not web
+        safe base64, has an unknown format byte or names an unknown key.
+        """
+        if len(ciphertext) < self.min_ciphertext_length or \
+           ciphertext.translate(None, _B64_ALPHABET):
+            raise InvalidCiphertext('malformed', 'not a ciphertext')
+        try:
+            header = b64decode(ciphertext[:8])
+        except TypeError:
+            raise InvalidCiphertext('malformed', 'not a ciphertext')
+        if len(header) < 1 + _KEY_HASH_SIZE or \
+           (self.formats and header[:1] not in self.formats):
+            raise InvalidCiphertext('malformed', 'unknown format')
+        key_id = b64encode(header[1:1 + _KEY_HASH_SIZE])
+        if not self.has_key_id(key_id):
+            raise InvalidCiphertext('unknown_key', 'unknown key %s' % key_id)
+        return key_id
+
+    def has_key_id(self, key_id):
+        """Return `False` if the backend has no key with the id `key_id`.
+        Backends that do not implement :meth:`key_ids` return `True`.
+        """
+        known = self.__dict__.get('_known_key_ids', False)
+        if known is False:
+            try:
+                known = frozenset(self.key_ids())
+            except NotImplementedError:
+                known = None
+            self._known_key_ids = known
+        return known is None or key_id in known
+
+
+class KeyczarBackend(CryptoBackend):
+    """Encrypts with a :class:`keyczar.Crypter` (AES-CBC and HMAC-SHA1).
+
+    keyczar cannot authenticate associated data, so it is put in front of
+    the plaintext and compared after decryption instead.
+
+    :param crypter_or_keys_location: a keyczar.Crypter instance or the
+        location of the keyczar keys.
+    """
+
+    formats = frozenset([KEYCZAR_FORMAT])
+
+    # header, IV, one AES block and the HMAC-SHA1 signature
+    min_ciphertext_length = _b64_length(1 + _KEY_HASH_SIZE + 16 + 16 + 20)
+
+    def __init__(self, crypter_or_keys_location):
+        if isinstance(crypter_or_keys_location, basestring):
+            crypter_or_keys_location = get_crypter(crypter_or_keys_location)
+        self.crypter = crypter_or_keys_location
+
+    def encrypt(self, data, associated_data=None):
+        if associated_data is not None:
+            if '\n' in associated_data:
+                raise ValueError('associated data must not contain newlines')
+            data = associated_data + '\n' + data
+        return self.crypter.Encrypt(data)
+
+    def ciphertext_length(self, size, associated_data=None):
+        if associated_data is not None:
+            size += len(associated_data) + 1
+        # header, IV, the PKCS#5 padded data and the HMAC-SHA1 signature
+        return _b64_length(1 + _KEY_HASH_SIZE + 16 + (size // 16 + 1) * 16 +
+                           20)
+
+    def decrypt(self, ciphertext, associated_data=None):
+        data = self.crypter.Decrypt(ciphertext)
+        if associated_data is not None:
+            prefix = associated_data + '\n'
+            if not data.startswith(prefix):
+                raise ValueError('associated data does not match')
+            data = data[len(prefix):]
+        return data
+
+    def key_ids(self):
+        return [self.crypter.GetKey(version).hash_id
+                for version in self.crypter.versions]
+
+    def has_key_id(self, key_id):
+        # keyczar indexes its keys by hash id too; computing the ids is
+        # slow and the backends wrapping a crypter are short lived
+        return key_id in self.crypter._keys
+
+    @property
+    def primary_key_id(self):
+        return self.crypter.primary_key.hash_id
+
+    def __eq__(self, other):
+        return isinstance(other, KeyczarBackend) and \
+            self.crypter is other.crypter
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.crypter)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.crypter)
+
+
+def _import_cryptography():
+    global AESGCM, ChaCha20Poly1305, HKDF, hashes, default_backend
+    if AESGCM is not None:
+        return
+    try:
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.ciphers.aead import (
+            AESGCM, ChaCha20Poly1305)
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    except ImportError:
+        raise RuntimeError('the cryptography package is not installed')
+
+
+def _derive_key(key, algorithm):
+    if algorithm == 'aes-gcm':
+        length = len(key.key_bytes)
+    else:
+        length = 32
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=length, salt=None,
+                info='flask-encryptedsession ' + algorithm,
+                backend=default_backend())
+    return hkdf.derive(key.key_bytes + key.hmac_key.key_bytes)
+
+
+class AEADBackend(CryptoBackend):
+    """Encrypts with AES-GCM or ChaCha20-Poly1305, using keys derived from
+    the AES keys of a keyczar keyset.  Output of the keyczar backend is
+    still decrypted.  Requires the `cryptography` package.
+
+    :param crypter_or_keys_location: a keyczar.Crypter instance or the
+        location of the keyczar keys.
+    :param algorithm: ``'aes-gcm'`` or ``'chacha20-poly1305'``.
+    """
+
+    formats = frozenset([KEYCZAR_FORMAT] + AEAD_FORMATS.values())
+
+    # header, nonce and tag
+    min_ciphertext_length = _b64_length(1 + _KEY_HASH_SIZE + _NONCE_SIZE + 16)
+
+    def __init__(self, crypter_or_keys_location, algorithm='aes-gcm'):
+        _import_cryptography()
+        if algorithm not in AEAD_FORMATS:
+            raise ValueError('unknown algorithm %r' % algorithm)
+        self.fallback = KeyczarBackend(crypter_or_keys_location)
+        self.crypter = self.fallback.crypter
+        self.algorithm = algorithm
+        self.format = AEAD_FORMATS[algorithm]
+        # maps (format byte, raw key hash) to the cipher
+        self._ciphers = {}
+        for version in self.crypter.versions:
+            key = self.crypter.GetKey(version)
+            key_hash = b64decode(key.hash_id)
+            self._ciphers[AEAD_FORMATS['aes-gcm'], key_hash] = \
+                AESGCM(_derive_key(key, 'aes-gcm'))
+            self._ciphers[AEAD_FORMATS['chacha20-poly1305'], key_hash] = \
+                ChaCha20Poly1305(_derive_key(key, 'chacha20-poly1305'))
+        primary = self.crypter.primary_key
+        self._primary_hash = b64decode(primary.hash_id)
+        self._primary = self._ciphers[self.format, self._primary_hash]
+
+    def encrypt(self, data, associated_data=None):
+        nonce = os.urandom(_NONCE_SIZE)
+        return b64encode(
+            self.format + self._primary_hash + nonce +
+            self._primary.encrypt(nonce, data, associated_data))
+
+    def ciphertext_length(self, size, associated_data=None):
+        # header, nonce, the data and the tag
+        return _b64_length(1 + _KEY_HASH_SIZE + _NONCE_SIZE + size + 16)
+
+    def decrypt(self, ciphertext, associated_data=None):
+        raw = b64decode(ciphertext)
+        cipher = self._ciphers.get((raw[:1], raw[1:1 + _KEY_HASH_SIZE]))
+        if cipher is None:
+            if raw[:1] == KEYCZAR_FORMAT:
+                return self.fallback.decrypt(ciphertext, associated_data)
+            raise ValueError('unknown format or key')
+        start = 1 + _KEY_HASH_SIZE
+        return cipher.decrypt(raw[start:start + _NONCE_SIZE],
+                              raw[start + _NONCE_SIZE:], associated_data)
+
+    def key_ids(self):
+        return self.fallback.key_ids()
+
+    @property
+    def primary_key_id(self):
+        return self.fallback.primary_key_id
+
+    def __repr__(self):
+        return '<%s %s %r>' % (self.__class__.__name__, self.algorithm,
+                               self.crypter)
+
+
+class KeyRing(CryptoBackend):
+    """Decrypts with any of several backends and encrypts with the first.
+
+    The backends are indexed by the ids of their keys, so decrypting looks
+    up the right backend by the key id in the ciphertext instead of trying
+    them one after the other.  If two backends know the same key the
+    earlier one wins.
+
+    :param backends: an ordered list of backends, keyczar.Crypter instances
+        or keys locations, primary first.
+    """
+
+    def __init__(self, backends):
+        self.backends = [get_backend(backend) for backend in backends]
+        if not self.backends:
+            raise ValueError('a key ring needs at least one backend')
+        self._index = {}
+        for backend in self.backends:
+            for key_id in backend.key_ids():
+                self._index.setdefault(key_id, backend)
+        if all(backend.formats for backend in self.backends):
+            self.formats = frozenset().union(
+                *[backend.formats for backend in self.backends])
+        self.min_ciphertext_length = min(
+            backend.min_ciphertext_length for backend in self.backends)
+
+    def encrypt(self, data, associated_data=None):
+        return self.backends[0].encrypt(data, associated_data)
+
+    def ciphertext_length(self, size, associated_data=None):
+        return self.backends[0].ciphertext_length(size, associated_data)
+
+    def decrypt(self, ciphertext, associated_data=None):
+        backend = self._index.get(self.key_id(ciphertext))
+        if backend is None:
+            raise ValueError('ciphertext was encrypted with an unknown key')
+        return backend.decrypt(ciphertext, associated_data)
+
+    def key_ids(self):
+        return list(self._index)
+
+    def has_key_id(self, key_id):
+        return key_id in self._index
+
+    @property
+    def primary_key_id(self):
+        return self.backends[0].primary_key_id
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.backends)
+
+
+def get_backend(crypter_or_keys_location):
+    """Return a backend for a backend instance, a keyczar.Crypter instance
+    or the location of keyczar keys.  Lists and tuples of those become a
+    :class:`KeyRing`.  `None` is passed through.
+    """
+    if crypter_or_keys_location is None or \
+       isinstance(crypter_or_keys_location, CryptoBackend):
+        return crypter_or_keys_location
+    if isinstance(crypter_or_keys_location, (list, tuple)):
+        return KeyRing(crypter_or_keys_location)
+    return KeyczarBackend(crypter_or_keys_location)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.batch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Decodes and encodes many cookies at once, for example to analyse the
+    session cookies found in access logs.
+
+    :func:`decode_cookies` takes any iterable of cookie values and yields
+    one :class:`DecodeResult` per value, in order.  With more than one
+    process the work is spread over a :class:`multiprocessing.Pool` in
+    chunks; every worker reads the keys once and reuses them::
+
+        from flask_encryptedsession.batch import decode_cookies
+
+        with open('cookies.txt') as f:
+            for result in decode_cookies(f, "/tmp/keys", processes=4):
+                if result.ok:
+                    print result.session.get('user_id')
+                else:
+                    print 'line %d: %s' % (result.index + 1, result.error)
+
+    The same is available from the command line, reading one cookie per
+    line and writing JSON lines::
+
+        $ flask-encryptedsession-batch decode --keys /tmp/keys -j 4 \\
+            cookies.txt > sessions.jsonl
+
+    ``encode`` does the opposite and turns JSON objects into cookies.
+    Every input line has one output line at the same position: blank
+    lines are decoded into an ``empty`` error and encoded into an empty
+    line, and lines that cannot be encoded are reported on standard error
+    with their line number and leave an empty line as well.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import optparse
+import sys
+from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+
+
+class DecodeResult(object):
+    """The outcome of decoding one cookie.
+
+    :param index: the position of the cookie in the input.
+    :param session: the decoded items, or `None` if the cookie was
+                    rejected.
+    :param error: why the cookie was rejected, see
+                  :data:`~flask_encryptedsession.signals.cookie_rejected`,
+                  or ``'empty'`` for a blank value.  Unexpected exceptions
+                  are reported as ``'error: ...'``.
+    """
+
+    __slots__ = ('index', 'session', 'error', 'expires', 'key_id')
+
+    def __init__(self, index, session=None, error=None, expires=None,
+                 key_id=None):
+        self.index = index
+        self.session = session
+        self.error = error
+        self.expires = expires
+        self.key_id = key_id
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_json(self):
+        """Return the result as a dict that :func:`json.dumps` accepts."""
+        if not self.ok:
+            return {'index': self.index, 'ok': False, 'error': self.error}
+        return {'index': self.index, 'ok': True,
+                'session': _jsonable(self.session),
+                'expires': self.expires, 'key_id': self.key_id}
+
+    def __reduce__(self):
+        return (DecodeResult, (self.index, self.session, self.error,
+                               self.expires, self.key_id))
+
+    def __repr__(self):
+        if not self.ok:
+            return '<%s %d %s>' % (self.__class__.__name__, self.index,
+                                   self.error)
+        return '<%s %d %r>' % (self.__class__.__name__, self.index,
+                               self.session)
+
+
+class EncodeResult(object):
+    """The outcome of encoding one session.
+
+    :param index: the position of the session in the input.
+    :param cookie: the cookie value, or `None` if the session could not
+                   be encoded.
+    :param error: why the session could not be encoded, as
+                  ``'error: ...'``, or ``'empty'`` for a blank string.
+    """
+
+    __slots__ = ('index', 'cookie', 'error')
+
+    def __init__(self, index, cookie=None, error=None):
+        self.index = index
+        self.cookie = cookie
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_json(self):
+        """Return the result as a dict that :func:`json.dumps` accepts."""
+        if not self.ok:
+            return {'index': self.index, 'ok': False, 'error': self.error}
+        return {'index': self.index, 'ok': True, 'cookie': self.cookie}
+
+    def __reduce__(self):
+        return (EncodeResult, (self.index, self.cookie, self.error))
+
+    def __repr__(self):
+        return '<%s %d %s>' % (self.__class__.__name__, self.index,
+                               self.ok and 'ok' or self.error)
+
+
+def _jsonable(obj):
+    if isinstance(obj, str):
+        return obj.decode('utf-8', 'replace')
+    if isinstance(obj, dict):
+        return dict((_jsonable(key), _jsonable(value))
+                    for key, value in obj.iteritems())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_jsonable(item) for item in obj]
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if obj is None or isinstance(obj, (unicode, int, long, float, bool)):
+        return obj
+    return repr(obj)
+
+
+# the state of a worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(keys, cookie_class):
+    _worker['crypter'] = cookie_class._get_crypter(keys)
+    _worker['cookie_class'] = cookie_class
+
+
+def _decode(job):
+    index, value = job
+    cookie_class = _worker['cookie_class']
+    try:
+        value = value.strip()
+        if not value:
+            return DecodeResult(index, error='empty')
+        if isinstance(value, unicode):
+            value = value.encode('utf-8', 'replace')
+        items, _, expires, key_id, _, reason = cookie_class._load_items(
+            value, _worker['crypter'])
+    except Exception, e:
+        return DecodeResult(index, error='error: %s' % e)
+    if reason is not None:
+        return DecodeResult(index, error=reason)
+    return DecodeResult(index, dict(items), None, expires, key_id)
+
+
+def _encode(job):
+    index, data = job
+    try:
+        if isinstance(data, basestring):
+            if not data.strip():
+                return EncodeResult(index, error='empty')
+            data = json.loads(data)
+        if not isinstance(data, dict):
+            raise TypeError('expected an object, got %s'
+                            % type(data).__name__)
+        cookie = _worker['cookie_class'](data, _worker['crypter'])
+        return EncodeResult(index, cookie.serialize())
+    except Exception, e:
+        return EncodeResult(index, error='error: %s' % e)
+
+
+def _run(func, iterable, keys, processes, chunksize, cookie_class):
+    jobs = enumerate(iterable)
+    if processes is None:
+        processes = cpu_count()
+    if processes <= 1:
+        _init_worker(keys, cookie_class)
+        for job in jobs:
+            yield func(job)
+        return
+    pool = Pool(processes, _init_worker, (keys, cookie_class))
+    try:
+        # hand out bounded batches so huge inputs are not read into memory
+        # all at once, which Pool.imap would do
+        batch_size = chunksize * processes * 4
+        while True:
+            batch = list(islice(jobs, batch_size))
+            if not batch:
+                break
+            for result in pool.imap(func, batch, chunksize):
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def decode_cookies(cookies, keys, processes=1, chunksize=256,
+                   cookie_class=EncryptedCookie):
+    """Decode the cookie values in the iterable `cookies` and yield a
+    :class:`DecodeResult` for each, in the order of the input.
+
+    :param keys: the keys location, a keyczar.Crypter instance, a backend
+                 or a list of those.
+    :param processes: the number of worker processes.  `None` uses one per
+                      CPU, ``1`` decodes in the calling process.
+    :param chunksize: the number of cookies handed to a worker at once.
+    :param cookie_class: the cookie class whose settings (such as
+                         :attr:`~EncryptedCookie.max_payload_size`) apply.
+    """
+    return _run(_decode, cookies, keys, processes, chunksize, cookie_class)
+
+
+def encode_cookies(sessions, keys, processes=1, chunksize=256,
+                   cookie_class=EncryptedCookie):
+    """Encrypt every dict, or string with a JSON object, in the iterable
+    `sessions` and yield an :class:`EncodeResult` for each, in order.  The
+    parameters are the same as for :func:`decode_cookies`.
+    """
+    return _run(_encode, sessions, keys, processes, chunksize, cookie_class)
+
+
+def main(argv=None):
+    """The ``flask-encryptedsession-batch`` command."""
+    parser = optparse.OptionParser(
+        usage='%prog decode|encode --keys LOCATION [options] [FILE]',
+        description='Decode cookies (one per line) into JSON lines, or '
+                    'encode JSON lines into cookies.  Reads standard input '
+                    'if no file is given.')
+    parser.add_option('-k', '--keys', action='append',
+                      help='the keyczar keys location, may be given '
+                           'repeatedly to try several keysets')
+    parser.add_option('-j', '--processes', type='int', default=None,
+                      help='worker processes (default: one per CPU)')
+    parser.add_option('--chunksize', type='int', default=256,
+                      help='items per worker job (default: %default)')
+    options, args = parser.parse_args(argv)
+    if not args or args[0] not in ('decode', 'encode') or len(args) > 2:
+        parser.error('expected decode or encode and at most one file')
+    if not options.keys:
+        parser.error('--keys is required')
+    keys = options.keys
+    if len(keys) == 1:
+        keys = keys[0]
+    input = len(args) == 2 and open(args[1]) or sys.stdin
+
+    try:
+        if args[0] == 'decode':
+            for result in decode_cookies(input, keys, options.processes,
+                                         options.chunksize):
+                sys.stdout.write(json.dumps(result.to_json()) + '\n')
+        else:
+            for result in encode_cookies(input, keys, options.processes,
+                                         options.chunksize):
+                if result.ok:
+                    sys.stdout.write(result.cookie + '\n')
+                    continue
+                sys.stdout.write('\n')
+                if result.error != 'empty':
+                    sys.stderr.write('line %d: %s\n' % (result.index + 1,
+                                                         result.error))
+    finally:
+        if input is not sys.stdin:
+            input.close()
+
+
+if __name__ == '__main__':
+    main()
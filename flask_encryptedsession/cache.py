@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    An in-process cache of decrypted cookies.
+
+    Browsers send back exactly the cookie they were given until the session
+    changes, so most requests decrypt a value that was already decrypted a
+    moment ago.  :class:`DecryptCache` maps a digest of the cookie string to
+    the items that were decoded from it, which lets
+    :meth:`~flask_encryptedsession.encryptedcookie.EncryptedCookie.unserialize`
+    skip the decryption and deserialization on a hit::
+
+        from flask_encryptedsession.cache import DecryptCache
+
+        cache = DecryptCache(max_entries=10000, max_bytes=8 * 1024 * 1024,
+                             ttl=300)
+        app.session_interface = EncryptedCookieSessionInterface(
+            "/tmp/keys", decrypt_cache=cache)
+
+    The cache is bounded by number of entries and by an estimate of the
+    memory it holds.  The least recently used entries are evicted first and
+    entries older than `ttl` seconds are never returned.
+
+    :class:`NegativeCache` does the opposite and remembers cookies that
+    failed to decrypt or deserialize, so a client that sends the same
+    forged or stale cookie again and again only costs a lookup::
+
+        app.session_interface = EncryptedCookieSessionInterface(
+            "/tmp/keys", negative_cache=NegativeCache(max_entries=10000))
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+from datetime import datetime
+from hashlib import sha256
+from threading import Lock
+from time import time
+
+from flask_encryptedsession.stats import Counters
+
+
+#: Types whose instances can be shared between sessions without copying.
+_IMMUTABLE_TYPES = (str, unicode, int, long, float, bool, datetime,
+                    type(None))
+
+#: Rough per-entry overhead in bytes of the bookkeeping around an entry.
+_ENTRY_OVERHEAD = 200
+
+
+def _is_immutable(value):
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return True
+    if isinstance(value, (tuple, frozenset)):
+        for item in value:
+            if not _is_immutable(item):
+                return False
+        return True
+    return False
+
+
+class _LinkedDict(object):
+    """The part of :class:`collections.OrderedDict`, which needs Python
+    2.7, that the caches use: a dict that remembers the order keys were
+    inserted in and pops the oldest item first.
+    """
+
+    def __init__(self):
+        self._map = {}
+        # a circular doubly linked list of [prev, next, key, value] links
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def get(self, key, default=None):
+        link = self._map.get(key)
+        if link is None:
+            return default
+        return link[3]
+
+    def __getitem__(self, key):
+        return self._map[key][3]
+
+    def __setitem__(self, key, value):
+        link = self._map.get(key)
+        if link is not None:
+            link[3] = value
+            return
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = self._map[key] = [last, root, key, value]
+
+    def pop(self, key, default=None):
+        link = self._map.pop(key, None)
+        if link is None:
+            return default
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        return link[3]
+
+    def popitem(self):
+        """Remove and return the oldest ``(key, value)`` pair."""
+        link = self._root[1]
+        if link is self._root:
+            raise KeyError('dictionary is empty')
+        self.pop(link[2])
+        return link[2], link[3]
+
+    def values(self):
+        """Return the values, oldest first."""
+        values = []
+        root = self._root
+        link = root[1]
+        while link is not root:
+            values.append(link[3])
+            link = link[1]
+        return values
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+
+class _Entry(object):
+    __slots__ = ('crypter', 'items', 'data', 'digest', 'expires', 'stored',
+                 'size')
+
+    def __init__(self, crypter, items, data, digest, expires, stored, size):
+        self.crypter = crypter
+        self.items = items
+        self.data = data
+        self.digest = digest
+        self.expires = expires
+        self.stored = stored
+        self.size = size
+
+
+class DecryptCache(object):
+    """A bounded LRU cache of decrypted cookies keyed by a digest of the
+    cookie string.
+
+    Entries remember the crypter that decrypted them and are only returned
+    for the very same crypter, so a cookie is never accepted by a cache
+    that was filled using a different key set.
+
+    :param max_entries: the maximum number of cookies to remember.
+    :param max_bytes: the maximum estimated size of all entries in bytes.
+    :param ttl: the number of seconds an entry stays valid.  `None`
+                disables the time based expiration.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = Counters()
+        self._entries = _LinkedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(string):
+        return sha256(string).digest()
+
+    def get(self, string, crypter):
+        """Look up the decrypted value of the cookie `string`.
+
+        Returns a tuple ``(items, data, digest, expires)`` or `None` on a
+        miss.  If `data` is not `None` the items contain mutable values and
+        the caller has to rebuild them from the decrypted `data` instead of
+        copying `items`.
+        """
+        key = self._key(string)
+        now = time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry.crypter != crypter:
+                if entry is not None:
+                    self._size -= entry.size
+                self.stats.incr('misses')
+                return None
+            if (entry.expires is not None and now > entry.expires) or \
+               (self.ttl is not None and now - entry.stored > self.ttl):
+                self._size -= entry.size
+                self.stats.incr('expired')
+                self.stats.incr('misses')
+                return None
+            # re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.stats.incr('hits')
+            return entry.items, entry.data, entry.digest, entry.expires
+
+    def set(self, string, crypter, items, data, expires=None, digest=None):
+        """Remember that the cookie `string` decrypted to `data` which was
+        deserialized into `items`.
+
+        :param expires: the unix timestamp the cookie expires at, if any.
+        :param digest: the digest of `data`, returned on hits.
+        """
+        immutable = True
+        for value in items.itervalues():
+            if not _is_immutable(value):
+                immutable = False
+                break
+        size = len(string) + len(data) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        entry = _Entry(crypter, dict(items), None if immutable else data,
+                       digest, expires, time(), size)
+        key = self._key(string)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += size
+            while len(self._entries) > self.max_entries or \
+                    self._size > self.max_bytes:
+                _, evicted = self._entries.popitem()
+                self._size -= evicted.size
+                self.stats.incr('evictions')
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """The estimated number of bytes held by the cache."""
+        return self._size
+
+
+class NegativeCache(object):
+    """A bounded cache of the digests of cookie values that were rejected
+    and the reason why.
+
+    Only rejections that needed crypto to find out are worth caching; the
+    cookie classes add values that failed to decrypt or deserialize.
+
+    :param max_entries: the maximum number of values to remember.  The
+                        oldest are forgotten first.
+    :param ttl: the number of seconds an entry stays valid.  `None`
+                disables the time based expiration.
+    """
+
+    def __init__(self, max_entries=4096, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = Counters()
+        self._entries = _LinkedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(string):
+        return sha256(string).digest()
+
+    def get(self, string):
+        """Return the reason the cookie value `string` was rejected for, or
+        `None` if it is not in the cache.
+        """
+        entry = self._entries.get(self._key(string))
+        if entry is None:
+            self.stats.incr('misses')
+            return None
+        reason, stored = entry
+        if self.ttl is not None and time() - stored > self.ttl:
+            self.stats.incr('misses')
+            return None
+        self.stats.incr('hits')
+        return reason
+
+    def add(self, string, reason):
+        """Remember that the cookie value `string` was rejected."""
+        key = self._key(string)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (reason, time())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem()
+                self.stats.incr('evictions')
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -31,6 +31,58 @@ r"""
     If a bad key is provided, the unserialize method will fail silently and
     return a new empty `EncryptedCookie` object.
 
+    Cookie format
+    =============
+
+    The cookie value is a cleartext header and the ciphertext separated by
+    dots::
+
+        1.<expires>.<ciphertext>
+
+    The first field is the format version and the second the unix time the
+    cookie expires at (empty for cookies without expiration).  Expired
+    cookies are rejected by comparing that number, without decrypting
+    anything.  The header is passed to the crypto backend as associated
+    data, so a cookie whose header was tampered with does not decrypt.
+
+    The ciphertext starts with the id of the key it was encrypted with.
+    Cookies encrypted with a key other than the primary key of the backend
+    are saved again on the next response, so they move to the primary key
+    over time (see :attr:`EncryptedCookie.stale_key`).
+
+    Cookie classes with :attr:`~EncryptedCookie.session_ids` enabled write
+    a second format that adds a random session id to the header, so that
+    the session can be revoked (see
+    :mod:`~flask_encryptedsession.revocation`)::
+
+        2.<expires>.<session id>.<ciphertext>
+
+    Values without dots were written by older versions, which stored the
+    expiration in the encrypted data.  They are still accepted.
+
+    Values longer than :attr:`EncryptedCookie.max_cookie_size` are split
+    over several cookies because browsers drop cookies of more than about
+    4KB.  The cookie itself then holds a manifest with the number of
+    chunks and a digest of the complete value, and the chunks are stored
+    in the cookies ``<key>.0``, ``<key>.1`` and so on::
+
+        c<chunks>.<digest>
+
+    :meth:`EncryptedCookie.load_cookie` joins the chunks and rejects them if
+    they do not match the manifest.
+
+    Size budget
+    ===========
+
+    Cookie classes with a :attr:`~EncryptedCookie.size_budget` check the
+    length of the encrypted value before it is set.  Most backends can
+    tell the length from the size of the payload, so nothing is encrypted
+    more than once.  A cookie over the budget loses its
+    :attr:`~EncryptedCookie.evictable_keys` one by one, and if that is not
+    enough the :attr:`~EncryptedCookie.budget_action` is taken.
+    :meth:`EncryptedCookie.key_sizes` tells which keys make a session
+    large.
+
     Application Integration
     =======================
 
@@ -84,18 +136,166 @@ r"""
 
     :license: BSD, see LICENSE for more details.
 """
+import logging
+import os
+from hashlib import sha1, sha256
 from time import time
 
-from keyczar import keyczar
 from werkzeug._internal import _date_to_unix
 from werkzeug.contrib.securecookie import SecureCookie
 from werkzeug.contrib.sessions import ModificationTrackingDict
 
+from flask_encryptedsession.backends import (
+    InvalidCiphertext, b64encode, get_backend)
+from flask_encryptedsession.serializers import (
+    DEFAULT_MAX_SIZE, PickleSerializer, compress_payload, dump_payload,
+    load_payload)
+from flask_encryptedsession.signals import (
+    cookie_encrypted, cookie_loaded, cookie_oversized, cookie_rejected)
+
+
+#: the version of the cookie format written by :meth:`EncryptedCookie.serialize`.
+FORMAT_VERSION = '1'
+
+#: the version of the cookie format that carries a session id.
+SESSION_ID_FORMAT_VERSION = '2'
+
+#: the first character of the manifest of a cookie split into chunks.
+CHUNKED_MARKER = 'c'
+
+#: the key under which the payload lists the values that were spilled to
+#: a :class:`~flask_encryptedsession.stores.SessionStore`.
+SPILLED_KEY = '_spilled'
+
+
+class _NullHandler(logging.Handler):
+    # logging.NullHandler is new in Python 2.7
+
+    def emit(self, record):
+        pass
+
+logger = logging.getLogger('flask_encryptedsession')
+logger.addHandler(_NullHandler())
+
 
 class UnquoteError(Exception):
     """Internal exception used to signal failures on quoting."""
 
 
+class CookieTooLarge(ValueError):
+    """Raised when a cookie exceeds its
+    :attr:`~EncryptedCookie.size_budget` even after evicting keys.
+    `key_sizes` is the result of :meth:`EncryptedCookie.key_sizes`.
+    """
+
+    def __init__(self, size, budget, key_sizes):
+        ValueError.__init__(self, 'the cookie is %d bytes, more than the '
+                            'budget of %d bytes; largest keys: %s' % (
+                                size, budget, ', '.join(
+                                    '%s (%d)' % item
+                                    for item in key_sizes[:5])))
+        self.size = size
+        self.budget = budget
+        self.key_sizes = key_sizes
+
+
+def _make_header(expires, session_id=None):
+    if session_id is not None:
+        return '%s.%s.%s' % (SESSION_ID_FORMAT_VERSION,
+                             '' if expires is None else '%d' % expires,
+                             session_id)
+    if expires is None:
+        return FORMAT_VERSION + '.'
+    return '%s.%d' % (FORMAT_VERSION, expires)
+
+
+def _new_session_id():
+    return b64encode(os.urandom(16))
+
+
+def _chunk_digest(value):
+    return b64encode(sha1(value).digest()[:9])
+
+
+def _spill_digest(data):
+    return b64encode(sha256(data).digest())
+
+
+def _make_manifest(value, count):
+    return '%s%d.%s' % (CHUNKED_MARKER, count, _chunk_digest(value))
+
+
+def _join_chunks(cookies, key, manifest, max_chunks):
+    """Join the chunks described by `manifest`.  Returns the value and the
+    list of chunks, or `None` and the chunks found if the chunks are missing
+    or do not match the manifest.
+    """
+    count, _, digest = manifest[1:].partition('.')
+    try:
+        count = int(count)
+    except ValueError:
+        return None, []
+    if not 0 < count <= max_chunks:
+        return None, []
+    chunks = []
+    for index in xrange(count):
+        chunk = cookies.get('%s.%d' % (key, index))
+        if chunk is None:
+            return None, chunks
+        chunks.append(chunk)
+    value = ''.join(chunks)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8', 'replace')
+    if _chunk_digest(value) != digest:
+        return None, chunks
+    return value, chunks
+
+
+class SpilledValue(object):
+    """Stands in for a session value that was spilled to the
+    :attr:`~SpillingCookieMixin.spill_store` and was not fetched yet.
+    """
+
+    __slots__ = ('ref', 'version', 'digest')
+
+    def __init__(self, ref, version, digest):
+        self.ref = ref
+        self.version = version
+        #: the digest of the stored bytes, checked before they are loaded.
+        self.digest = digest
+
+    @property
+    def store_key(self):
+        """The key of the value in the store."""
+        return '%s.%d' % (self.ref, self.version)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.store_key)
+
+
+def _split_cookie(string):
+    """Split a cookie value into ``(header, expires, session_id,
+    ciphertext)``.  The header is `None` for cookies in the old format and
+    the session id for cookies without one.  Raises `ValueError` if the
+    header is malformed.
+    """
+    if '.' not in string:
+        return None, None, None, string
+    version, expires, ciphertext = string.split('.', 2)
+    if version == FORMAT_VERSION:
+        session_id = None
+    elif version == SESSION_ID_FORMAT_VERSION:
+        session_id, _, ciphertext = ciphertext.partition('.')
+        if not session_id or not ciphertext:
+            raise ValueError('cookie without session id')
+    else:
+        raise ValueError('unknown cookie format %r' % version)
+    header = string[:len(string) - len(ciphertext) - 1]
+    if not expires:
+        return header, None, session_id, ciphertext
+    return header, int(expires), session_id, ciphertext
+
+
 class EncryptedCookie(SecureCookie):
     """Represents an encrypted cookie.
 
@@ -117,20 +317,170 @@ class EncryptedCookie(SecureCookie):
     :param new: The initial value of the `new` flag.
     """
 
+    #: the :class:`~flask_encryptedsession.serializers.Serializer` used to
+    #: dump the cookie data.  Cookies are always loaded with the serializer
+    #: recorded in their payload, so this can be changed at any time.
+    serializer = PickleSerializer()
+
+    #: if cookies written before payloads were tagged should still be
+    #: loaded with :attr:`serialization_method` (pickle).  Set this to
+    #: `False` once all old cookies have expired.
+    accept_legacy_pickle = True
+
+    #: payloads of at least this many bytes are compressed before they are
+    #: encrypted.  `None` disables compression.
+    compress_threshold = None
+
+    #: the zlib compression level between 1 (fastest) and 9 (smallest).
+    compress_level = 6
+
+    #: compressed payloads that inflate to more than this many bytes are
+    #: rejected, which protects against decompression bombs.
+    max_payload_size = DEFAULT_MAX_SIZE
+
+    #: cookie values longer than this many bytes are split into several
+    #: cookies.  `None` never splits.
+    max_cookie_size = 3800
+
+    #: the largest number of chunks a cookie may be split into.
+    max_chunks = 10
+
+    #: cookie values longer than this many bytes (after joining chunks)
+    #: are rejected without decrypting them.
+    max_value_size = 64 * 1024
+
+    #: a :class:`~flask_encryptedsession.cache.NegativeCache` of cookie
+    #: values that failed to decrypt or deserialize.  They are rejected
+    #: again without any crypto.
+    negative_cache = None
+
+    #: give every cookie a random :attr:`session_id` that is kept for as
+    #: long as the session lives and written to the cleartext header.
+    session_ids = False
+
+    #: a :class:`~flask_encryptedsession.revocation.RevocationList`.
+    #: Cookies whose session id was revoked are rejected before they are
+    #: decrypted.
+    revocation_list = None
+
+    #: the largest encrypted cookie value, in bytes, :meth:`save_cookie`
+    #: sets.  Chunking (see :attr:`max_cookie_size`) applies afterwards.
+    #: `None` disables the check.
+    size_budget = None
+
+    #: the keys of values that can be recomputed, such as cached lookups,
+    #: in the order they are removed from a cookie over the
+    #: :attr:`size_budget`.
+    evictable_keys = ()
+
+    #: what happens if a cookie is still over the :attr:`size_budget`
+    #: after evicting keys: ``'log'`` logs a warning and sets the cookie
+    #: anyway, ``'raise'`` raises :exc:`CookieTooLarge`.
+    budget_action = 'log'
+
     def __init__(self, data=None, crypter_or_keys_location=None, new=True):
         ModificationTrackingDict.__init__(self, data or ())
         self.crypter = self._get_crypter(crypter_or_keys_location)
         self.new = new
+        #: the size of the serialized payload and of what was encrypted
+        #: after compression, set by :meth:`serialize`.
+        self.payload_sizes = None
+        #: a digest of the payload the cookie was loaded from.  Saving a
+        #: cookie whose payload did not change is skipped.
+        self.payload_digest = None
+        #: the unix timestamp the loaded cookie expires at, if any.
+        self.expires_at = None
+        #: the id of the key the loaded cookie was encrypted with.
+        self.key_id = None
+        #: the session id of the cookie, see :attr:`session_ids`.  New
+        #: cookies get one when they are first serialized.
+        self.session_id = None
+        #: why the cookie value was rejected, if it was.  See
+        #: :data:`~flask_encryptedsession.signals.cookie_rejected`.
+        self.rejected_reason = None
+        #: a dict that durations in seconds are recorded in, or `None` if
+        #: the cookie is not timed.
+        self.timings = None
+        #: the chunks the cookie was loaded from, if it was split.
+        self.loaded_chunks = []
+        #: the length of the encrypted value set by the last
+        #: :meth:`save_cookie`, before it was split into chunks.
+        self.cookie_size = None
+        #: the keys removed by the last :meth:`save_cookie` to fit the
+        #: :attr:`size_budget`.
+        self.evicted_keys = []
+
+    @property
+    def stale_key(self):
+        """`True` if the cookie was encrypted with a key that is not the
+        primary key any more and should be encrypted again.
+        """
+        return self.key_id is not None and \
+            self.key_id != self.crypter.primary_key_id
+
+    @property
+    def should_save(self):
+        """True if the session should be saved.  That is the case if it
+        was modified or encrypted with a key that is not primary any more.
+        """
+        return self.modified or self.stale_key
 
     @staticmethod
     def _get_crypter(crypter_or_keys_location):
         """
-        :param crypter_or_keys_location: may be None, a string, or a
-            keyczar.Crypter instance.
+        :param crypter_or_keys_location: may be None, a string, a
+            keyczar.Crypter instance or a
+            :class:`~flask_encryptedsession.backends.CryptoBackend`.  Strings
+            are looked up in the process-wide
+            :mod:`~flask_encryptedsession.keys` registry so the keys are only
+            read from disk once.
+        :return: the crypto backend, or `None`.
+        """
+        return get_backend(crypter_or_keys_location)
+
+    @classmethod
+    def _loads(cls, data):
+        legacy = cls.accept_legacy_pickle and cls.serialization_method or None
+        return load_payload(data, legacy, cls.max_payload_size,
+                            cls.serializer)
+
+    def _dumps(self):
+        timings = self.timings
+        if timings is not None:
+            start = time()
+        result = dump_payload(self.serializer, self._payload_items())
+        self.payload_sizes = (len(result), len(result))
+        if self.compress_threshold is not None and \
+           len(result) >= self.compress_threshold:
+            result = compress_payload(result, self.compress_level)
+            self.payload_sizes = (self.payload_sizes[0], len(result))
+        if timings is not None:
+            timings['serialize'] = time() - start
+        return result
+
+    def _payload_items(self):
+        """Return the dict that is serialized into the payload."""
+        return dict(self)
+
+    @classmethod
+    def _postprocess_items(cls, items):
+        """Return the items a cookie is created with from the `items` of a
+        loaded payload.  Raising an exception rejects the cookie as
+        ``deserialize``.
         """
-        if isinstance(crypter_or_keys_location, basestring):
-            return keyczar.Crypter.Read(crypter_or_keys_location)
-        return crypter_or_keys_location
+        return items
+
+    def key_sizes(self):
+        """Return a list of ``(key, bytes)`` with the number of bytes every
+        key adds to the serialized payload, before compression, largest
+        first.
+        """
+        serializer = self.serializer
+        base = len(serializer.dumps({}))
+        sizes = [(key, len(serializer.dumps({key: value})) - base)
+                 for key, value in self.iteritems()]
+        sizes.sort(key=lambda item: item[1], reverse=True)
+        return sizes
 
     def serialize(self, expires=None):
         """Serialize the cookie into a string and encrypt.
@@ -142,42 +492,146 @@ class EncryptedCookie(SecureCookie):
         :param expires: an optional expiration date for the cookie (a
                         :class:`datetime.datetime` object)
         """
-        if expires:
-            self['_expires'] = _date_to_unix(expires)
-        result = self.serialization_method.dumps(dict(self))
-        return self.crypter.Encrypt(result)
+        return self._encrypt(self._dumps(), expires)
+
+    def _header(self, expires=None):
+        session_id = self.session_id
+        if session_id is None and self.session_ids:
+            session_id = self.session_id = _new_session_id()
+        return _make_header(expires and _date_to_unix(expires) or None,
+                            session_id)
+
+    def _encrypt(self, payload, expires=None):
+        header = self._header(expires)
+        timings = self.timings
+        if timings is None:
+            return header + '.' + self.crypter.encrypt(payload, header)
+        start = time()
+        rv = header + '.' + self.crypter.encrypt(payload, header)
+        timings['encrypt'] = time() - start
+        cookie_encrypted.send(self, cookie_size=len(rv),
+                              payload_size=len(payload), timings=timings)
+        return rv
 
     @classmethod
-    def unserialize(cls, string, crypter_or_keys_location):
+    def unserialize(cls, string, crypter_or_keys_location, cache=None,
+                    timings=None):
         """Decrypt and load the cookie from a serialized string.
 
         :param string: the cookie value to decrypt and deserialize.
         :param crypter_or_keys_location: the Crypter instance or the location
             of the keyczar keys
+        :param cache: an optional
+            :class:`~flask_encryptedsession.cache.DecryptCache` that is
+            consulted before decrypting.
+        :param timings: an optional dict to record durations in, which
+            becomes the :attr:`timings` of the cookie.
         :return: a new :class:`EncryptedCookie`.
         """
         if isinstance(string, unicode):
             string = string.encode('utf-8', 'replace')
-
         crypter = cls._get_crypter(crypter_or_keys_location)
+        items, digest, expires, key_id, session_id, reason = \
+            cls._load_items(string, crypter, cache, timings)
+        rv = cls(items, crypter, False)
+        rv.payload_digest = digest
+        rv.expires_at = expires
+        rv.key_id = key_id
+        rv.session_id = session_id
+        rv.rejected_reason = reason
+        rv.timings = timings
+        return rv
+
+    @classmethod
+    def _reject(cls, reason, string=None):
+        """Report the rejection and return the result of
+        :meth:`_load_items` for it.  Pass the cookie value as `string` to
+        add it to the :attr:`negative_cache`.
+        """
+        if string is not None and cls.negative_cache is not None:
+            cls.negative_cache.add(string, reason)
+        cookie_rejected.send(cls, reason=reason)
+        return (), None, None, None, None, reason
+
+    @classmethod
+    def _load_items(cls, string, crypter, cache=None, timings=None):
+        """Decrypt and deserialize the cookie value `string`.  Returns the
+        items stored in it, the digest of the payload, the expiration
+        timestamp, the id of the key, the session id and `None`, or ``((),
+        None, None, None, None, reason)`` if the cookie is invalid, expired
+        or revoked.
+
+        Everything that can be rejected without crypto is rejected first:
+        values that are too long or structurally invalid, expired or
+        revoked cookies and, with a :attr:`negative_cache`, values that were
+        rejected before.
+        """
+        if len(string) > cls.max_value_size:
+            return cls._reject('malformed')
         try:
-            data = crypter.Decrypt(string)
-        except:
-            # if decryption fails, return new empty EncryptedCookie object
-            items = ()
-        else:
-            items = cls.serialization_method.loads(data)
-            # check if cookie is expired
-            if '_expires' in items:
-                if time() > items['_expires']:
-                    items = ()
-                else:
-                    del items['_expires']
+            header, expires, session_id, ciphertext = _split_cookie(string)
+        except ValueError:
+            return cls._reject('malformed')
+        now = time()
+        # expired cookies are rejected before anything is decrypted
+        if expires is not None and now > expires:
+            return cls._reject('expired')
+        try:
+            key_id = crypter.check(ciphertext)
+        except InvalidCiphertext, e:
+            return cls._reject(e.reason)
+        except Exception:
+            return cls._reject('malformed')
+        if session_id is not None and cls.revocation_list is not None and \
+           cls.revocation_list.is_revoked(session_id):
+            return cls._reject('revoked')
+        if cls.negative_cache is not None:
+            reason = cls.negative_cache.get(string)
+            if reason is not None:
+                return cls._reject(reason)
+
+        if cache is not None:
+            hit = cache.get(string, crypter)
+            if hit is not None:
+                items, data, digest, expires = hit
+                if data is not None:
+                    # mutable values must not be shared between sessions
+                    items = cls._postprocess_items(cls._loads(data))
+                    items.pop('_expires', None)
+                if timings is not None:
+                    timings['cache'] = time() - now
+                return items, digest, expires, key_id, session_id, None
 
-        return cls(items, crypter, False)
+        try:
+            # the cleartext header must match the one it was encrypted with
+            data = crypter.decrypt(ciphertext, header)
+        except Exception:
+            # if decryption fails, return new empty EncryptedCookie object
+            return cls._reject('decrypt', string)
+        if timings is not None:
+            decrypted = time()
+            timings['decrypt'] = decrypted - now
+        try:
+            items = cls._postprocess_items(cls._loads(data))
+        except Exception:
+            return cls._reject('deserialize', string)
+        if timings is not None:
+            timings['deserialize'] = time() - decrypted
+            cookie_loaded.send(cls, cookie_size=len(string),
+                               payload_size=len(data), timings=timings)
+        if header is None:
+            # old format cookies store the expiration in the data
+            expires = items.pop('_expires', None)
+            if expires is not None and time() > expires:
+                return cls._reject('expired')
+        digest = sha1(data).digest()
+        if cache is not None:
+            cache.set(string, crypter, items, data, expires, digest)
+        return items, digest, expires, key_id, session_id, None
 
     @classmethod
-    def load_cookie(cls, request, key='session', crypter_or_keys_location=None):
+    def load_cookie(cls, request, key='session', crypter_or_keys_location=None,
+                    cache=None, timings=None):
         """Loads a :class:`EncryptedCookie` from a cookie in request. If the
         cookie is not set, a new :class:`EncryptedCookie` instance is
         returned.
@@ -189,8 +643,357 @@ class EncryptedCookie(SecureCookie):
                            of the keyczar keys.
                            Always provide the value even though it has
                            no default!
+        :param cache: an optional
+            :class:`~flask_encryptedsession.cache.DecryptCache`.
+        :param timings: an optional dict to record durations in.
         """
         data = request.cookies.get(key)
+        chunks = []
+        reason = None
+        if data and data[:1] == CHUNKED_MARKER:
+            data, chunks = _join_chunks(request.cookies, key, data,
+                                        cls.max_chunks)
+            if data is None:
+                reason = 'malformed'
+                cookie_rejected.send(cls, reason=reason)
         if not data:
-            return cls(crypter_or_keys_location=crypter_or_keys_location)
-        return cls.unserialize(data, crypter_or_keys_location)
+            rv = cls(crypter_or_keys_location=crypter_or_keys_location)
+            rv.timings = timings
+            rv.rejected_reason = reason
+        else:
+            rv = cls.unserialize(data, crypter_or_keys_location, cache,
+                                 timings)
+        rv.loaded_chunks = chunks
+        return rv
+
+    def save_cookie(self, response, key='session', expires=None,
+                    session_expires=None, max_age=None, path='/', domain=None,
+                    secure=None, httponly=False, force=False,
+                    refresh_expiry=True):
+        """Saves the EncryptedCookie in a cookie on response object.  All
+        parameters that are not described here are forwarded directly
+        to :meth:`~BaseResponse.set_cookie`.
+
+        Cookies that were modified but serialize to exactly the payload
+        and header they were loaded from are not encrypted and set again
+        unless `force` is true or they were encrypted with a stale key.
+
+        :param response: a response object that has a
+                         :meth:`~BaseResponse.set_cookie` method.
+        :param key: the name of the cookie.
+        :param session_expires: the expiration date of the encrypted cookie
+                                stored information.  If this is not provided
+                                the cookie `expires` date is used instead.
+        :param refresh_expiry: if false, a new expiration alone is no
+                               reason to set an unchanged cookie again,
+                               for callers that refresh it separately.
+        :return: `True` if the cookie was set on the response.
+        """
+        if not (force or self.should_save):
+            return False
+        payload = self._dumps()
+        if not (force or self.stale_key) and \
+           self._unchanged(payload, session_expires or expires,
+                           refresh_expiry):
+            return False
+        if self.size_budget is None:
+            data = self._encrypt(payload, session_expires or expires)
+        else:
+            data = self._fit_budget(payload, session_expires or expires)
+        self.cookie_size = len(data)
+        size = self.max_cookie_size
+        if size is None or len(data) <= size:
+            response.set_cookie(key, data, expires=expires, max_age=max_age,
+                                path=path, domain=domain, secure=secure,
+                                httponly=httponly)
+            chunks = []
+        else:
+            chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+            if len(chunks) > self.max_chunks:
+                raise ValueError('the cookie needs %d chunks, more than '
+                                 'max_chunks' % len(chunks))
+            response.set_cookie(key, _make_manifest(data, len(chunks)),
+                                expires=expires, max_age=max_age, path=path,
+                                domain=domain, secure=secure,
+                                httponly=httponly)
+            loaded_chunks = self.loaded_chunks
+            for index, chunk in enumerate(chunks):
+                # chunks the browser already has are not sent again
+                if index < len(loaded_chunks) and \
+                   loaded_chunks[index] == chunk:
+                    continue
+                response.set_cookie('%s.%d' % (key, index), chunk,
+                                    expires=expires, max_age=max_age,
+                                    path=path, domain=domain, secure=secure,
+                                    httponly=httponly)
+        self._delete_chunks(response, key, len(chunks), path, domain)
+        self.loaded_chunks = chunks
+        return True
+
+    def _unchanged(self, payload, expires, refresh_expiry):
+        """`True` if the cookie would be set to the payload and header it
+        was loaded from.
+        """
+        if self.payload_digest is None or \
+           sha1(payload).digest() != self.payload_digest:
+            return False
+        if self.session_id is None and self.session_ids:
+            return False
+        if not refresh_expiry:
+            return True
+        # permanent sessions get a new expiration every time
+        return self._header(expires) == _make_header(self.expires_at,
+                                                     self.session_id)
+
+    def _fit_budget(self, payload, expires):
+        """Encrypt `payload`, evicting :attr:`evictable_keys` and
+        serializing again until the value fits the :attr:`size_budget`.
+        Returns the encrypted value.
+        """
+        budget = self.size_budget
+        header = self._header(expires)
+        candidates = [key for key in self.evictable_keys if key in self]
+        evicted = self.evicted_keys = []
+        while True:
+            size = self.crypter.ciphertext_length(len(payload), header)
+            if size is None:
+                data = self._encrypt(payload, expires)
+                size = len(data)
+            else:
+                data = None
+                size += len(header) + 1
+            if size <= budget or not candidates:
+                break
+            key = candidates.pop(0)
+            del self[key]
+            evicted.append(key)
+            payload = self._dumps()
+        if size > budget:
+            key_sizes = self.key_sizes()
+            cookie_oversized.send(self, size=size, budget=budget,
+                                  evicted=evicted, key_sizes=key_sizes)
+            if self.budget_action == 'raise':
+                raise CookieTooLarge(size, budget, key_sizes)
+            logger.warning('the session cookie is %d bytes, more than the '
+                           'budget of %d bytes; largest keys: %s', size,
+                           budget, ', '.join('%s (%d)' % item
+                                             for item in key_sizes[:5]))
+        elif evicted:
+            cookie_oversized.send(self, size=size, budget=budget,
+                                  evicted=evicted, key_sizes=None)
+        if data is None:
+            data = self._encrypt(payload, expires)
+        return data
+
+    def _delete_chunks(self, response, key, start, path, domain):
+        for index in xrange(start, len(self.loaded_chunks)):
+            response.delete_cookie('%s.%d' % (key, index), path=path,
+                                   domain=domain)
+
+    def delete_cookie(self, response, key='session', path='/', domain=None):
+        """Delete the cookie from the browser, including the chunks it
+        was split into.
+        """
+        response.delete_cookie(key, path=path, domain=domain)
+        self._delete_chunks(response, key, 0, path, domain)
+        self.loaded_chunks = []
+
+
+class SpillingCookieMixin(object):
+    """Keeps large session values in a server side
+    :class:`~flask_encryptedsession.stores.SessionStore` instead of the
+    cookie.  Mix it into a cookie class and set :attr:`spill_store`::
+
+        class HybridCookie(SpillingCookieMixin, EncryptedCookie):
+            spill_store = SQLiteStore('/var/lib/myapp/sessions.db')
+
+    Values whose serialized size is at least :attr:`spill_threshold` bytes
+    and the values of :attr:`spill_keys` are written to the store when the
+    cookie is serialized.  The cookie only carries a random reference, a
+    version and a SHA-256 digest for each of them, encrypted like the rest
+    of the payload, so values changed in the store are never deserialized.
+    Loaded cookies hold :class:`SpilledValue` placeholders that are fetched
+    from the store, all in one call, the first time a spilled value is
+    read.  Values that did not change keep their reference and are not
+    written again.  Replaced versions stay in the store until its `ttl`
+    expires, because concurrent requests may still carry the cookie that
+    refers to them; only deleting the cookie removes its values at once.
+
+    A spilled value that is missing from the store, or whose bytes do not
+    match the digest in the cookie, is dropped from the session without
+    marking it modified.  The references are kept under
+    :data:`SPILLED_KEY`, which is reserved in spilling cookies.
+    """
+
+    #: the :class:`~flask_encryptedsession.stores.SessionStore` values are
+    #: spilled to.  `None` keeps everything in the cookie.
+    spill_store = None
+
+    #: values that serialize to at least this many bytes are spilled.
+    #: `None` only spills :attr:`spill_keys`.
+    spill_threshold = 1024
+
+    #: keys whose values are always spilled, whatever their size.
+    spill_keys = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        #: maps the keys of spilled values to ``(ref, version, digest)``;
+        #: the digest is `None` until the value was fetched.
+        self._spill_refs = {}
+        self._spill_scanned = False
+        self._spill_fetched = False
+        super(SpillingCookieMixin, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def _postprocess_items(cls, items):
+        # replace the references with placeholders
+        items = super(SpillingCookieMixin, cls)._postprocess_items(items)
+        spilled = items.pop(SPILLED_KEY, None)
+        if spilled is None:
+            return items
+        if not isinstance(spilled, dict):
+            raise ValueError('malformed spilled references')
+        for key, value in spilled.iteritems():
+            if not isinstance(value, (list, tuple)) or len(value) != 3 or \
+               not isinstance(value[0], basestring) or \
+               not isinstance(value[1], (int, long)) or \
+               not isinstance(value[2], basestring):
+                raise ValueError('malformed spilled reference for %r' % key)
+            items[key] = SpilledValue(*value)
+        return items
+
+    def _scan_spilled(self):
+        """Record the references of the placeholders in the cookie and
+        return the placeholders as a list of ``(key, placeholder)``.
+        """
+        if getattr(self, '_raw', None) is not None:
+            # lazy sessions are loaded first
+            self._load()
+        self._spill_scanned = True
+        refs = self._spill_refs
+        pending = []
+        for key, value in dict.iteritems(self):
+            if value.__class__ is SpilledValue:
+                if key not in refs:
+                    refs[key] = (value.ref, value.version, value.digest)
+                pending.append((key, value))
+        return pending
+
+    def _fetch_spilled(self):
+        """Replace all placeholders with the values from the store."""
+        pending = self._scan_spilled()
+        self._spill_fetched = True
+        if not pending:
+            return
+        store = self.spill_store
+        found = {}
+        if store is not None:
+            found = store.get_many([value.store_key for _, value in pending])
+        for key, value in pending:
+            data = found.get(value.store_key)
+            # the store is not trusted: only the exact bytes the cookie
+            # names by their digest are deserialized
+            if data is not None and _spill_digest(data) != value.digest:
+                self.spill_store.stats.incr('mismatches')
+                data = None
+            if data is not None:
+                try:
+                    item = self._loads(data)
+                except Exception:
+                    data = None
+            if data is None:
+                # the cookie keeps the reference until it is saved anyway
+                dict.__delitem__(self, key)
+                continue
+            dict.__setitem__(self, key, item)
+
+    def _dump_value(self, value):
+        data = dump_payload(self.serializer, value)
+        if self.compress_threshold is not None and \
+           len(data) >= self.compress_threshold:
+            data = compress_payload(data, self.compress_level)
+        return data
+
+    def _payload_items(self):
+        self._scan_spilled()
+        items = dict(self)
+        store = self.spill_store
+        threshold = self.spill_threshold
+        spill_keys = self.spill_keys
+        old_refs = self._spill_refs
+        refs = {}
+        writes = {}
+        for key, value in items.items():
+            if value.__class__ is SpilledValue:
+                refs[key] = old_refs[key]
+                continue
+            if store is None or (threshold is None and
+                                 key not in spill_keys):
+                continue
+            data = self._dump_value(value)
+            if key not in spill_keys and len(data) < threshold:
+                continue
+            digest = _spill_digest(data)
+            ref, version, old_digest = old_refs.get(key, (None, 0, None))
+            if ref is None:
+                ref = b64encode(os.urandom(12))
+            if digest != old_digest:
+                version += 1
+                writes['%s.%d' % (ref, version)] = data
+            refs[key] = (ref, version, digest)
+        if writes:
+            store.set_many(writes)
+        self._spill_refs = refs
+        if refs:
+            for key in refs:
+                del items[key]
+            items[SPILLED_KEY] = dict((key, list(ref))
+                                      for key, ref in refs.iteritems())
+        return items
+
+    def __getitem__(self, key):
+        value = super(SpillingCookieMixin, self).__getitem__(key)
+        if value.__class__ is SpilledValue:
+            self._fetch_spilled()
+            value = dict.__getitem__(self, key)
+        return value
+
+    def get(self, key, default=None):
+        value = super(SpillingCookieMixin, self).get(key, default)
+        if value.__class__ is SpilledValue:
+            self._fetch_spilled()
+            value = dict.get(self, key, default)
+        return value
+
+    def delete_cookie(self, response, key='session', path='/', domain=None):
+        """Delete the cookie and the values it spilled to the store."""
+        self._scan_spilled()
+        if self._spill_refs and self.spill_store is not None:
+            self.spill_store.delete_many([
+                '%s.%d' % (ref, version) for ref, version, _
+                in self._spill_refs.itervalues()])
+        self._spill_refs = {}
+        super(SpillingCookieMixin, self).delete_cookie(response, key, path,
+                                                       domain)
+
+
+def _spilling(name, fetch):
+    def wrapper(self, *args, **kwargs):
+        if fetch:
+            if not self._spill_fetched:
+                self._fetch_spilled()
+        elif not self._spill_scanned:
+            self._scan_spilled()
+        return getattr(super(SpillingCookieMixin, self), name)(
+            *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+# reading values fetches the spilled ones, changing the cookie records
+# their references first so new versions of a value keep its reference
+for _name in ('values', 'items', 'itervalues', 'iteritems', 'copy',
+              '__eq__', '__ne__', 'pop', 'popitem', 'setdefault'):
+    setattr(SpillingCookieMixin, _name, _spilling(_name, True))
+for _name in ('__setitem__', '__delitem__', 'clear', 'update'):
+    setattr(SpillingCookieMixin, _name, _spilling(_name, False))
+del _name
@@ -8,10 +8,15 @@
 
     :license: BSD, see LICENSE for more details.
 """
+from random import random
+from time import time
+
 from flask.sessions import SessionMixin, SessionInterface
-from keyczar import keyczar
 
-from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.encryptedcookie import (
+    EncryptedCookie, SpillingCookieMixin, _split_cookie)
+from flask_encryptedsession.signals import session_timed
+from flask_encryptedsession.stats import Counters
 
 
 class EncryptedCookieSession(EncryptedCookie, SessionMixin):
@@ -19,6 +24,99 @@ class EncryptedCookieSession(EncryptedCookie, SessionMixin):
     and non-permanent sessions.
     """
 
+    #: set once the session data is read.  Writes are tracked by
+    #: :attr:`modified`, so a handler that only writes to the session
+    #: leaves it `False`.
+    accessed = False
+
+
+def _reading(name):
+    method = getattr(EncryptedCookie, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.accessed = True
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ('__getitem__', '__contains__', '__iter__', '__len__',
+              '__eq__', '__ne__', '__repr__', 'get', 'has_key', 'keys',
+              'values', 'items', 'iterkeys', 'itervalues', 'iteritems',
+              'copy', 'pop', 'popitem', 'setdefault'):
+    setattr(EncryptedCookieSession, _name, _reading(_name))
+del _name
+
+
+class LazyEncryptedCookieSession(EncryptedCookieSession):
+    """A session that keeps the raw cookie value and only decrypts it the
+    first time the session is read or modified.  Requests that never touch
+    the session do not pay for decryption at all.
+    """
+
+    def __init__(self, data=None, crypter_or_keys_location=None, new=True):
+        EncryptedCookieSession.__init__(self, data, crypter_or_keys_location,
+                                        new)
+        self._raw = None
+        self._cache = None
+
+    @property
+    def loaded(self):
+        """`True` once the cookie value was decrypted (or if there was no
+        cookie to begin with).
+        """
+        return self._raw is None
+
+    def _load(self):
+        raw = self._raw
+        if raw is not None:
+            self._raw = None
+            items, self.payload_digest, self.expires_at, self.key_id, \
+                self.session_id, self.rejected_reason = self._load_items(
+                    raw, self.crypter, self._cache, self.timings)
+            dict.update(self, items)
+
+    @classmethod
+    def unserialize(cls, string, crypter_or_keys_location, cache=None,
+                    timings=None):
+        if isinstance(string, unicode):
+            string = string.encode('utf-8', 'replace')
+        session = cls(None, crypter_or_keys_location, False)
+        session._raw = string
+        session._cache = cache
+        session.timings = timings
+        # the expiration and session id are readable without decrypting
+        # the cookie
+        try:
+            _, expires, session_id, _ = _split_cookie(string)
+        except ValueError:
+            expires = session_id = None
+        if expires is not None and expires > time():
+            session.expires_at = expires
+        session.session_id = session_id
+        return session
+
+
+def _loading(name):
+    method = getattr(EncryptedCookieSession, name)
+
+    def wrapper(self, *args, **kwargs):
+        if self._raw is not None:
+            self._load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ('__getitem__', '__contains__', '__iter__', '__len__',
+              '__eq__', '__ne__', '__repr__', 'get', 'has_key', 'keys',
+              'values', 'items', 'iterkeys', 'itervalues', 'iteritems',
+              'copy', '__setitem__', '__delitem__', 'clear', 'pop',
+              'popitem', 'setdefault', 'update', 'serialize', 'save_cookie',
+              '_dumps', '_payload_items', 'key_sizes'):
+    setattr(LazyEncryptedCookieSession, _name, _loading(_name))
+del _name
+
 
 class NullSession(EncryptedCookieSession):
     """Class used to generate nicer error messages if sessions are not
@@ -42,39 +140,327 @@ class NullSession(EncryptedCookieSession):
 class EncryptedCookieSessionInterface(SessionInterface):
     """The cookie session interface that uses the Werkzeug encryptedcookie
     as client side session backend.
+
+    One instance is shared by all request threads.  Its crypto backend is
+    safe to share: keyczar and the AEAD ciphers create their cipher state
+    per call, and everything else the interface changes is guarded by a
+    lock (see the ``Threads`` section of the README).
     """
     session_class = EncryptedCookieSession
+    lazy_session_class = LazyEncryptedCookieSession
     null_session_class = NullSession
 
-    def __init__(self, keys_location):
+    #: re-issue unchanged permanent sessions once less than this fraction
+    #: of :attr:`~flask.Flask.permanent_session_lifetime` remains.  `None`
+    #: only saves sessions whose data changed, ``1.0`` pushes the expiration
+    #: forward on every request.  With a threshold, modified sessions whose
+    #: data is unchanged also keep their expiration until it is reached;
+    #: with `None` they are re-issued with a new expiration.
+    refresh_threshold = None
+
+    #: the fraction of requests for which the time spent decrypting,
+    #: deserializing, serializing and encrypting the session is measured
+    #: and reported through the
+    #: :data:`~flask_encryptedsession.signals.session_timed` signal.  `None`
+    #: measures nothing, ``1.0`` every request.
+    timing_sample_rate = None
+
+    #: add a ``Server-Timing`` header with the measured durations to the
+    #: responses of timed requests.
+    server_timing = False
+
+    #: the name of a response header that lists why the session made the
+    #: response uncacheable, for example ``'X-Session-Cache'``.  `None`
+    #: adds no header.  See :meth:`save_session`.
+    cacheability_header = None
+
+    def __init__(self, keys_location, decrypt_cache=None, serializer=None,
+                 compress_threshold=None, compress_level=None,
+                 max_payload_size=None, lazy=False, refresh_threshold=None,
+                 timing_sample_rate=None, server_timing=None,
+                 spill_store=None, spill_threshold=None, spill_keys=None,
+                 revocation_list=None, negative_cache=None, schema=None,
+                 size_budget=None, evictable_keys=None, budget_action=None,
+                 cacheability_header=None):
         """
-        :param keys_location: the directory containing the keyczar keys
+        :param keys_location: the directory containing the keyczar keys,
+            a keyczar.Crypter instance or a
+            :class:`~flask_encryptedsession.backends.CryptoBackend`
+        :param decrypt_cache: an optional
+            :class:`~flask_encryptedsession.cache.DecryptCache` used to skip
+            decrypting cookies that were seen recently.  Its hit and miss
+            counters are available as ``decrypt_cache.stats``.
+        :param serializer: the
+            :class:`~flask_encryptedsession.serializers.Serializer` used for
+            new cookies.  Defaults to the one of :attr:`session_class`.
+        :param compress_threshold: compress payloads of at least this many
+            bytes before encrypting them.
+        :param compress_level: the zlib compression level.
+        :param max_payload_size: reject compressed payloads that inflate to
+            more than this many bytes.
+        :param lazy: use :attr:`lazy_session_class` so cookies are only
+            decrypted if the request actually uses the session.
+        :param refresh_threshold: see :attr:`refresh_threshold`.
+        :param timing_sample_rate: see :attr:`timing_sample_rate`.
+        :param server_timing: see :attr:`server_timing`.
+        :param spill_store: a
+            :class:`~flask_encryptedsession.stores.SessionStore` that large
+            values are kept in instead of the cookie.  See
+            :class:`~flask_encryptedsession.encryptedcookie.SpillingCookieMixin`.
+        :param spill_threshold: spill values that serialize to at least
+            this many bytes.
+        :param spill_keys: the keys whose values are always spilled.
+        :param revocation_list: a
+            :class:`~flask_encryptedsession.revocation.RevocationList`.
+            Sessions get a session id and can be revoked with
+            :meth:`revoke_session`.
+        :param negative_cache: an optional
+            :class:`~flask_encryptedsession.cache.NegativeCache` of cookies
+            that failed to decrypt, which are then rejected without
+            decrypting them again.
+        :param schema: a
+            :class:`~flask_encryptedsession.schema.SessionSchema`.  The
+            session class keeps its fields in slots and writes them by
+            position.  Cannot be combined with `spill_store`.
+        :param size_budget: the largest encrypted session cookie in bytes.
+            See :attr:`~flask_encryptedsession.encryptedcookie.EncryptedCookie.size_budget`.
+        :param evictable_keys: the keys removed, in this order, from
+            sessions over the `size_budget`.
+        :param budget_action: ``'log'`` or ``'raise'``, what happens to
+            sessions that are still over the budget.
+        :param cacheability_header: see :attr:`cacheability_header`.
         """
+        self.decrypt_cache = decrypt_cache
+        if refresh_threshold is not None:
+            self.refresh_threshold = refresh_threshold
+        if timing_sample_rate is not None:
+            self.timing_sample_rate = timing_sample_rate
+        if server_timing is not None:
+            self.server_timing = server_timing
+        if cacheability_header is not None:
+            self.cacheability_header = cacheability_header
+        self.stats = Counters()
+        if lazy:
+            self.session_class = self.lazy_session_class
+        if spill_store is not None and schema is not None:
+            raise ValueError('a schema cannot be combined with a '
+                             'spill_store')
+        if spill_store is not None:
+            self.session_class = type(
+                self.session_class.__name__,
+                (SpillingCookieMixin, self.session_class),
+                {'spill_store': spill_store})
+            if spill_keys is not None:
+                spill_keys = frozenset(spill_keys)
+        if budget_action not in (None, 'log', 'raise'):
+            raise ValueError('unknown budget_action %r' % budget_action)
+        if evictable_keys is not None:
+            evictable_keys = tuple(evictable_keys)
+        self._configure_session_class(
+            size_budget=size_budget, evictable_keys=evictable_keys,
+            budget_action=budget_action,
+            negative_cache=negative_cache, revocation_list=revocation_list,
+            session_ids=revocation_list is not None or None,
+            spill_threshold=spill_threshold, spill_keys=spill_keys,
+            serializer=serializer, compress_threshold=compress_threshold,
+            compress_level=compress_level, max_payload_size=max_payload_size)
+        if schema is not None:
+            self.session_class = schema.session_class(self.session_class)
         try:
-            self.crypter = keyczar.Crypter.Read(keys_location)
+            self.crypter = self.session_class._get_crypter(keys_location)
         except Exception, e:
             self.crypter = None
             self.crypter_exc = e
 
+    def _configure_session_class(self, **attributes):
+        """Derive :attr:`session_class` with the class attributes that
+        were passed to the constructor.  Attributes that are `None` keep
+        the default of the session class.
+        """
+        attributes = dict((name, value) for name, value
+                          in attributes.iteritems() if value is not None)
+        if attributes:
+            self.session_class = type(self.session_class.__name__,
+                                      (self.session_class,), attributes)
+
+    def compression_ratio(self):
+        """Return the size of the encrypted payloads relative to their
+        uncompressed size over all saved sessions, or `None` if no session
+        was saved yet.
+        """
+        payload_bytes = self.stats['payload_bytes']
+        if not payload_bytes:
+            return None
+        return float(self.stats['stored_payload_bytes']) / payload_bytes
+
+    def key_usage(self):
+        """Return a dict mapping key ids to the number of saved sessions
+        whose cookie was encrypted with that key.  A key that no longer
+        shows up can be removed from the keyset.
+        """
+        return dict((name[4:], value) for name, value
+                    in self.stats.snapshot().iteritems()
+                    if name.startswith('key:'))
+
+    def stale_key_ratio(self):
+        """Return the share of loaded sessions that were encrypted with a
+        key other than the primary key, or `None` if no cookie was loaded
+        yet.
+        """
+        keyed_sessions = self.stats['keyed_sessions']
+        if not keyed_sessions:
+            return None
+        return float(self.stats['stale_key_sessions']) / keyed_sessions
+
+    def uncacheable_reasons(self):
+        """Return a dict mapping the reasons :meth:`save_session` reports
+        to the number of responses they made uncacheable.
+        """
+        return dict((name[12:], value) for name, value
+                    in self.stats.snapshot().iteritems()
+                    if name.startswith('uncacheable:'))
+
+    def revoke_session(self, session):
+        """Revoke `session` so its cookie is rejected from now on, even if
+        it was copied, and clear it.  Needs a `revocation_list`.
+        """
+        revocation_list = self.session_class.revocation_list
+        if revocation_list is None:
+            raise RuntimeError('sessions can only be revoked with a '
+                               'revocation_list')
+        if session.session_id is not None:
+            revocation_list.revoke(session.session_id, session.expires_at)
+            self.stats.incr('revoked_sessions')
+        session.clear()
+        session.session_id = None
+
+    def should_refresh(self, app, session):
+        """Return `True` if `session` should be re-issued with a new
+        expiration even though its data did not change.  The default
+        implementation applies :attr:`refresh_threshold` to the expiration
+        carried in the cookie.
+        """
+        if self.refresh_threshold is None or session.new:
+            return False
+        expires_at = session.expires_at
+        if expires_at is None:
+            # cookies in the old format do not tell when they expire
+            return getattr(session, 'loaded', True) and session.permanent
+        lifetime = app.permanent_session_lifetime
+        lifetime = lifetime.days * 86400 + lifetime.seconds
+        return expires_at - time() < lifetime * self.refresh_threshold
+
     def make_null_session(self, app):
         return self.null_session_class(self.crypter_exc)
 
     def open_session(self, app, request):
         if self.crypter is not None:
+            timings = None
+            if self.timing_sample_rate and \
+               random() < self.timing_sample_rate:
+                timings = {}
             return self.session_class.load_cookie(
                 request, app.session_cookie_name,
-                crypter_or_keys_location=self.crypter)
+                crypter_or_keys_location=self.crypter,
+                cache=self.decrypt_cache, timings=timings)
 
     def save_session(self, app, session, response):
+        """Save `session` to `response` and report why the response can no
+        longer be cached by a shared cache:
+
+        ``'read'``
+            the session data was read, so ``Vary: Cookie`` is added.
+        ``'write'``, ``'delete'``
+            the session was modified and the cookie set or deleted.
+        ``'refresh'``
+            the unchanged session was re-issued with a new expiration.
+        ``'stale_key'``
+            the unchanged session was re-encrypted with the primary key.
+
+        Every reason is counted in :attr:`stats` as ``uncacheable:<reason>``
+        and responses without one as ``cacheable_responses``.  With a
+        :attr:`cacheability_header` the reasons, or ``cacheable``, are also
+        sent with the response.
+        """
+        # the interface reads the session itself while saving it
+        accessed = session.accessed
+        reasons = []
+        if accessed:
+            response.vary.add('Cookie')
+            reasons.append('read')
+        reason = self._save_session(app, session, response)
+        if reason is not None:
+            reasons.append(reason)
+        for reason in reasons:
+            self.stats.incr('uncacheable:' + reason)
+        if not reasons:
+            self.stats.incr('cacheable_responses')
+        if self.cacheability_header:
+            response.headers[self.cacheability_header] = \
+                ', '.join(reasons) or 'cacheable'
+        timings = session.timings
+        if timings is not None:
+            self.stats.incr('timed_requests')
+            session_timed.send(app, session=session, timings=timings)
+            if self.server_timing and timings:
+                response.headers.add('Server-Timing', ', '.join(
+                    'session-%s;dur=%.3f' % (name, timings[name] * 1000)
+                    for name in sorted(timings)))
+
+    def _save_session(self, app, session, response):
+        refresh = self.should_refresh(app, session)
+        if not refresh and not getattr(session, 'loaded', True):
+            # the session was never used, so the cookie stays as it is
+            self.stats.incr('untouched_sessions')
+            return
+        if session.rejected_reason is not None:
+            self.stats.incr('rejected:' + session.rejected_reason)
+        key_id = session.key_id
+        if key_id is not None:
+            self.stats.incr('key:' + key_id)
+            self.stats.incr('keyed_sessions')
+            if session.stale_key:
+                self.stats.incr('stale_key_sessions')
         expires = self.get_expiration_time(app, session)
         domain = self.get_cookie_domain(app)
         path = self.get_cookie_path(app)
         httponly = self.get_cookie_httponly(app)
         secure = self.get_cookie_secure(app)
         if session.modified and not session:
-            response.delete_cookie(app.session_cookie_name, path=path,
-                                   domain=domain)
-        else:
-            session.save_cookie(response, app.session_cookie_name, path=path,
-                                expires=expires, httponly=httponly,
-                                secure=secure, domain=domain)
+            if session.new and session.rejected_reason is None and \
+               not session.loaded_chunks:
+                # the client never had a cookie to delete
+                self.stats.incr('empty_new_sessions')
+                return
+            session.delete_cookie(response, app.session_cookie_name,
+                                  path=path, domain=domain)
+            return 'delete'
+        elif session.should_save or refresh:
+            saved = session.save_cookie(
+                response, app.session_cookie_name, path=path,
+                expires=expires, httponly=httponly, secure=secure,
+                domain=domain, force=refresh,
+                refresh_expiry=self.refresh_threshold is None)
+            if not saved:
+                # modified, but the payload is the one that was loaded
+                self.stats.incr('saves_avoided')
+                return
+            self.stats.incr('saves')
+            if refresh:
+                self.stats.incr('refreshes')
+            if session.stale_key:
+                self.stats.incr('reencrypted')
+            if session.evicted_keys:
+                self.stats.incr('evicted_keys', len(session.evicted_keys))
+            if session.size_budget is not None and \
+               session.cookie_size > session.size_budget:
+                self.stats.incr('over_budget')
+            payload_sizes = session.payload_sizes
+            if payload_sizes is not None:
+                self.stats.incr('payload_bytes', payload_sizes[0])
+                self.stats.incr('stored_payload_bytes', payload_sizes[1])
+            if session.modified:
+                return 'write'
+            if refresh:
+                return 'refresh'
+            return 'stale_key'
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.keys
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A process-wide registry of keyczar crypters.
+
+    Reading a keyset means reading the metadata and every key file and
+    parsing them into key objects.  :func:`get_crypter` does that once per
+    location and hands out the same :class:`keyczar.Crypter` afterwards::
+
+        >>> from flask_encryptedsession.keys import get_crypter
+        >>> get_crypter("/tmp/keys") is get_crypter("/tmp/keys")
+        True
+
+    The keyset is read again when the modification time of the location or
+    its ``meta`` file changes, which is what ``keyczart addkey`` and
+    ``keyczart promote`` do.  The modification times are only checked every
+    `check_interval` seconds so the hot path does not touch the filesystem.
+    :func:`reload_crypters` forces a reload.
+
+    keyczar is only imported when the first keyset is read.  Servers that
+    fork worker processes can read the keysets once in the master with
+    :func:`preload`, so the workers share them instead of each importing
+    keyczar and reading the keys again.  With gunicorn::
+
+        # gunicorn.conf.py
+        def on_starting(server):
+            from flask_encryptedsession.keys import preload
+            preload('/tmp/keys')
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import os
+from threading import Lock
+from time import time
+
+
+class _Entry(object):
+    __slots__ = ('crypter', 'mtime', 'checked')
+
+    def __init__(self, crypter, mtime, checked):
+        self.crypter = crypter
+        self.mtime = mtime
+        self.checked = checked
+
+
+class CrypterRegistry(object):
+    """Caches :class:`keyczar.Crypter` instances by keys location.
+
+    :param check_interval: the number of seconds between checks of the
+                           keyset modification time.  `None` disables the
+                           checks, only :meth:`reload` refreshes the keys.
+    """
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = Lock()
+        self._pid = os.getpid()
+
+    def _get_lock(self):
+        if self._pid != os.getpid():
+            # the lock may have been held by another thread when the
+            # process forked, and that thread does not exist here
+            self._lock = Lock()
+            self._pid = os.getpid()
+        return self._lock
+
+    @staticmethod
+    def _mtime(location):
+        try:
+            return (os.stat(location).st_mtime,
+                    os.stat(os.path.join(location, 'meta')).st_mtime)
+        except OSError:
+            return None
+
+    def get(self, location):
+        """Return the crypter for the keys at `location`, reading the keys
+        if they were not read yet or changed on disk.
+        """
+        entry = self._entries.get(location)
+        now = time()
+        if entry is not None and (self.check_interval is None or
+                                  now - entry.checked < self.check_interval):
+            return entry.crypter
+        with self._get_lock():
+            entry = self._entries.get(location)
+            mtime = self._mtime(location)
+            if entry is not None and mtime is not None and \
+               entry.mtime == mtime:
+                entry.checked = now
+                return entry.crypter
+            from keyczar import keyczar
+            crypter = keyczar.Crypter.Read(location)
+            self._entries[location] = _Entry(crypter, mtime, now)
+            return crypter
+
+    def reload(self, location=None):
+        """Forget the crypter for `location`, or for all locations if no
+        location is given, so that the keys are read again on next use.
+        """
+        with self._get_lock():
+            if location is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(location, None)
+
+    def __contains__(self, location):
+        return location in self._entries
+
+
+#: the registry used by :func:`get_crypter` and :func:`reload_crypters`.
+registry = CrypterRegistry()
+
+
+def get_crypter(location):
+    """Return the shared :class:`keyczar.Crypter` for `location`."""
+    return registry.get(location)
+
+
+def preload(*locations):
+    """Read the keysets at `locations` into the registry.  Call this before
+    the server forks its workers so they inherit the crypters.
+    """
+    for location in locations:
+        registry.get(location)
+
+
+def reload_crypters(location=None):
+    """Make :func:`get_crypter` read the keys at `location` (or all keys)
+    from disk again.
+    """
+    registry.reload(location)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.offload
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs the decryption and encryption of sessions on a thread pool so that
+    an event loop does not stall while keyczar works.
+
+    :class:`OffloadingSessionInterface` adds :meth:`open_session_async` and
+    :meth:`save_session_async`, which return a result object instead of
+    blocking.  The result has the interface of
+    :class:`multiprocessing.pool.AsyncResult` (`ready`, `wait` and `get`),
+    so event loops can poll it or wait for it in a greenlet::
+
+        interface = OffloadingSessionInterface(
+            "/tmp/keys", executor=BoundedExecutor(threads=4, max_pending=32))
+
+        result = interface.open_session_async(app, request)
+        ...  # serve other requests until result.ready()
+        session = result.get()
+
+    Small cookies are decoded inline because handing them to another
+    thread costs more than decrypting them.  The executor limits the number
+    of queued jobs; once the limit is reached new jobs run inline (or wait
+    for a free slot, see :class:`BoundedExecutor`) instead of piling up.
+
+    The synchronous :meth:`~OffloadingSessionInterface.open_session` and
+    :meth:`~OffloadingSessionInterface.save_session` that Flask calls are
+    unchanged and run inline.
+
+    :license: BSD, see LICENSE for more details.
+"""
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore
+
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+from flask_encryptedsession.stats import Counters
+
+
+class InlineResult(object):
+    """The result of a job that already ran in the calling thread.  Has the
+    same interface as :class:`multiprocessing.pool.AsyncResult`.
+    """
+
+    def __init__(self, func, args):
+        try:
+            self._value = func(*args)
+            self._success = True
+        except Exception, e:
+            self._value = e
+            self._success = False
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self._success
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if not self._success:
+            raise self._value
+        return self._value
+
+
+class BoundedExecutor(object):
+    """Runs jobs on a thread pool with at most `max_pending` jobs queued or
+    running at a time.
+
+    :param threads: the number of worker threads.
+    :param max_pending: the limit of queued or running jobs.
+    :param block: if `True` a job submitted while the limit is reached
+                  waits for a free slot, otherwise it runs inline in the
+                  submitting thread.
+    :param pool: an existing pool with an ``apply_async`` method to use
+                 instead of creating a :class:`ThreadPool`.
+    """
+
+    def __init__(self, threads=4, max_pending=64, block=False, pool=None):
+        if pool is None:
+            pool = ThreadPool(threads)
+        self.pool = pool
+        self.block = block
+        self.stats = Counters()
+        self._slots = BoundedSemaphore(max_pending)
+
+    def _run(self, func, args):
+        try:
+            return func(*args)
+        finally:
+            self._slots.release()
+
+    def submit(self, func, *args):
+        """Run ``func(*args)`` and return a result object."""
+        if not self._slots.acquire(self.block):
+            self.stats.incr('saturated')
+            return InlineResult(func, args)
+        self.stats.incr('offloaded')
+        try:
+            return self.pool.apply_async(self._run, (func, args))
+        except:
+            self._slots.release()
+            raise
+
+    def close(self):
+        """Stop the pool after the queued jobs finished."""
+        self.pool.close()
+        self.pool.join()
+        # runs the pool's finalizer now rather than at interpreter exit
+        self.pool.terminate()
+
+
+class OffloadingSessionInterface(EncryptedCookieSessionInterface):
+    """A session interface whose sessions can be opened and saved on a
+    :class:`BoundedExecutor`.
+
+    :param executor: the :class:`BoundedExecutor` to use.  A new one with
+                     the default limits is created if not given.
+    :param inline_threshold: cookies shorter than this many bytes are
+                             decoded inline.
+    """
+
+    inline_threshold = 256
+
+    def __init__(self, keys_location, executor=None, inline_threshold=None,
+                 **options):
+        EncryptedCookieSessionInterface.__init__(self, keys_location,
+                                                 **options)
+        if executor is None:
+            executor = BoundedExecutor()
+        self.executor = executor
+        if inline_threshold is not None:
+            self.inline_threshold = inline_threshold
+
+    def _open_session(self, app, request):
+        session = self.open_session(app, request)
+        if session is not None and not getattr(session, 'loaded', True):
+            # offloading a lazy session only helps if it is decrypted
+            session._load()
+        return session
+
+    def open_session_async(self, app, request):
+        """Like :meth:`open_session` but returns a result object whose
+        `get` method returns the session.
+        """
+        # the worker thread cannot see context locals such as flask.request
+        request = getattr(request, '_get_current_object', lambda: request)()
+        value = request.cookies.get(app.session_cookie_name)
+        if not value or len(value) < self.inline_threshold:
+            self.stats.incr('inline_opens')
+            return InlineResult(self._open_session, (app, request))
+        return self.executor.submit(self._open_session, app, request)
+
+    def save_session_async(self, app, session, response):
+        """Like :meth:`save_session` but returns a result object.  The
+        response must not be sent before the result is ready.
+        """
+        if not (session.should_save or self.refresh_threshold is not None):
+            # nothing will be encrypted
+            self.stats.incr('inline_saves')
+            return InlineResult(self.save_session, (app, session, response))
+        return self.executor.submit(self.save_session, app, session,
+                                    response)
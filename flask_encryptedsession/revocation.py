@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.revocation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Server side revocation of sessions.
+
+    A client side session cannot be deleted on the server, so a stolen
+    cookie stays valid until it expires.  With a :class:`RevocationList`
+    every cookie carries a random session id in its cleartext (but
+    authenticated) header, and cookies whose id was revoked are rejected
+    before anything is decrypted::
+
+        from flask_encryptedsession.revocation import RevocationList
+
+        revoked = RevocationList('/var/lib/myapp/revoked.db')
+        app.session_interface = EncryptedCookieSessionInterface(
+            "/tmp/keys", revocation_list=revoked)
+
+        @app.route('/logout-everywhere')
+        def logout():
+            app.session_interface.revoke_session(flask.session)
+            ...
+
+    The ids are kept in a SQLite database that all processes share.  Each
+    process holds a Bloom filter of the revoked ids, so checking an id that
+    was not revoked, which is what almost every request does, takes a few
+    microseconds and no I/O.  Only ids the filter reports are looked up in
+    the database.  Ids revoked by other processes are loaded incrementally
+    every `reload_interval` seconds.
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import math
+import os
+import sqlite3
+import struct
+from hashlib import md5
+from threading import Lock, local
+from time import time
+
+from flask_encryptedsession.stats import Counters
+
+
+_unpack_hashes = struct.Struct('<QQ').unpack
+
+
+class BloomFilter(object):
+    """A Bloom filter of strings.
+
+    :param capacity: the number of strings the filter is sized for.
+    :param error_rate: the false positive rate once `capacity` strings were
+                       added.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(
+            float(self.size) / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, string):
+        # double hashing, see Kirsch and Mitzenmacher
+        h1, h2 = _unpack_hashes(md5(string).digest())
+        size = self.size
+        bits = self._bits
+        for i in xrange(self.hashes):
+            position = (h1 + i * h2) % size
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, string):
+        h1, h2 = _unpack_hashes(md5(string).digest())
+        size = self.size
+        bits = self._bits
+        # most strings that were not added miss on one of the first bits
+        for i in xrange(self.hashes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList(object):
+    """The set of revoked session ids.
+
+    :param path: the SQLite database the ids are stored in.  `None` keeps
+                 them in memory, which only works with a single process.
+    :param capacity: the number of ids the Bloom filter is sized for.  It
+                     is rebuilt twice as large once more ids were revoked.
+    :param error_rate: the false positive rate of the Bloom filter.
+    :param reload_interval: how often, in seconds, ids revoked by other
+                            processes are loaded.  `None` never reloads.
+    :param table: the name of the table.
+    """
+
+    def __init__(self, path=None, capacity=100000, error_rate=0.001,
+                 reload_interval=30, table='revoked_sessions'):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.reload_interval = reload_interval
+        self.table = table
+        self.stats = Counters()
+        self._lock = Lock()
+        self._local = local()
+        self._pid = os.getpid()
+        self._memory = None
+        self._last_id = 0
+        if path is None:
+            self._memory = {}
+            self.reload_interval = None
+        else:
+            with self._connection() as connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY '
+                    'AUTOINCREMENT, session_id TEXT NOT NULL UNIQUE, '
+                    'expires REAL)' % table)
+        self._rebuild()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # SQLite connections must not be used across a fork, and the
+            # lock may have been held by a thread that does not exist here
+            self._local = local()
+            self._lock = Lock()
+            self._pid = os.getpid()
+
+    def _get_lock(self):
+        self._check_fork()
+        return self._lock
+
+    def _connection(self):
+        self._check_fork()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.text_factory = str
+            self._local.connection = connection
+        return connection
+
+    def _schedule_reload(self):
+        if self.reload_interval is None:
+            self._next_reload = None
+        else:
+            self._next_reload = time() + self.reload_interval
+
+    def _rebuild(self):
+        """Build a new Bloom filter from all revoked ids."""
+        with self._get_lock():
+            if self._memory is not None:
+                ids = list(self._memory)
+            else:
+                rows = self._connection().execute(
+                    'SELECT id, session_id FROM %s' % self.table).fetchall()
+                ids = [session_id for _, session_id in rows]
+                self._last_id = max([0] + [id for id, _ in rows])
+            capacity = self.capacity
+            while capacity < len(ids):
+                capacity *= 2
+            bloom = BloomFilter(capacity, self.error_rate)
+            for session_id in ids:
+                bloom.add(session_id)
+            self._bloom = bloom
+            self._schedule_reload()
+
+    def reload(self, due_only=False):
+        """Add the ids revoked by other processes since the last reload to
+        the Bloom filter.
+
+        :param due_only: only reload if the reload interval has passed,
+                         so threads that waited for another thread's
+                         reload do not repeat it.
+        """
+        if self._memory is not None:
+            return
+        with self._get_lock():
+            if due_only and (self._next_reload is None or
+                             time() < self._next_reload):
+                return
+            rows = self._connection().execute(
+                'SELECT id, session_id FROM %s WHERE id > ?' % self.table,
+                (self._last_id,)).fetchall()
+            for id, session_id in rows:
+                self._bloom.add(session_id)
+                self._last_id = max(self._last_id, id)
+            self._schedule_reload()
+        self.stats.incr('reloads')
+        if self._bloom.count > self._bloom.capacity:
+            self._rebuild()
+
+    def is_revoked(self, session_id):
+        """Return `True` if `session_id` was revoked."""
+        next_reload = self._next_reload
+        if next_reload is not None and time() >= next_reload:
+            self.reload(due_only=True)
+        if session_id not in self._bloom:
+            return False
+        if self._memory is not None:
+            revoked = session_id in self._memory
+        else:
+            revoked = self._connection().execute(
+                'SELECT 1 FROM %s WHERE session_id = ?' % self.table,
+                (session_id,)).fetchone() is not None
+        self.stats.incr(revoked and 'revoked' or 'false_positives')
+        return revoked
+
+    def revoke(self, session_id, expires=None):
+        """Revoke `session_id`.
+
+        :param expires: the unix timestamp the session expires at anyway.
+                        :meth:`compact` forgets the id after that.  `None`
+                        keeps it forever.
+        """
+        if self._memory is not None:
+            self._memory[session_id] = expires
+        else:
+            with self._connection() as connection:
+                connection.execute(
+                    'INSERT OR IGNORE INTO %s (session_id, expires) '
+                    'VALUES (?, ?)' % self.table, (session_id, expires))
+        with self._get_lock():
+            self._bloom.add(session_id)
+        if self._bloom.count > self._bloom.capacity:
+            self._rebuild()
+
+    def compact(self):
+        """Forget the ids of sessions that expired and rebuild the Bloom
+        filter.  Returns the number of ids removed.
+
+        Other processes keep the old ids in their filters until they
+        compact too, which only costs them a lookup for those ids.
+        """
+        now = time()
+        if self._memory is not None:
+            expired = [session_id for session_id, expires
+                       in self._memory.items()
+                       if expires is not None and expires <= now]
+            for session_id in expired:
+                del self._memory[session_id]
+            removed = len(expired)
+        else:
+            with self._connection() as connection:
+                removed = connection.execute(
+                    'DELETE FROM %s WHERE expires <= ?' % self.table,
+                    (now,)).rowcount
+        self._rebuild()
+        return removed
+
+    def __len__(self):
+        if self._memory is not None:
+            return len(self._memory)
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM %s' % self.table).fetchone()[0]
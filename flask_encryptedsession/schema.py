@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.schema
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Declared session schemas.
+
+    A generic session stores the name of every key in every cookie.  If the
+    keys an application uses are known up front they can be declared with
+    their types and defaults::
+
+        from flask_encryptedsession.schema import Field, SessionSchema
+
+        schema = SessionSchema([
+            Field('user_id', (int, long)),
+            Field('csrf_token', str),
+            Field('_permanent', bool, False),
+            Field('_flashes', list),
+        ])
+        app.session_interface = EncryptedCookieSessionInterface(
+            "/tmp/keys", schema=schema)
+
+    The cookie then holds the values of the fields by position instead of a
+    dict::
+
+        [version, mask, value, value, ..., {undeclared keys}]
+
+    `mask` has a bit set for every field that is present, so fields that
+    are not set cost nothing, and keys that were not declared still work
+    and are kept in the dict at the end.  The list is written with the
+    serializer of the session class, see :class:`SchemaSerializer`.
+
+    The session itself is an ordinary session: fields that are not set are
+    missing, exactly like keys of a dict.  Values assigned to a field are
+    checked against its type.  Fields whose name is a valid identifier and
+    not taken by an attribute of the session, such as ``key_id`` or
+    ``permanent``, can also be read as attributes, which return the default
+    of the field if it is not set::
+
+        if session.user_id is None:
+            ...
+
+    New fields can be appended to a schema without changing its version,
+    cookies written before simply do not have them.  Removing, renaming or
+    reordering fields needs a new `version`; cookies written with another
+    version are rejected and the client starts with an empty session.
+    Cookies written before the schema was introduced are loaded as usual.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+
+from flask_encryptedsession.encryptedcookie import SpillingCookieMixin
+from flask_encryptedsession.serializers import Serializer, get_serializer
+
+
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+_missing = object()
+
+
+class Field(object):
+    """A declared session key.
+
+    :param name: the key.
+    :param type: a type or tuple of types that values assigned to the field
+                 must be instances of.  `None` is always accepted.  `None`
+                 as the type accepts everything.
+    :param default: the value the attribute of the field reads as while the
+                    field is not set.  Should be immutable.
+    """
+
+    __slots__ = ('name', 'type', 'default')
+
+    def __init__(self, name, type=None, default=None):
+        self.name = name
+        self.type = type
+        self.default = default
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+
+class SessionSchema(object):
+    """The declared fields of a session.
+
+    :param fields: a list of :class:`Field` objects or ``(name, type,
+                   default)`` tuples.  The order is part of the cookie
+                   format.
+    :param version: the version written to every cookie.  Change it when
+                    fields are removed or reordered.
+    """
+
+    def __init__(self, fields, version=1):
+        self.fields = tuple(isinstance(field, Field) and field or
+                            Field(*field) for field in fields)
+        self.names = tuple(field.name for field in self.fields)
+        if len(set(self.names)) != len(self.names):
+            raise ValueError('field names must be unique')
+        self.version = version
+
+    def pack(self, items):
+        """Return the positional form of the dict `items`."""
+        extras = dict(items)
+        pop = extras.pop
+        packed = [self.version, 0]
+        append = packed.append
+        mask = 0
+        bit = 1
+        for name in self.names:
+            value = pop(name, _missing)
+            if value is not _missing:
+                mask |= bit
+                append(value)
+            bit <<= 1
+        packed[1] = mask
+        if extras:
+            append(extras)
+        return packed
+
+    def unpack(self, packed):
+        """Return the dict of items from the positional form `packed`.
+        Raises `ValueError` if it was written with another version of the
+        schema.
+        """
+        if not isinstance(packed, (list, tuple)) or len(packed) < 2:
+            raise ValueError('not a schema payload')
+        version, mask = packed[0], packed[1]
+        if version != self.version:
+            raise ValueError('schema version %r, expected %r'
+                             % (version, self.version))
+        if mask >> len(self.names):
+            raise ValueError('payload has undeclared fields')
+        items = {}
+        position = 2
+        for name in self.names:
+            if not mask:
+                break
+            if mask & 1:
+                items[name] = packed[position]
+                position += 1
+            mask >>= 1
+        rest = len(packed) - position
+        if rest:
+            if rest != 1 or not isinstance(packed[position], dict):
+                raise ValueError('malformed schema payload')
+            items.update(packed[position])
+        return items
+
+    def session_class(self, base):
+        """Return a subclass of the session class `base` that checks the
+        types of the declared fields and writes them by position with a
+        :class:`SchemaSerializer` around the serializer of `base`.
+        """
+        if issubclass(base, SpillingCookieMixin):
+            raise TypeError('spilling sessions cannot have a schema')
+        # the attributes sessions set on their instances stay attributes
+        taken = set(vars(base()))
+        attributes = {
+            'schema': self,
+            '_field_types': dict((field.name, field.type)
+                                 for field in self.fields),
+            'serializer': SchemaSerializer(self, base.serializer),
+        }
+        for field in self.fields:
+            if _identifier.match(field.name) and \
+               field.name not in taken and not hasattr(base, field.name):
+                attributes[field.name] = _field_property(field)
+        return type(base.__name__, (SchemaSessionMixin, base), attributes)
+
+
+class SchemaSerializer(Serializer):
+    """Writes dicts in the positional form of `schema` with the serializer
+    `inner`, whose tag is recorded so it can be changed later.  Only the
+    cookie classes that use it can load its payloads, so it is not
+    registered.
+    """
+
+    tag = 'S'
+
+    def __init__(self, schema, inner):
+        self.schema = schema
+        self.inner = inner
+
+    def dumps(self, obj):
+        return self.inner.tag + self.inner.dumps(self.schema.pack(obj))
+
+    def loads(self, data):
+        inner = self.inner
+        if data[:1] != inner.tag:
+            try:
+                inner = get_serializer(data[:1])
+            except KeyError:
+                raise ValueError('unknown serializer tag %r' % data[:1])
+        return self.schema.unpack(inner.loads(data[1:]))
+
+
+def _field_property(field):
+    name = field.name
+    default = field.default
+
+    def fget(self):
+        return self.get(name, default)
+
+    def fset(self, value):
+        self[name] = value
+
+    def fdel(self):
+        self.pop(name, None)
+
+    return property(fget, fset, fdel, 'The %r field.' % name)
+
+
+class SchemaSessionMixin(object):
+    """Checks the types of the values assigned to the fields of
+    :attr:`schema`.  Use :meth:`SessionSchema.session_class` to mix it into
+    a session class.
+    """
+
+    #: the :class:`SessionSchema`.
+    schema = None
+
+    #: maps field names to their type.
+    _field_types = {}
+
+    def __setitem__(self, key, value):
+        type = self._field_types.get(key)
+        if type is not None and value is not None and \
+           not isinstance(value, type):
+            raise TypeError('session field %r does not accept %r'
+                            % (key, value))
+        super(SchemaSessionMixin, self).__setitem__(key, value)
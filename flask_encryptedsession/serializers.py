@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.serializers
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Serializers turn the session dict into the bytes that get encrypted.
+
+    Every payload starts with a marker byte and the tag of the serializer
+    that wrote it, so cookies can be read whatever serializer is configured
+    now.  Payloads without the marker were written by older versions with
+    pickle and are still loaded as long as a legacy loader is passed to
+    :func:`load_payload`.
+
+    The built-in serializers are:
+
+    :class:`PickleSerializer`
+        pickle with the highest protocol, which is both smaller and faster
+        to load than the protocol 0 pickles older versions wrote.  This is
+        the default.
+    :class:`MsgpackSerializer`
+        msgpack, requires the `msgpack` package.  The smallest and fastest
+        choice when it is installed.  Tuples come back as lists.
+    :class:`JSONSerializer`
+        JSON.  Tuples come back as lists and strings as unicode.
+    :class:`TaggedBinarySerializer`
+        A compact pure Python format that round-trips `None`, booleans,
+        numbers, byte and unicode strings, lists, tuples, dicts and naive
+        :class:`~datetime.datetime` objects without executing any code
+        while loading.
+
+    Payloads can be compressed with :func:`compress_payload`.  Compressed
+    payloads start with their own marker byte followed by the algorithm, and
+    :func:`load_payload` inflates them transparently up to a size limit.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import cPickle as pickle
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+#: the first byte of every tagged payload.  Pickles never start with it.
+PAYLOAD_MARKER = '\x00'
+
+#: the first byte of a compressed payload, followed by the algorithm.
+COMPRESSED_MARKER = '\x01'
+
+#: the default limit for the size of an inflated payload.
+DEFAULT_MAX_SIZE = 64 * 1024
+
+_serializers = {}
+
+
+class Serializer(object):
+    """Base class for serializers.  Subclasses set a unique single
+    character :attr:`tag` and implement :meth:`dumps` and :meth:`loads`.
+    """
+
+    #: the character stored in front of the payload to identify the
+    #: serializer.  Must be unique among the registered serializers.
+    tag = None
+
+    def dumps(self, obj):
+        raise NotImplementedError()
+
+    def loads(self, data):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.tag)
+
+
+class PickleSerializer(Serializer):
+    tag = 'p'
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONSerializer(Serializer):
+    tag = 'j'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    tag = 'm'
+
+    def dumps(self, obj):
+        if msgpack is None:
+            raise RuntimeError('the msgpack package is not installed')
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        if msgpack is None:
+            raise RuntimeError('the msgpack package is not installed')
+        return msgpack.unpackb(data, raw=False)
+
+
+_EPOCH = datetime(1970, 1, 1)
+_pack_double = struct.Struct('>d').pack
+_unpack_double = struct.Struct('>d').unpack_from
+_bytes = [chr(i) for i in range(256)]
+
+
+def _encode_varint(value, parts):
+    # zigzag encoding keeps small negative numbers small
+    if value < 0:
+        _encode_length((-value << 1) - 1, parts)
+    else:
+        _encode_length(value << 1, parts)
+
+
+def _decode_varint(data, pos):
+    value, pos = _decode_length(data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def _encode_length(length, parts):
+    if length < 0x80:
+        parts.append(_bytes[length])
+        return
+    while length > 0x7f:
+        parts.append(chr(0x80 | (length & 0x7f)))
+        length >>= 7
+    parts.append(chr(length))
+
+
+def _decode_length(data, pos):
+    byte = ord(data[pos])
+    if byte < 0x80:
+        return byte, pos + 1
+    result = shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_none(obj, parts):
+    parts.append('N')
+
+
+def _encode_bool(obj, parts):
+    parts.append(obj and 'T' or 'F')
+
+
+def _encode_int(obj, parts):
+    parts.append('i')
+    _encode_varint(obj, parts)
+
+
+def _encode_str(obj, parts):
+    parts.append('s')
+    _encode_length(len(obj), parts)
+    parts.append(obj)
+
+
+def _encode_unicode(obj, parts):
+    obj = obj.encode('utf-8')
+    parts.append('u')
+    _encode_length(len(obj), parts)
+    parts.append(obj)
+
+
+def _encode_float(obj, parts):
+    parts.append('d')
+    parts.append(_pack_double(obj))
+
+
+def _encode_dict(obj, parts):
+    parts.append('m')
+    _encode_length(len(obj), parts)
+    # sorted so equal dicts always produce equal payloads
+    for key in sorted(obj):
+        _encode(key, parts)
+        _encode(obj[key], parts)
+
+
+def _encode_list(obj, parts, tag='l'):
+    parts.append(tag)
+    _encode_length(len(obj), parts)
+    for item in obj:
+        _encode(item, parts)
+
+
+def _encode_tuple(obj, parts):
+    _encode_list(obj, parts, 't')
+
+
+def _encode_datetime(obj, parts):
+    if obj.tzinfo is not None:
+        raise TypeError('cannot serialize timezone aware datetimes')
+    delta = obj - _EPOCH
+    parts.append('D')
+    _encode_varint((delta.days * 86400 + delta.seconds) * 1000000 +
+                   delta.microseconds, parts)
+
+
+_encoders = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    long: _encode_int,
+    str: _encode_str,
+    unicode: _encode_unicode,
+    float: _encode_float,
+    dict: _encode_dict,
+    list: _encode_list,
+    tuple: _encode_tuple,
+    datetime: _encode_datetime,
+}
+
+
+def _encode(obj, parts):
+    try:
+        encoder = _encoders[type(obj)]
+    except KeyError:
+        # subclasses of the supported types are encoded like their base
+        for base in type(obj).__mro__[1:]:
+            encoder = _encoders.get(base)
+            if encoder is not None:
+                break
+        else:
+            raise TypeError('cannot serialize %r' % (obj,))
+    encoder(obj, parts)
+
+
+def _decode_string(data, pos):
+    length, pos = _decode_length(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise ValueError('truncated payload')
+    return data[pos:end], end
+
+
+def _decode_unicode(data, pos):
+    value, pos = _decode_string(data, pos)
+    return value.decode('utf-8'), pos
+
+
+def _decode_dict(data, pos):
+    length, pos = _decode_length(data, pos)
+    result = {}
+    for _ in xrange(length):
+        key, pos = _decoders[data[pos]](data, pos + 1)
+        result[key], pos = _decoders[data[pos]](data, pos + 1)
+    return result, pos
+
+
+def _decode_list(data, pos):
+    length, pos = _decode_length(data, pos)
+    result = []
+    append = result.append
+    for _ in xrange(length):
+        item, pos = _decoders[data[pos]](data, pos + 1)
+        append(item)
+    return result, pos
+
+
+def _decode_tuple(data, pos):
+    result, pos = _decode_list(data, pos)
+    return tuple(result), pos
+
+
+def _decode_float(data, pos):
+    return _unpack_double(data, pos)[0], pos + 8
+
+
+def _decode_datetime(data, pos):
+    value, pos = _decode_varint(data, pos)
+    return _EPOCH + timedelta(microseconds=value), pos
+
+
+_decoders = {
+    'N': lambda data, pos: (None, pos),
+    'T': lambda data, pos: (True, pos),
+    'F': lambda data, pos: (False, pos),
+    'i': _decode_varint,
+    's': _decode_string,
+    'u': _decode_unicode,
+    'd': _decode_float,
+    'm': _decode_dict,
+    'l': _decode_list,
+    't': _decode_tuple,
+    'D': _decode_datetime,
+}
+
+
+class TaggedBinarySerializer(Serializer):
+    tag = 'b'
+
+    def dumps(self, obj):
+        parts = []
+        _encode(obj, parts)
+        return ''.join(parts)
+
+    def loads(self, data):
+        try:
+            value, pos = _decoders[data[0]](data, 1)
+        except KeyError, e:
+            raise ValueError('unknown type tag %r' % e.args[0])
+        except (IndexError, struct.error):
+            raise ValueError('truncated payload')
+        if pos != len(data):
+            raise ValueError('trailing data in payload')
+        return value
+
+
+def register_serializer(serializer):
+    """Make :func:`load_payload` understand payloads written by
+    `serializer`.  The built-in serializers are registered already.
+    """
+    tag = serializer.tag
+    if not isinstance(tag, str) or len(tag) != 1:
+        raise ValueError('serializer tags must be a single character')
+    existing = _serializers.get(tag)
+    if existing is not None and type(existing) is not type(serializer):
+        raise ValueError('tag %r is already used by %r' % (tag, existing))
+    _serializers[tag] = serializer
+
+
+def get_serializer(tag):
+    """Return the registered serializer for `tag` or raise `KeyError`."""
+    return _serializers[tag]
+
+
+def dump_payload(serializer, obj):
+    """Serialize `obj` with `serializer` and tag the result."""
+    return PAYLOAD_MARKER + serializer.tag + serializer.dumps(obj)
+
+
+def _deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _inflate(data, max_size):
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    result = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail:
+        raise ValueError('inflated payload exceeds %d bytes' % max_size)
+    result += decompressor.flush()
+    if len(result) > max_size:
+        raise ValueError('inflated payload exceeds %d bytes' % max_size)
+    return result
+
+
+#: maps the algorithm byte of compressed payloads to ``(compress,
+#: decompress)`` functions.
+_compressors = {
+    'z': (_deflate, _inflate),
+}
+
+
+def compress_payload(payload, level=6, algorithm='z'):
+    """Compress `payload` and tag the result with the algorithm.  Returns
+    `payload` unchanged if compressing does not make it smaller.
+    """
+    compress = _compressors[algorithm][0]
+    result = COMPRESSED_MARKER + algorithm + compress(payload, level)
+    if len(result) >= len(payload):
+        return payload
+    return result
+
+
+def load_payload(data, legacy=None, max_size=DEFAULT_MAX_SIZE,
+                 serializer=None):
+    """Load a payload written by :func:`dump_payload`, inflating it first
+    if it was compressed with :func:`compress_payload`.
+
+    :param legacy: the module or serializer used for untagged payloads,
+                   usually :mod:`pickle`.  If `None` untagged payloads are
+                   rejected with a `ValueError`.
+    :param max_size: the maximum size of an inflated payload.  Larger
+                     payloads raise a `ValueError` before they are fully
+                     inflated.
+    :param serializer: a serializer that loads the payloads tagged with its
+                       tag instead of the registered one, for serializers
+                       that are not registered.
+    """
+    if data[:1] == COMPRESSED_MARKER:
+        try:
+            decompress = _compressors[data[1:2]][1]
+        except KeyError:
+            raise ValueError('unknown compression %r' % data[1:2])
+        data = decompress(data[2:], max_size)
+        if data[:1] != PAYLOAD_MARKER:
+            raise ValueError('compressed payloads must be tagged')
+    if data[:1] == PAYLOAD_MARKER:
+        tag = data[1:2]
+        if serializer is None or serializer.tag != tag:
+            try:
+                serializer = _serializers[tag]
+            except KeyError:
+                raise ValueError('unknown serializer tag %r' % tag)
+        return serializer.loads(data[2:])
+    if legacy is None:
+        raise ValueError('untagged payloads are not accepted')
+    return legacy.loads(data)
+
+
+for _serializer in (PickleSerializer(), JSONSerializer(),
+                    MsgpackSerializer(), TaggedBinarySerializer()):
+    register_serializer(_serializer)
+del _serializer
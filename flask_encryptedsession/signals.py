@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.signals
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Signals sent while cookies are loaded and saved.  They need the
+    `blinker` library, like Flask's own signals; without it they are
+    silently not sent.
+
+    Durations are only measured for cookies that carry a `timings` dict,
+    which :class:`~flask_encryptedsession.encryptedsession.EncryptedCookieSessionInterface`
+    does for a sample of the requests (see its `timing_sample_rate`).  The
+    `timings` map names such as ``'decrypt'`` or ``'serialize'`` to seconds::
+
+        from flask_encryptedsession.signals import session_timed
+
+        def log_timings(app, session, timings):
+            app.logger.debug('session timings: %r', timings)
+
+        session_timed.connect(log_timings, app)
+
+    :license: BSD, see LICENSE for more details.
+"""
+from flask.signals import Namespace
+
+
+_signals = Namespace()
+
+#: sent by the cookie class after a cookie was decrypted and loaded, if it
+#: was timed.  Arguments: `cookie_size`, `payload_size` and `timings`.
+cookie_loaded = _signals.signal('cookie-loaded')
+
+#: sent by the cookie class whenever a cookie value is rejected and an
+#: empty cookie is used instead.  The `reason` argument is one of
+#: ``'malformed'``, ``'expired'``, ``'unknown_key'`` (not encrypted with
+#: any of the keys), ``'revoked'``, ``'decrypt'`` (tampered with) or
+#: ``'deserialize'``.
+cookie_rejected = _signals.signal('cookie-rejected')
+
+#: sent by a cookie after it was serialized and encrypted, if it was
+#: timed.  Arguments: `cookie_size`, `payload_size` and `timings`.
+cookie_encrypted = _signals.signal('cookie-encrypted')
+
+#: sent by a cookie whose encrypted value exceeded its `size_budget`
+#: when it was saved.  Arguments: `size` (after evicting keys), `budget`,
+#: `evicted` (the keys that were removed) and `key_sizes`, a list of
+#: ``(key, bytes)`` with the largest contributions to the payload first,
+#: which is only computed if the cookie still exceeds the budget.
+cookie_oversized = _signals.signal('cookie-oversized')
+
+#: sent by the application at the end of a timed request.  Arguments:
+#: `session` and `timings`.
+session_timed = _signals.signal('session-timed')
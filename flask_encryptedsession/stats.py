@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.stats
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Thread-safe counters used to report what the session machinery is
+    doing (cache hits, skipped saves and so on).
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+from threading import Lock
+
+
+class Counters(object):
+    """A small thread-safe collection of named integer counters.
+
+    >>> c = Counters()
+    >>> c.incr('hits')
+    >>> c['hits']
+    1
+    >>> c['misses']
+    0
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = {}
+
+    def incr(self, name, amount=1):
+        """Increment the counter `name` by `amount`."""
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def __getitem__(self, name):
+        return self._values.get(name, 0)
+
+    def snapshot(self):
+        """Return a copy of all counters as a plain dict."""
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        """Set all counters back to zero."""
+        with self._lock:
+            self._values.clear()
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.snapshot())
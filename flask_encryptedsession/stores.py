@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.stores
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Server side stores for session values that are too large to be carried
+    in the cookie on every request, see
+    :class:`~flask_encryptedsession.encryptedcookie.SpillingCookieMixin`::
+
+        from flask_encryptedsession.stores import SQLiteStore
+
+        app.session_interface = EncryptedCookieSessionInterface(
+            "/tmp/keys", spill_store=SQLiteStore("/tmp/sessions.db",
+                                                 ttl=31 * 86400))
+
+    A store maps string keys to byte strings and is only ever accessed with
+    batches of keys, so one round trip per request is enough.  Entries are
+    never changed in place: a new version of a value gets a new key.  To
+    back the sessions with another database implement
+    :meth:`SessionStore.get_many`, :meth:`SessionStore.set_many` and
+    :meth:`SessionStore.delete_many`; for Redis these map to ``MGET``, a
+    pipeline of ``SETEX`` and ``DEL``.
+
+    The values are encrypted inside the cookie only.  In the store they are
+    kept in the clear, so the store has to be as trustworthy as the server.
+
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import os
+import sqlite3
+from threading import Lock, local
+from time import time
+
+from flask_encryptedsession.stats import Counters
+
+
+class SessionStore(object):
+    """The interface of the stores.
+
+    :param ttl: the number of seconds entries are kept.  Should be at least
+                :attr:`~flask.Flask.permanent_session_lifetime`.  `None`
+                keeps entries until they are deleted.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.stats = Counters()
+
+    def get_many(self, keys):
+        """Return a dict with the values of the `keys` that were found."""
+        raise NotImplementedError()
+
+    def set_many(self, mapping):
+        """Store all key/value pairs of the dict `mapping`."""
+        raise NotImplementedError()
+
+    def delete_many(self, keys):
+        """Delete the `keys`, ignoring those that do not exist."""
+        raise NotImplementedError()
+
+    def _expires(self):
+        if self.ttl is None:
+            return None
+        return time() + self.ttl
+
+    def _count_get(self, keys, found):
+        self.stats.incr('gets')
+        self.stats.incr('hits', len(found))
+        self.stats.incr('misses', len(keys) - len(found))
+
+
+class MemoryStore(SessionStore):
+    """Keeps the values in a dict.  Only useful for tests and applications
+    served by a single process.  Expired entries are removed on access and
+    whenever `ttl` seconds have passed since the last sweep.
+    """
+
+    def __init__(self, ttl=None):
+        SessionStore.__init__(self, ttl)
+        self._entries = {}
+        self._lock = Lock()
+        self._next_prune = self._expires()
+
+    def get_many(self, keys):
+        now = time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] is not None and now > entry[1]:
+                    del self._entries[key]
+                    continue
+                found[key] = entry[0]
+        self._count_get(keys, found)
+        return found
+
+    def set_many(self, mapping):
+        expires = self._expires()
+        with self._lock:
+            for key, value in mapping.iteritems():
+                self._entries[key] = (value, expires)
+        self.stats.incr('writes', len(mapping))
+        if self._next_prune is not None and time() > self._next_prune:
+            self.prune()
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        self.stats.incr('deletes', len(keys))
+
+    def prune(self):
+        """Remove all expired entries."""
+        now = time()
+        with self._lock:
+            for key, (_, expires) in self._entries.items():
+                if expires is not None and now > expires:
+                    del self._entries[key]
+            self._next_prune = self._expires()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore(SessionStore):
+    """Keeps the values in a SQLite database file, which can be shared by
+    all processes on the machine.  Every thread uses its own connection,
+    and forked processes open new ones.
+
+    :param path: the path of the database file.  The table is created if it
+                 does not exist.
+    :param table: the name of the table.
+    :param timeout: how many seconds to wait for a lock held by another
+                    connection.
+    """
+
+    def __init__(self, path, ttl=None, table='session_values', timeout=5.0):
+        SessionStore.__init__(self, ttl)
+        self.path = path
+        self.table = table
+        self.timeout = timeout
+        self._local = local()
+        self._pid = os.getpid()
+        self._next_prune = self._expires()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, '
+                'value BLOB NOT NULL, expires REAL)' % table)
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            # SQLite connections must not be used across a fork
+            self._local = local()
+            self._pid = os.getpid()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.text_factory = str
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, keys):
+        found = {}
+        if keys:
+            keys = list(keys)
+            rows = self._connection().execute(
+                'SELECT key, value FROM %s WHERE key IN (%s) AND '
+                '(expires IS NULL OR expires > ?)' % (
+                    self.table, ', '.join('?' * len(keys))),
+                keys + [time()])
+            for key, value in rows:
+                found[key] = str(value)
+        self._count_get(keys, found)
+        return found
+
+    def set_many(self, mapping):
+        expires = self._expires()
+        with self._connection() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO %s (key, value, expires) '
+                'VALUES (?, ?, ?)' % self.table,
+                [(key, sqlite3.Binary(value), expires)
+                 for key, value in mapping.iteritems()])
+        self.stats.incr('writes', len(mapping))
+        if self._next_prune is not None and time() > self._next_prune:
+            self.prune()
+
+    def delete_many(self, keys):
+        with self._connection() as connection:
+            connection.executemany(
+                'DELETE FROM %s WHERE key = ?' % self.table,
+                [(key,) for key in keys])
+        self.stats.incr('deletes', len(keys))
+
+    def prune(self):
+        """Remove all expired entries."""
+        with self._connection() as connection:
+            connection.execute('DELETE FROM %s WHERE expires <= ?'
+                               % self.table, (time(),))
+        self._next_prune = self._expires()
@@ -1,9 +1,23 @@
 import unittest
 
 from flask_encryptedsession.tests import (
-    test_encryptedcookie, test_encryptedsession)
+    test_backends, test_batch, test_cache, test_encryptedcookie,
+    test_encryptedsession, test_keys, test_offload, test_revocation,
+    test_schema, test_serializers, test_signals, test_stores)
 
 
 suite1 = test_encryptedcookie.suite()
 suite2 = test_encryptedsession.suite()
-suite = unittest.TestSuite([suite1, suite2])
+suite3 = test_cache.suite()
+suite4 = test_keys.suite()
+suite5 = test_serializers.suite()
+suite6 = test_backends.suite()
+suite7 = test_signals.suite()
+suite8 = test_offload.suite()
+suite9 = test_batch.suite()
+suite10 = test_stores.suite()
+suite11 = test_revocation.suite()
+suite12 = test_schema.suite()
+suite = unittest.TestSuite([suite1, suite2, suite3, suite4, suite5, suite6,
+                            suite7, suite8, suite9, suite10, suite11,
+                            suite12])
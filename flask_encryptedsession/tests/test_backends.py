@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_backends
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the crypto backends.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import unittest
+
+from keyczar import keyczar
+from werkzeug.testsuite import WerkzeugTestCase
+
+from flask_encryptedsession.backends import (
+    AEADBackend, InvalidCiphertext, KeyRing, KeyczarBackend, b64decode,
+    get_backend)
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.keys import get_crypter
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+KEYS_DIR_BADKEY = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys_badkey')
+
+
+class KeyczarBackendTestCase(WerkzeugTestCase):
+
+    def test_associated_data(self):
+        backend = KeyczarBackend(KEYS_DIR)
+        ciphertext = backend.encrypt('payload', '1.123')
+        self.assert_equal(backend.decrypt(ciphertext, '1.123'), 'payload')
+        self.assert_raises(ValueError, backend.decrypt, ciphertext, '1.124')
+        self.assert_raises(ValueError, backend.encrypt, 'payload', 'a\nb')
+
+    def test_get_backend(self):
+        crypter = get_crypter(KEYS_DIR)
+        backend = get_backend(KEYS_DIR)
+        assert backend.crypter is crypter
+        # wrappers of the same crypter are equal, so cache entries match
+        self.assert_equal(backend, get_backend(crypter))
+        assert backend != get_backend(keyczar.Crypter.Read(KEYS_DIR))
+        assert get_backend(backend) is backend
+        assert get_backend(None) is None
+
+
+class AEADBackendTestCase(WerkzeugTestCase):
+
+    def test_round_trip(self):
+        for algorithm in ('aes-gcm', 'chacha20-poly1305'):
+            backend = AEADBackend(KEYS_DIR, algorithm)
+            ciphertext = backend.encrypt('payload', '1.123')
+            self.assert_equal(backend.decrypt(ciphertext, '1.123'),
+                              'payload')
+            self.assert_raises(Exception, backend.decrypt, ciphertext,
+                               '1.124')
+            self.assert_raises(Exception, backend.decrypt, ciphertext)
+
+    def test_shorter_than_keyczar(self):
+        data = 'x' * 100
+        aead = AEADBackend(KEYS_DIR).encrypt(data)
+        self.assert_equal(len(b64decode(aead)), 1 + 4 + 12 + 100 + 16)
+        assert len(aead) < len(KeyczarBackend(KEYS_DIR).encrypt(data))
+
+    def test_reads_other_formats(self):
+        gcm = AEADBackend(KEYS_DIR, 'aes-gcm')
+        chacha = AEADBackend(KEYS_DIR, 'chacha20-poly1305')
+        self.assert_equal(gcm.decrypt(chacha.encrypt('a', 'h'), 'h'), 'a')
+        old = KeyczarBackend(KEYS_DIR).encrypt('b', 'h')
+        self.assert_equal(gcm.decrypt(old, 'h'), 'b')
+
+    def test_other_keys(self):
+        ciphertext = AEADBackend(KEYS_DIR).encrypt('payload')
+        self.assert_raises(ValueError, AEADBackend(KEYS_DIR_BADKEY).decrypt,
+                           ciphertext)
+
+    def test_unknown_algorithm(self):
+        self.assert_raises(ValueError, AEADBackend, KEYS_DIR, 'rot13')
+
+    def test_cookie(self):
+        backend = AEADBackend(KEYS_DIR)
+        old = EncryptedCookie({'x': 42}, KEYS_DIR).serialize()
+        new = EncryptedCookie({'x': 42}, backend).serialize()
+        assert len(new) < len(old)
+        self.assert_equal(EncryptedCookie.unserialize(new, backend),
+                          {'x': 42})
+        self.assert_equal(EncryptedCookie.unserialize(old, backend),
+                          {'x': 42})
+        # the header is authenticated
+        tampered = '1.9999999999.' + new.split('.', 2)[2]
+        self.assert_equal(EncryptedCookie.unserialize(tampered, backend), {})
+
+
+class KeyRingTestCase(WerkzeugTestCase):
+
+    def test_key_ids(self):
+        backend = KeyczarBackend(KEYS_DIR)
+        crypter = backend.crypter
+        self.assert_equal(backend.primary_key_id, crypter.primary_key.hash_id)
+        self.assert_equal(backend.key_ids(), [crypter.primary_key.hash_id])
+        for ciphertext in (backend.encrypt('x'),
+                           AEADBackend(KEYS_DIR).encrypt('x')):
+            self.assert_equal(backend.key_id(ciphertext),
+                              backend.primary_key_id)
+        self.assert_raises(ValueError, backend.key_id, 'AA')
+
+    def test_rotation(self):
+        old = KeyczarBackend(KEYS_DIR_BADKEY)
+        ring = get_backend([KEYS_DIR, KEYS_DIR_BADKEY])
+        assert isinstance(ring, KeyRing)
+        self.assert_equal(ring.primary_key_id,
+                          KeyczarBackend(KEYS_DIR).primary_key_id)
+        self.assert_equal(len(ring.key_ids()), 2)
+        self.assert_equal(ring.decrypt(old.encrypt('old', 'h'), 'h'), 'old')
+        self.assert_equal(ring.decrypt(ring.encrypt('new')), 'new')
+        self.assert_raises(Exception, old.decrypt, ring.encrypt('new'))
+
+    def test_unknown_key(self):
+        ring = KeyRing([KEYS_DIR])
+        ciphertext = KeyczarBackend(KEYS_DIR_BADKEY).encrypt('x')
+        self.assert_raises(ValueError, ring.decrypt, ciphertext)
+        self.assert_raises(ValueError, KeyRing, [])
+
+    def test_ciphertext_length(self):
+        for backend in (KeyczarBackend(KEYS_DIR), AEADBackend(KEYS_DIR),
+                        AEADBackend(KEYS_DIR, 'chacha20-poly1305'),
+                        KeyRing([KEYS_DIR, KEYS_DIR_BADKEY])):
+            for size in (0, 1, 15, 16, 17, 100, 1000):
+                for associated_data in (None, '1.123'):
+                    self.assert_equal(
+                        backend.ciphertext_length(size, associated_data),
+                        len(backend.encrypt('x' * size, associated_data)))
+
+    def test_check(self):
+        ring = KeyRing([KEYS_DIR])
+        ciphertext = ring.encrypt('x')
+        self.assert_equal(ring.check(ciphertext), ring.primary_key_id)
+        for bad, reason in (
+                ('AA', 'malformed'),
+                (ciphertext[:-1] + '+', 'malformed'),
+                ('B' + ciphertext[1:], 'malformed'),
+                (KeyczarBackend(KEYS_DIR_BADKEY).encrypt('x'),
+                 'unknown_key')):
+            try:
+                ring.check(bad)
+            except InvalidCiphertext, e:
+                self.assert_equal(e.reason, reason)
+            else:
+                assert False, 'check accepted %r' % bad
+
+    def test_stale_cookie(self):
+        old = EncryptedCookie({'x': 42}, KEYS_DIR_BADKEY).serialize()
+        c = EncryptedCookie.unserialize(old, [KEYS_DIR, KEYS_DIR_BADKEY])
+        self.assert_equal(c, {'x': 42})
+        assert c.stale_key
+        assert c.should_save
+        assert not c.modified
+        c = EncryptedCookie.unserialize(c.serialize(), [KEYS_DIR])
+        self.assert_equal(c, {'x': 42})
+        assert not c.stale_key
+        assert not c.should_save
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(KeyczarBackendTestCase))
+    suite.addTest(unittest.makeSuite(AEADBackendTestCase))
+    suite.addTest(unittest.makeSuite(KeyRingTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
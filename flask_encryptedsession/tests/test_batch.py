@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_batch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests batch decoding and encoding of cookies.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import os
+import os.path
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+
+from werkzeug.testsuite import WerkzeugTestCase
+
+from flask_encryptedsession.batch import (
+    DecodeResult, EncodeResult, decode_cookies, encode_cookies, main)
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+KEYS_DIR_BADKEY = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys_badkey')
+
+
+class BatchTestCase(WerkzeugTestCase):
+
+    def make_cookies(self):
+        cookies = [EncryptedCookie({'n': i}, KEYS_DIR).serialize() + '\n'
+                   for i in range(20)]
+        cookies[3] = 'garbage\n'
+        cookies[7] = EncryptedCookie({'n': 7}, KEYS_DIR_BADKEY).serialize()
+        return cookies
+
+    def check_results(self, results):
+        self.assert_equal([result.index for result in results], range(20))
+        self.assert_equal(results[3].error, 'malformed')
+        self.assert_equal(results[7].error, 'unknown_key')
+        for i, result in enumerate(results):
+            if i not in (3, 7):
+                assert result.ok
+                self.assert_equal(result.session, {'n': i})
+
+    def test_decode(self):
+        self.check_results(list(decode_cookies(self.make_cookies(),
+                                               KEYS_DIR)))
+
+    def test_decode_processes(self):
+        self.check_results(list(decode_cookies(
+            iter(self.make_cookies()), KEYS_DIR, processes=2, chunksize=3)))
+
+    def test_encode(self):
+        sessions = [{'n': i} for i in range(10)]
+        results = list(encode_cookies(sessions, KEYS_DIR, processes=2,
+                                      chunksize=2))
+        self.assert_equal([result.index for result in results], range(10))
+        cookies = [result.cookie for result in results]
+        self.assert_equal(
+            [result.session for result in decode_cookies(cookies, KEYS_DIR)],
+            sessions)
+
+    def test_encode_errors(self):
+        sessions = [{'n': 0}, '{"n": 1}', '[1, 2]', '{"n":', [3]]
+        results = list(encode_cookies(sessions, KEYS_DIR))
+        self.assert_equal([result.ok for result in results],
+                          [True, True, False, False, False])
+        self.assert_equal(results[2].error, 'error: expected an object, '
+                                            'got list')
+        self.assert_equal(
+            [result.session for result in decode_cookies(
+                [result.cookie for result in results[:2]], KEYS_DIR)],
+            [{'n': 0}, {u'n': 1}])
+        self.assert_equal(EncodeResult(4, error='error: x').to_json(),
+                          {'index': 4, 'ok': False, 'error': 'error: x'})
+
+    def test_to_json(self):
+        result = DecodeResult(0, {'when': datetime(2012, 1, 2),
+                                  'raw': '\xff', 'tuple': (1, 2)},
+                              key_id='abc')
+        self.assert_equal(json.loads(json.dumps(result.to_json())), {
+            'index': 0, 'ok': True, 'expires': None, 'key_id': 'abc',
+            'session': {'when': '2012-01-02T00:00:00', 'raw': u'\ufffd',
+                        'tuple': [1, 2]}})
+        self.assert_equal(DecodeResult(1, error='expired').to_json(),
+                          {'index': 1, 'ok': False, 'error': 'expired'})
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, ''.join(self.make_cookies()[:5]) + '\n')
+        os.close(fd)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            main(['decode', '--keys', KEYS_DIR, '-j', '1', path])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            os.remove(path)
+        lines = [json.loads(line) for line in output.splitlines()]
+        self.assert_equal(len(lines), 6)
+        self.assert_equal(lines[0]['session'], {'n': 0})
+        self.assert_equal(lines[3], {'index': 3, 'ok': False,
+                                     'error': 'malformed'})
+        self.assert_equal(lines[5], {'index': 5, 'ok': False,
+                                     'error': 'empty'})
+
+    def test_encode_command(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, '{"n": 0}\n\n[1, 2]\n{"n":\n{"n": 4}\n')
+        os.close(fd)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            main(['encode', '--keys', KEYS_DIR, '-j', '1', path])
+            output = sys.stdout.getvalue()
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            os.remove(path)
+        lines = output.splitlines()
+        self.assert_equal(len(lines), 5)
+        self.assert_equal(lines[1:4], ['', '', ''])
+        self.assert_equal(
+            [result.session for result in decode_cookies(
+                [lines[0], lines[4]], KEYS_DIR)], [{'n': 0}, {'n': 4}])
+        errors = errors.splitlines()
+        self.assert_equal(len(errors), 2)
+        assert errors[0].startswith('line 3: error: ')
+        assert errors[1].startswith('line 4: error: ')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BatchTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
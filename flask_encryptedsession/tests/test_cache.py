@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the cache of decrypted cookies.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import unittest
+from datetime import datetime, timedelta
+
+from keyczar import keyczar
+from werkzeug.testsuite import WerkzeugTestCase
+
+from flask_encryptedsession.cache import (
+    DecryptCache, NegativeCache, _LinkedDict)
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+KEYS_DIR_BADKEY = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys_badkey')
+
+
+class CountingCrypter(object):
+    """Wraps a crypter and counts the calls to `Decrypt`."""
+
+    def __init__(self, crypter):
+        self.crypter = crypter
+        self.decrypts = 0
+
+    def Encrypt(self, data):
+        return self.crypter.Encrypt(data)
+
+    def Decrypt(self, data):
+        self.decrypts += 1
+        return self.crypter.Decrypt(data)
+
+    def __getattr__(self, name):
+        return getattr(self.crypter, name)
+
+
+class DecryptCacheTestCase(WerkzeugTestCase):
+
+    def setUp(self):
+        self.crypter = CountingCrypter(keyczar.Crypter.Read(KEYS_DIR))
+
+    def make_cookie(self, data):
+        return EncryptedCookie(data, self.crypter).serialize()
+
+    def test_hit_skips_decrypt(self):
+        cache = DecryptCache()
+        s = self.make_cookie({'x': 42})
+        c1 = EncryptedCookie.unserialize(s, self.crypter, cache)
+        c2 = EncryptedCookie.unserialize(s, self.crypter, cache)
+        assert c1 == c2 == {'x': 42}
+        assert c1 is not c2
+        assert not c2.new
+        assert not c2.modified
+        self.assert_equal(self.crypter.decrypts, 1)
+        self.assert_equal(cache.stats['hits'], 1)
+        self.assert_equal(cache.stats['misses'], 1)
+
+    def test_hits_are_isolated(self):
+        cache = DecryptCache()
+        s = self.make_cookie({'x': 42, 'flashes': [('message', 'Zap')]})
+        c1 = EncryptedCookie.unserialize(s, self.crypter, cache)
+        c1['x'] = 23
+        c1['flashes'].append(('message', 'Zip'))
+        c2 = EncryptedCookie.unserialize(s, self.crypter, cache)
+        self.assert_equal(c2, {'x': 42, 'flashes': [('message', 'Zap')]})
+        self.assert_equal(self.crypter.decrypts, 1)
+
+    def test_other_crypter_misses(self):
+        cache = DecryptCache()
+        s = self.make_cookie({'x': 42})
+        EncryptedCookie.unserialize(s, self.crypter, cache)
+        c = EncryptedCookie.unserialize(s, KEYS_DIR_BADKEY, cache)
+        self.assert_equal(c, {})
+
+    def test_expires(self):
+        cache = DecryptCache()
+        c = EncryptedCookie({'x': 42}, self.crypter)
+        s = c.serialize(datetime.utcnow() + timedelta(seconds=60))
+        self.assert_equal(EncryptedCookie.unserialize(s, self.crypter, cache),
+                          {'x': 42})
+        cache._entries.values()[0].expires -= 120
+        EncryptedCookie.unserialize(s, self.crypter, cache)
+        self.assert_equal(cache.stats['expired'], 1)
+        self.assert_equal(self.crypter.decrypts, 2)
+
+        s = c.serialize(datetime.utcnow() - timedelta(seconds=60))
+        self.assert_equal(EncryptedCookie.unserialize(s, self.crypter, cache),
+                          {})
+        self.assert_equal(EncryptedCookie.unserialize(s, self.crypter, cache),
+                          {})
+        # expired cookies are rejected without decrypting them
+        self.assert_equal(self.crypter.decrypts, 2)
+
+    def test_ttl(self):
+        cache = DecryptCache(ttl=60)
+        s = self.make_cookie({'x': 42})
+        EncryptedCookie.unserialize(s, self.crypter, cache)
+        cache._entries.values()[0].stored -= 120
+        EncryptedCookie.unserialize(s, self.crypter, cache)
+        self.assert_equal(self.crypter.decrypts, 2)
+
+    def test_bounds(self):
+        cache = DecryptCache(max_entries=2)
+        cookies = [self.make_cookie({'x': i}) for i in range(3)]
+        for s in cookies:
+            EncryptedCookie.unserialize(s, self.crypter, cache)
+        self.assert_equal(len(cache), 2)
+        self.assert_equal(cache.stats['evictions'], 1)
+        EncryptedCookie.unserialize(cookies[0], self.crypter, cache)
+        self.assert_equal(self.crypter.decrypts, 4)
+
+        cache = DecryptCache(max_bytes=700)
+        for s in cookies:
+            EncryptedCookie.unserialize(s, self.crypter, cache)
+        assert cache.size <= 700
+        assert len(cache) < 3
+
+
+    def test_linked_dict(self):
+        d = _LinkedDict()
+        for key in 'abcd':
+            d[key] = key.upper()
+        d['a'] = 'A2'
+        self.assert_equal(d.pop('b'), 'B')
+        self.assert_equal(d.pop('b', 1), 1)
+        d['b'] = 'B2'
+        self.assert_equal(len(d), 4)
+        self.assert_equal(d.get('a'), 'A2')
+        self.assert_equal([d.popitem() for _ in range(4)],
+                          [('a', 'A2'), ('c', 'C'), ('d', 'D'), ('b', 'B2')])
+        self.assert_raises(KeyError, d.popitem)
+        d['x'] = 1
+        d.clear()
+        self.assert_equal(len(d), 0)
+        self.assert_equal(d.get('x'), None)
+
+
+class NegativeCacheTestCase(WerkzeugTestCase):
+
+    def setUp(self):
+        self.crypter = CountingCrypter(keyczar.Crypter.Read(KEYS_DIR))
+
+    def test_forged_cookie_decrypted_once(self):
+        class CachingCookie(EncryptedCookie):
+            negative_cache = NegativeCache()
+
+        s = EncryptedCookie({'x': 42}, self.crypter).serialize()
+        # flip a bit of the signature so the structure stays valid
+        forged = s[:-2] + (s[-2] == 'A' and 'B' or 'A') + s[-1]
+        for i in range(3):
+            c = CachingCookie.unserialize(forged, self.crypter)
+            self.assert_equal(c, {})
+            self.assert_equal(c.rejected_reason, 'decrypt')
+        self.assert_equal(self.crypter.decrypts, 1)
+        self.assert_equal(CachingCookie.negative_cache.stats['hits'], 2)
+        self.assert_equal(CachingCookie.unserialize(s, self.crypter),
+                          {'x': 42})
+
+    def test_structural_rejects_not_cached(self):
+        class CachingCookie(EncryptedCookie):
+            negative_cache = NegativeCache()
+
+        for garbage, reason in (('1..' + 'A' * 100, 'unknown_key'),
+                                ('1..' + 'Z' * 100, 'malformed'),
+                                ('1..not base64!', 'malformed')):
+            c = CachingCookie.unserialize(garbage, self.crypter)
+            self.assert_equal(c.rejected_reason, reason)
+        self.assert_equal(len(CachingCookie.negative_cache), 0)
+        self.assert_equal(self.crypter.decrypts, 0)
+
+    def test_bounds(self):
+        cache = NegativeCache(max_entries=2, ttl=60)
+        for i in range(3):
+            cache.add(str(i), 'decrypt')
+        self.assert_equal(len(cache), 2)
+        self.assert_equal(cache.stats['evictions'], 1)
+        self.assert_equal(cache.get('0'), None)
+        self.assert_equal(cache.get('2'), 'decrypt')
+        key = cache._key('2')
+        cache._entries[key] = ('decrypt', cache._entries[key][1] - 120)
+        self.assert_equal(cache.get('2'), None)
+        cache.clear()
+        self.assert_equal(len(cache), 0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DecryptCacheTestCase))
+    suite.addTest(unittest.makeSuite(NegativeCacheTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,15 +7,23 @@
 
     :license: BSD, see LICENSE for more details.
 """
+import cPickle as pickle
 import os.path
+import time
 import unittest
+from datetime import datetime, timedelta
 
+from keyczar import keyczar
 from werkzeug.testsuite import WerkzeugTestCase
 
 from werkzeug.utils import parse_cookie
 from werkzeug.wrappers import Request, Response
 
-from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.backends import KeyczarBackend
+from flask_encryptedsession.encryptedcookie import (
+    CookieTooLarge, EncryptedCookie)
+from flask_encryptedsession.serializers import JSONSerializer
+from flask_encryptedsession.tests.test_cache import CountingCrypter
 
 
 KEYS_DIR = os.path.join(
@@ -58,6 +66,85 @@ class EncryptedCookieTestCase(WerkzeugTestCase):
             Exception, EncryptedCookie.unserialize, 'some string',
             KEYS_DIR_NONEXISTENT)
 
+    def test_serializer(self):
+        class JSONCookie(EncryptedCookie):
+            serializer = JSONSerializer()
+
+        c = JSONCookie({'x': (1, 2)}, KEYS_DIR)
+        s = c.serialize()
+        self.assert_equal(JSONCookie.unserialize(s, KEYS_DIR), {'x': [1, 2]})
+        # the serializer is recorded in the payload
+        self.assert_equal(EncryptedCookie.unserialize(s, KEYS_DIR),
+                          {'x': [1, 2]})
+        c = EncryptedCookie({'x': (1, 2)}, KEYS_DIR)
+        self.assert_equal(JSONCookie.unserialize(c.serialize(), KEYS_DIR),
+                          {'x': (1, 2)})
+
+    def test_compression(self):
+        class CompressedCookie(EncryptedCookie):
+            compress_threshold = 100
+
+        data = {'flags': dict(('feature_%d' % i, True) for i in range(50))}
+        s = CompressedCookie(data, KEYS_DIR).serialize()
+        assert len(s) < len(EncryptedCookie(data, KEYS_DIR).serialize()) / 2
+        self.assert_equal(EncryptedCookie.unserialize(s, KEYS_DIR), data)
+
+        c = CompressedCookie({'x': 42}, KEYS_DIR)
+        c.serialize()
+        self.assert_equal(c.payload_sizes[0], c.payload_sizes[1])
+
+        class LimitedCookie(EncryptedCookie):
+            max_payload_size = 100
+        self.assert_equal(LimitedCookie.unserialize(s, KEYS_DIR), {})
+
+    def test_legacy_pickle(self):
+        crypter = keyczar.Crypter.Read(KEYS_DIR)
+        s = crypter.Encrypt(pickle.dumps({'x': (1, 2)}))
+        self.assert_equal(EncryptedCookie.unserialize(s, crypter),
+                          {'x': (1, 2)})
+
+        class StrictCookie(EncryptedCookie):
+            accept_legacy_pickle = False
+        self.assert_equal(StrictCookie.unserialize(s, crypter), {})
+
+    def test_expires_header(self):
+        crypter = CountingCrypter(keyczar.Crypter.Read(KEYS_DIR))
+        c = EncryptedCookie({'x': 42}, crypter)
+        expires = datetime.utcnow() + timedelta(seconds=60)
+        s = c.serialize(expires)
+        version, timestamp, ciphertext = s.split('.')
+        self.assert_equal(version, '1')
+        assert abs(int(timestamp) - time.time() - 60) < 5
+        assert '_expires' not in c
+        self.assert_equal(EncryptedCookie.unserialize(s, crypter), {'x': 42})
+
+        # tampering with the cleartext expiration is detected
+        forged = '1.%d.%s' % (int(timestamp) + 3600, ciphertext)
+        self.assert_equal(EncryptedCookie.unserialize(forged, crypter), {})
+        forged = '1..%s' % ciphertext
+        self.assert_equal(EncryptedCookie.unserialize(forged, crypter), {})
+        self.assert_equal(crypter.decrypts, 3)
+
+        # expired cookies are rejected without decrypting
+        s = c.serialize(datetime.utcnow() - timedelta(seconds=60))
+        self.assert_equal(EncryptedCookie.unserialize(s, crypter), {})
+        self.assert_equal(crypter.decrypts, 3)
+
+        for bad in ('2.0.' + ciphertext, '1.x.' + ciphertext, '1.0'):
+            self.assert_equal(EncryptedCookie.unserialize(bad, crypter), {})
+
+        s = c.serialize()
+        assert s.startswith('1..')
+        self.assert_equal(EncryptedCookie.unserialize(s, crypter), {'x': 42})
+
+    def test_old_format(self):
+        crypter = keyczar.Crypter.Read(KEYS_DIR)
+        expires = int(time.time())
+        s = crypter.Encrypt(pickle.dumps({'x': 42, '_expires': expires + 60}))
+        self.assert_equal(EncryptedCookie.unserialize(s, crypter), {'x': 42})
+        s = crypter.Encrypt(pickle.dumps({'x': 42, '_expires': expires - 60}))
+        self.assert_equal(EncryptedCookie.unserialize(s, crypter), {})
+
     def test_wrapper_support(self):
         req = Request.from_values()
         resp = Response()
@@ -75,6 +162,136 @@ class EncryptedCookieTestCase(WerkzeugTestCase):
         assert c2 == c
 
 
+    def test_unchanged_payload(self):
+        c = EncryptedCookie({'x': 42, 'l': [1, 2]}, KEYS_DIR)
+        req = Request.from_values(headers={
+            'Cookie': 'session="%s"' % c.serialize()})
+        c2 = EncryptedCookie.load_cookie(req, crypter_or_keys_location=KEYS_DIR)
+        assert c2.payload_digest is not None
+        c2.modified = True
+        resp = Response()
+        assert not c2.save_cookie(resp)
+        assert 'set-cookie' not in resp.headers
+        assert c2.save_cookie(resp, force=True)
+        assert 'set-cookie' in resp.headers
+
+        c2['l'].append(3)
+        resp = Response()
+        assert c2.save_cookie(resp)
+        assert 'set-cookie' in resp.headers
+
+    def test_chunked_cookie(self):
+        def set_cookies(resp):
+            cookies = {}
+            for header in resp.headers.getlist('set-cookie'):
+                name, value = header.split(';')[0].split('=', 1)
+                cookies[name] = value
+            return cookies
+
+        def request(cookies):
+            return Request.from_values(headers={'Cookie': '; '.join(
+                '%s=%s' % item for item in cookies.iteritems())})
+
+        c = EncryptedCookie({'big': os.urandom(2000).encode('hex')},
+                            KEYS_DIR)
+        resp = Response()
+        c.save_cookie(resp, force=True)
+        cookies = set_cookies(resp)
+        self.assert_equal(sorted(cookies),
+                          ['session', 'session.0', 'session.1'])
+        assert cookies['session'].startswith('c2.')
+        assert len(cookies['session.0']) <= EncryptedCookie.max_cookie_size
+
+        c2 = EncryptedCookie.load_cookie(request(cookies),
+                                         crypter_or_keys_location=KEYS_DIR)
+        self.assert_equal(c2, c)
+        self.assert_equal(len(c2.loaded_chunks), 2)
+
+        # a missing or mismatched chunk rejects the whole cookie
+        for name, value in (('session.1', None), ('session.0', 'A' * 10)):
+            broken = dict(cookies)
+            if value is None:
+                del broken[name]
+            else:
+                broken[name] = value
+            c3 = EncryptedCookie.load_cookie(
+                request(broken), crypter_or_keys_location=KEYS_DIR)
+            self.assert_equal(c3, {})
+            self.assert_equal(c3.rejected_reason, 'malformed')
+
+        # a request without the cookie is not a rejection
+        c3 = EncryptedCookie.load_cookie(request({}),
+                                         crypter_or_keys_location=KEYS_DIR)
+        self.assert_equal(c3.rejected_reason, None)
+
+        # shrinking back to a single cookie deletes the chunks
+        c2['big'] = 'small'
+        resp = Response()
+        c2.save_cookie(resp)
+        cookies = set_cookies(resp)
+        self.assert_equal(cookies['session.0'], '')
+        self.assert_equal(cookies['session.1'], '')
+        assert cookies['session'].startswith('1.')
+        self.assert_equal(c2.loaded_chunks, [])
+
+    def test_small_cookie_not_chunked(self):
+        c = EncryptedCookie({'x': 42}, KEYS_DIR)
+        resp = Response()
+        c.save_cookie(resp, force=True)
+        self.assert_equal(len(resp.headers.getlist('set-cookie')), 1)
+
+    def test_size_budget(self):
+        encrypts = []
+
+        class CountingBackend(KeyczarBackend):
+            def encrypt(self, data, associated_data=None):
+                encrypts.append(data)
+                return KeyczarBackend.encrypt(self, data, associated_data)
+
+        class BudgetCookie(EncryptedCookie):
+            size_budget = 400
+            evictable_keys = ('absent', 'cache', 'recent')
+
+        backend = CountingBackend(KEYS_DIR)
+        c = BudgetCookie({'user': 'joe', 'cache': 'x' * 300,
+                          'recent': 'y' * 100}, backend)
+        resp = Response()
+        assert c.save_cookie(resp, force=True)
+        value = parse_cookie(resp.headers['set-cookie'])['session']
+        self.assert_equal(c.evicted_keys, ['cache'])
+        self.assert_equal(sorted(c), ['recent', 'user'])
+        self.assert_equal(c.cookie_size, len(value))
+        assert len(value) <= 400
+        # the size was predicted, so only the final payload was encrypted
+        self.assert_equal(len(encrypts), 1)
+        self.assert_equal(EncryptedCookie.unserialize(value, KEYS_DIR), c)
+
+        c['user'] = 'z' * 1000
+        resp = Response()
+        assert c.save_cookie(resp)
+        self.assert_equal(c.evicted_keys, ['recent'])
+        assert c.cookie_size > 400
+        self.assert_('set-cookie' in resp.headers)
+
+        BudgetCookie.budget_action = 'raise'
+        c['recent'] = 'y' * 100
+        try:
+            c.save_cookie(Response())
+        except CookieTooLarge, e:
+            self.assert_equal(e.budget, 400)
+            self.assert_equal(e.size, c.cookie_size)
+            self.assert_equal(e.key_sizes[0][0], 'user')
+        else:
+            assert False, 'expected CookieTooLarge'
+
+    def test_key_sizes(self):
+        c = EncryptedCookie({'small': 1, 'large': 'x' * 500, 'medium': 'y' * 50})
+        sizes = c.key_sizes()
+        self.assert_equal([key for key, _ in sizes],
+                          ['large', 'medium', 'small'])
+        assert 500 < sizes[0][1] < 520
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(EncryptedCookieTestCase))
@@ -12,15 +12,23 @@ from __future__ import with_statement
 
 import os.path
 import re
+import threading
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import flask
 from flask.testsuite import FlaskTestCase
+from keyczar import keyczar
 from werkzeug.http import parse_date
+from werkzeug.wrappers import Request, Response
 
+from flask_encryptedsession.cache import DecryptCache
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
 from flask_encryptedsession.encryptedsession import (
-    EncryptedCookieSessionInterface)
+    EncryptedCookieSession, EncryptedCookieSessionInterface,
+    LazyEncryptedCookieSession)
+from flask_encryptedsession.serializers import JSONSerializer
+from flask_encryptedsession.tests.test_cache import CountingCrypter
 
 
 KEYS_DIR = os.path.join(
@@ -197,6 +205,127 @@ class BasicFunctionalityTestCase(FlaskTestCase):
         match = re.search(r'\bexpires=([^;]+)', rv.headers['set-cookie'])
         self.assert_(match is None)
 
+    def test_decrypt_cache(self):
+        app = flask.Flask(__name__)
+        cache = DecryptCache()
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, decrypt_cache=cache)
+
+        @app.route('/set', methods=['POST'])
+        def set():
+            flask.session['value'] = flask.request.form['value']
+            return 'value set'
+
+        @app.route('/get')
+        def get():
+            return flask.session['value']
+
+        c = app.test_client()
+        c.post('/set', data={'value': '42'})
+        self.assert_equal(c.get('/get').data, '42')
+        self.assert_equal(c.get('/get').data, '42')
+        self.assert_equal(cache.stats['misses'], 1)
+        self.assert_equal(cache.stats['hits'], 1)
+
+    def test_serializer(self):
+        app = flask.Flask(__name__)
+        serializer = JSONSerializer()
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, serializer=serializer)
+        session_class = app.session_interface.session_class
+        assert issubclass(session_class, EncryptedCookieSession)
+        assert session_class.serializer is serializer
+        assert EncryptedCookieSession.serializer is not serializer
+
+        @app.route('/set')
+        def set():
+            flask.session['value'] = (1, 2)
+            return 'value set'
+
+        @app.route('/get')
+        def get():
+            return repr(flask.session['value'])
+
+        c = app.test_client()
+        c.get('/set')
+        self.assert_equal(c.get('/get').data, '[1, 2]')
+
+    def test_compression(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, compress_threshold=100)
+        self.assert_(app.session_interface.compression_ratio() is None)
+
+        @app.route('/set')
+        def set():
+            flask.session['value'] = 'x' * 1000
+            return 'value set'
+
+        @app.route('/get')
+        def get():
+            return flask.session['value']
+
+        c = app.test_client()
+        rv = c.get('/set')
+        self.assert_(len(rv.headers['set-cookie']) < 500)
+        self.assert_equal(c.get('/get').data, 'x' * 1000)
+        self.assert_(app.session_interface.compression_ratio() < 0.1)
+
+    def test_unchanged_session_not_saved(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR)
+
+        @app.route('/set')
+        def set():
+            flask.session['items'] = [1]
+            return 'value set'
+
+        @app.route('/touch')
+        def touch():
+            flask.session.modified = True
+            return 'touched'
+
+        @app.route('/append')
+        def append():
+            flask.session['items'].append(2)
+            flask.session.modified = True
+            return repr(flask.session['items'])
+
+        c = app.test_client()
+        self.assert_('set-cookie' in c.get('/set').headers)
+        self.assert_('set-cookie' not in c.get('/touch').headers)
+        rv = c.get('/append')
+        self.assert_('set-cookie' in rv.headers)
+        self.assert_equal(c.get('/touch').data, 'touched')
+        self.assert_equal(c.get('/append').data, '[1, 2, 2]')
+        stats = app.session_interface.stats
+        self.assert_equal(stats['saves_avoided'], 2)
+        self.assert_equal(stats['saves'], 3)
+
+    def test_unchanged_permanent_session(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR)
+
+        @app.before_request
+        def make_permanent():
+            flask.session.permanent = True
+
+        @app.route('/touch')
+        def touch():
+            flask.session.modified = True
+            return ''
+
+        c = app.test_client()
+        self.assert_('set-cookie' in c.get('/touch').headers)
+        # the expiration moves forward even though the data is the same
+        app.permanent_session_lifetime = timedelta(days=40)
+        rv = c.get('/touch')
+        self.assert_('set-cookie' in rv.headers)
+        expires = parse_date(re.search(r'\bexpires=([^;]+)',
+                                       rv.headers['set-cookie']).group(1))
+        self.assert_(expires - datetime.utcnow() > timedelta(days=39))
+        self.assert_equal(app.session_interface.stats['saves_avoided'], 0)
+
     def test_flashes(self):
         app = flask.Flask(__name__)
         app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR)
@@ -209,10 +338,387 @@ class BasicFunctionalityTestCase(FlaskTestCase):
             self.assert_(flask.session.modified)
             self.assert_equal(list(flask.get_flashed_messages()), ['Zap', 'Zip'])
 
+    def test_chunked_session(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR)
+
+        @app.route('/set')
+        def set():
+            flask.session['big'] = 'x' * 6000
+            flask.session['rnd'] = os.urandom(3000)
+            return 'value set'
+
+        @app.route('/get')
+        def get():
+            return str(len(flask.session.get('big', '')))
+
+        @app.route('/clear')
+        def clear():
+            flask.session.clear()
+            return 'cleared'
+
+        c = app.test_client()
+        rv = c.get('/set')
+        cookies = len(rv.headers.getlist('set-cookie'))
+        assert cookies > 2
+        self.assert_equal(c.get('/get').data, '6000')
+        # the manifest and every chunk are deleted
+        rv = c.get('/clear')
+        self.assert_equal(len(rv.headers.getlist('set-cookie')), cookies)
+        self.assert_equal(c.get('/get').data, '0')
+
+    def test_key_rotation(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR_BADKEY)
+
+        @app.route('/set')
+        def set():
+            flask.session['value'] = 42
+            return 'value set'
+
+        @app.route('/get')
+        def get():
+            return unicode(flask.session['value'])
+
+        c = app.test_client()
+        c.get('/set')
+        app.session_interface = interface = EncryptedCookieSessionInterface(
+            [KEYS_DIR, KEYS_DIR_BADKEY])
+        old_key = interface.crypter.backends[1].primary_key_id
+        new_key = interface.crypter.primary_key_id
+        # the old cookie is still read and encrypted again with the new key
+        rv = c.get('/get')
+        self.assert_equal(rv.data, '42')
+        self.assert_('set-cookie' in rv.headers)
+        rv = c.get('/get')
+        self.assert_equal(rv.data, '42')
+        self.assert_('set-cookie' not in rv.headers)
+        self.assert_equal(interface.key_usage(), {old_key: 1, new_key: 1})
+        self.assert_equal(interface.stale_key_ratio(), 0.5)
+        self.assert_equal(interface.stats['reencrypted'], 1)
+
+
+class RefreshPolicyTestCase(FlaskTestCase):
+
+    def make_app(self, **options):
+        app = flask.Flask(__name__)
+        app.permanent_session_lifetime = timedelta(days=10)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, refresh_threshold=0.5, **options)
+
+        @app.route('/login')
+        def login():
+            flask.session['user'] = 42
+            flask.session.permanent = True
+            return ''
+
+        @app.route('/user')
+        def user():
+            return str(flask.session.get('user'))
+
+        @app.route('/health')
+        def health():
+            return 'ok'
+        return app
+
+    def cookie(self, days_left):
+        c = EncryptedCookie({'user': 42, '_permanent': True}, KEYS_DIR)
+        return 'session="%s"' % c.serialize(
+            datetime.utcnow() + timedelta(days=days_left))
+
+    def assert_refreshed(self, rv):
+        self.assert_('set-cookie' in rv.headers)
+        match = re.search(r'\bexpires=([^;]+)', rv.headers['set-cookie'])
+        expires = parse_date(match.group())
+        self.assert_(expires - datetime.utcnow() > timedelta(days=9))
+
+    def test_refresh(self):
+        app = self.make_app()
+        c = app.test_client()
+        self.assert_('set-cookie' in c.get('/login').headers)
+        self.assert_('set-cookie' not in c.get('/user').headers)
+
+        c = app.test_client()
+        rv = c.get('/user', headers={'Cookie': self.cookie(6)})
+        self.assert_equal(rv.data, '42')
+        self.assert_('set-cookie' not in rv.headers)
+        rv = c.get('/user', headers={'Cookie': self.cookie(4)})
+        self.assert_equal(rv.data, '42')
+        self.assert_refreshed(rv)
+        self.assert_equal(app.session_interface.stats['refreshes'], 1)
+
+    def test_unchanged_data(self):
+        app = self.make_app()
+
+        @app.route('/touch')
+        def touch():
+            flask.session.modified = True
+            return ''
+
+        # the policy decides when the expiration is pushed forward
+        c = app.test_client()
+        rv = c.get('/touch', headers={'Cookie': self.cookie(8)})
+        self.assert_('set-cookie' not in rv.headers)
+        self.assert_equal(app.session_interface.stats['saves_avoided'], 1)
+        self.assert_refreshed(c.get('/touch',
+                                    headers={'Cookie': self.cookie(2)}))
+
+    def test_lazy_refresh(self):
+        app = self.make_app(lazy=True)
+        c = app.test_client()
+        rv = c.get('/health', headers={'Cookie': self.cookie(6)})
+        self.assert_('set-cookie' not in rv.headers)
+        rv = c.get('/health', headers={'Cookie': self.cookie(4)})
+        self.assert_refreshed(rv)
+        rv = c.get('/user', headers={'Cookie': rv.headers['set-cookie']})
+        self.assert_equal(rv.data, '42')
+
+    def test_no_policy(self):
+        app = self.make_app()
+        app.session_interface.refresh_threshold = None
+        rv = app.test_client().get('/user', headers={'Cookie': self.cookie(1)})
+        self.assert_('set-cookie' not in rv.headers)
+
+
+class LazySessionTestCase(FlaskTestCase):
+
+    def setUp(self):
+        self.crypter = CountingCrypter(keyczar.Crypter.Read(KEYS_DIR))
+
+    def test_lazy_session(self):
+        s = EncryptedCookieSession({'x': 42, 'y': 23}, self.crypter).serialize()
+        session = LazyEncryptedCookieSession.unserialize(s, self.crypter)
+        self.assert_(not session.loaded)
+        self.assert_(not session.new)
+        self.assert_equal(self.crypter.decrypts, 0)
+        self.assert_equal(session.get('x'), 42)
+        self.assert_(session.loaded)
+        self.assert_(not session.modified)
+        self.assert_equal(len(session), 2)
+        self.assert_equal(self.crypter.decrypts, 1)
+
+        for touch in (len, list, lambda s: s['x'], lambda s: 'x' in s,
+                      lambda s: s.items(), lambda s: s == {},
+                      lambda s: s.setdefault('z', 1)):
+            session = LazyEncryptedCookieSession.unserialize(s, self.crypter)
+            touch(session)
+            self.assert_(session.loaded)
+
+        session = LazyEncryptedCookieSession.unserialize(s, self.crypter)
+        session['z'] = 1
+        self.assert_(session.modified)
+        self.assert_equal(session, {'x': 42, 'y': 23, 'z': 1})
+
+        session = LazyEncryptedCookieSession.unserialize(s, KEYS_DIR_BADKEY)
+        self.assert_equal(session, {})
+
+    def test_save_untouched_session(self):
+        s = EncryptedCookieSession({'x': 42}, self.crypter).serialize()
+        for modified in (False, True):
+            session = LazyEncryptedCookieSession.unserialize(s, self.crypter)
+            session.modified = modified
+            response = Response()
+            assert session.save_cookie(response, force=True)
+            cookie = response.headers['set-cookie'].split(';')[0]
+            request = Request.from_values(headers={'Cookie': cookie})
+            self.assert_equal(EncryptedCookieSession.load_cookie(
+                request, crypter_or_keys_location=self.crypter), {'x': 42})
+
+    def test_untouched_session(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            self.crypter, lazy=True)
+
+        @app.route('/set')
+        def set():
+            flask.session['a'] = 1
+            return 'value set'
+
+        @app.route('/add')
+        def add():
+            flask.session['b'] = 2
+            return 'value set'
+
+        @app.route('/get')
+        def get():
+            return repr(sorted(flask.session.items()))
+
+        @app.route('/health')
+        def health():
+            return 'ok'
+
+        c = app.test_client()
+        c.get('/set')
+        rv = c.get('/health')
+        self.assert_('set-cookie' not in rv.headers)
+        self.assert_equal(self.crypter.decrypts, 0)
+        self.assert_equal(
+            app.session_interface.stats['untouched_sessions'], 1)
+        rv = c.get('/add')
+        self.assert_('set-cookie' in rv.headers)
+        self.assert_equal(c.get('/get').data, "[('a', 1), ('b', 2)]")
+        self.assert_equal(self.crypter.decrypts, 2)
+
+    def test_lazy_flashes(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, lazy=True)
+
+        @app.route('/flash')
+        def flash():
+            flask.flash('Zap')
+            return ''
+
+        @app.route('/messages')
+        def messages():
+            return ', '.join(flask.get_flashed_messages())
+
+        c = app.test_client()
+        c.get('/flash')
+        c.get('/flash')
+        self.assert_equal(c.get('/messages').data, 'Zap, Zap')
+        self.assert_equal(c.get('/messages').data, '')
+
+
+class CacheabilityTestCase(FlaskTestCase):
+
+    def test_accessed(self):
+        s = EncryptedCookieSession({'x': 42}, KEYS_DIR).serialize()
+        for cls in (EncryptedCookieSession, LazyEncryptedCookieSession):
+            session = cls.unserialize(s, KEYS_DIR)
+            self.assert_(not session.accessed)
+            session['y'] = 1
+            session.update(z=2)
+            del session['z']
+            self.assert_(session.modified)
+            self.assert_(not session.accessed)
+            for read in (len, list, lambda s: s['x'], lambda s: 'x' in s,
+                         lambda s: s.get('x'), lambda s: s.items(),
+                         lambda s: s.pop('y', None), lambda s: s.permanent):
+                session = cls.unserialize(s, KEYS_DIR)
+                read(session)
+                self.assert_(session.accessed)
+
+    def test_vary_and_report(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, cacheability_header='X-Session-Cache')
+
+        @app.route('/')
+        def index():
+            return 'anonymous'
+
+        @app.route('/login')
+        def login():
+            flask.session['user_id'] = 42
+            return 'logged in'
+
+        @app.route('/user')
+        def user():
+            return str(flask.session.get('user_id'))
+
+        @app.route('/flash')
+        def flash():
+            flask.flash('Zap')
+            return ', '.join(flask.get_flashed_messages())
+
+        @app.route('/logout')
+        def logout():
+            flask.session.clear()
+            return 'logged out'
+
+        c = app.test_client()
+        rv = c.get('/')
+        self.assert_('set-cookie' not in rv.headers)
+        self.assert_('vary' not in rv.headers)
+        self.assert_equal(rv.headers['X-Session-Cache'], 'cacheable')
+        # the flashes were consumed, so the new session is empty again
+        rv = c.get('/flash')
+        self.assert_equal(rv.data, 'Zap')
+        self.assert_('set-cookie' not in rv.headers)
+        self.assert_equal(rv.headers['vary'], 'Cookie')
+        self.assert_equal(rv.headers['X-Session-Cache'], 'read')
+
+        rv = c.get('/login')
+        self.assert_('set-cookie' in rv.headers)
+        self.assert_('vary' not in rv.headers)
+        self.assert_equal(rv.headers['X-Session-Cache'], 'write')
+        rv = c.get('/user')
+        self.assert_equal(rv.data, '42')
+        self.assert_equal(rv.headers['vary'], 'Cookie')
+        self.assert_('set-cookie' not in rv.headers)
+        self.assert_equal(rv.headers['X-Session-Cache'], 'read')
+        rv = c.get('/')
+        self.assert_equal(rv.headers['X-Session-Cache'], 'cacheable')
+        rv = c.get('/logout')
+        self.assert_('set-cookie' in rv.headers)
+        self.assert_equal(rv.headers['X-Session-Cache'], 'delete')
+
+        interface = app.session_interface
+        self.assert_equal(interface.uncacheable_reasons(),
+                          {'read': 2, 'write': 1, 'delete': 1})
+        self.assert_equal(interface.stats['cacheable_responses'], 2)
+        self.assert_equal(interface.stats['empty_new_sessions'], 1)
+
+
+class ConcurrencyTestCase(FlaskTestCase):
+
+    def run_threads(self, target, count=8):
+        errors = []
+
+        def run(index):
+            try:
+                target(index)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(index,))
+                   for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assert_equal(errors, [])
+
+    def test_shared_interface(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, decrypt_cache=DecryptCache(max_entries=4))
+
+        @app.route('/<name>')
+        def count(name):
+            assert flask.session.get('name', name) == name
+            flask.session['name'] = name
+            flask.session['count'] = flask.session.get('count', 0) + 1
+            return str(flask.session['count'])
+
+        def client(index):
+            c = app.test_client()
+            for i in range(1, 31):
+                assert c.get('/thread%d' % index).data == str(i)
+        self.run_threads(client)
+        self.assert_equal(app.session_interface.stats['saves'], 8 * 30)
+
+    def test_shared_backend(self):
+        session_class = EncryptedCookieSessionInterface(KEYS_DIR).session_class
+        crypter = session_class._get_crypter(KEYS_DIR)
+
+        def roundtrip(index):
+            for i in range(100):
+                data = '%d-%d' % (index, i)
+                header = '1.%d' % i
+                assert crypter.decrypt(crypter.encrypt(data, header),
+                                       header) == data
+        self.run_threads(roundtrip)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BasicFunctionalityTestCase))
+    suite.addTest(unittest.makeSuite(CacheabilityTestCase))
+    suite.addTest(unittest.makeSuite(ConcurrencyTestCase))
+    suite.addTest(unittest.makeSuite(LazySessionTestCase))
+    suite.addTest(unittest.makeSuite(RefreshPolicyTestCase))
     return suite
 
 
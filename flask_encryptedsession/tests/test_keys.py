@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_keys
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the crypter registry.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from werkzeug.testsuite import WerkzeugTestCase
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.keys import (
+    CrypterRegistry, get_crypter, preload, registry, reload_crypters)
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+KEYS_DIR_NONEXISTENT = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys_nonexistent')
+
+
+class CrypterRegistryTestCase(WerkzeugTestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        os.rmdir(self.location)
+        shutil.copytree(KEYS_DIR, self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_shared_crypter(self):
+        assert get_crypter(KEYS_DIR) is get_crypter(KEYS_DIR)
+        c = EncryptedCookie({'x': 42}, KEYS_DIR)
+        assert c.crypter.crypter is get_crypter(KEYS_DIR)
+        c2 = EncryptedCookie.unserialize(c.serialize(), KEYS_DIR)
+        assert c2.crypter.crypter is c.crypter.crypter
+        self.assert_equal(c2, {'x': 42})
+
+    def test_reload(self):
+        registry = CrypterRegistry()
+        crypter = registry.get(self.location)
+        assert registry.get(self.location) is crypter
+        registry.reload(self.location)
+        assert self.location not in registry
+        assert registry.get(self.location) is not crypter
+
+    def test_mtime_change(self):
+        registry = CrypterRegistry(check_interval=0)
+        crypter = registry.get(self.location)
+        assert registry.get(self.location) is crypter
+        meta = os.path.join(self.location, 'meta')
+        mtime = os.stat(meta).st_mtime + 10
+        os.utime(meta, (mtime, mtime))
+        assert registry.get(self.location) is not crypter
+
+    def test_check_interval(self):
+        registry = CrypterRegistry(check_interval=3600)
+        crypter = registry.get(self.location)
+        meta = os.path.join(self.location, 'meta')
+        mtime = os.stat(meta).st_mtime + 10
+        os.utime(meta, (mtime, mtime))
+        assert registry.get(self.location) is crypter
+
+    def test_fail_to_read_keys(self):
+        registry = CrypterRegistry()
+        self.assert_raises(Exception, registry.get, KEYS_DIR_NONEXISTENT)
+        assert KEYS_DIR_NONEXISTENT not in registry
+        self.assert_raises(Exception, registry.get, KEYS_DIR_NONEXISTENT)
+
+    def test_preload(self):
+        preload(self.location)
+        try:
+            assert self.location in registry
+            c = EncryptedCookie({'x': 42}, self.location)
+            assert c.crypter.crypter is registry.get(self.location)
+        finally:
+            reload_crypters(self.location)
+
+    def test_forked(self):
+        registry = CrypterRegistry(check_interval=0)
+        crypter = registry.get(self.location)
+        # a lock held by a thread of the parent when the process forked
+        registry._lock.acquire()
+        registry._pid = -1
+        assert registry.get(self.location) is crypter
+
+        registry._lock.acquire()
+        registry._pid = -1
+        registry.reload()
+        assert self.location not in registry
+
+    def test_lazy_imports(self):
+        process = subprocess.Popen([sys.executable, '-c', (
+            'import sys\n'
+            'import flask_encryptedsession.encryptedsession\n'
+            'print sorted(name for name in sys.modules if name.split(".")[0]'
+            ' in ("keyczar", "Crypto", "pyasn1", "cryptography"))')],
+            stdout=subprocess.PIPE)
+        self.assert_equal(process.communicate()[0].strip(), '[]')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CrypterRegistryTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_offload
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests offloading session crypto to a thread pool.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import threading
+import unittest
+
+import flask
+from flask.testsuite import FlaskTestCase
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.offload import (
+    BoundedExecutor, InlineResult, OffloadingSessionInterface)
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+
+
+class BoundedExecutorTestCase(FlaskTestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(threads=1, max_pending=1)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_submit(self):
+        result = self.executor.submit(lambda x, y: x + y, 1, 2)
+        self.assert_equal(result.get(1), 3)
+        result = self.executor.submit(lambda: 1 / 0)
+        self.assert_raises(ZeroDivisionError, result.get, 1)
+        self.assert_equal(self.executor.stats['offloaded'], 2)
+
+    def test_saturated(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def wait():
+            started.set()
+            release.wait(5)
+            return threading.current_thread()
+
+        busy = self.executor.submit(wait)
+        started.wait(5)
+        result = self.executor.submit(threading.current_thread)
+        assert isinstance(result, InlineResult)
+        assert result.get() is threading.current_thread()
+        self.assert_equal(self.executor.stats['saturated'], 1)
+        release.set()
+        assert busy.get(5) is not threading.current_thread()
+        # the slot is free again
+        result = self.executor.submit(threading.current_thread)
+        assert result.get(5) is not threading.current_thread()
+
+    def test_inline_result(self):
+        result = InlineResult(lambda: 1 / 0, ())
+        assert result.ready()
+        assert not result.successful()
+        self.assert_raises(ZeroDivisionError, result.get)
+
+
+class OffloadingSessionInterfaceTestCase(FlaskTestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(threads=2)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def make_interface(self, **options):
+        return OffloadingSessionInterface(KEYS_DIR, executor=self.executor,
+                                          **options)
+
+    def test_round_trip(self):
+        app = flask.Flask(__name__)
+        interface = self.make_interface(inline_threshold=0)
+        value = EncryptedCookie({'x': 42}, KEYS_DIR).serialize()
+        with app.test_request_context(
+                headers=[('Cookie', 'session=' + value)]):
+            session = interface.open_session_async(
+                app, flask.request).get(5)
+            self.assert_equal(session, {'x': 42})
+            session['y'] = 23
+            response = app.response_class()
+            interface.save_session_async(app, session, response).get(5)
+        self.assert_equal(self.executor.stats['offloaded'], 2)
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+        self.assert_equal(
+            EncryptedCookie.unserialize(cookie.split('=', 1)[1], KEYS_DIR),
+            {'x': 42, 'y': 23})
+
+    def test_inline(self):
+        app = flask.Flask(__name__)
+        interface = self.make_interface(lazy=True)
+        value = EncryptedCookie({'x': 42}, KEYS_DIR).serialize()
+        with app.test_request_context(
+                headers=[('Cookie', 'session=' + value)]):
+            result = interface.open_session_async(app, flask.request)
+            assert isinstance(result, InlineResult)
+            session = result.get()
+            # lazy sessions are loaded by the executor
+            assert session.loaded
+            result = interface.save_session_async(
+                app, session, app.response_class())
+            assert isinstance(result, InlineResult)
+        self.assert_equal(interface.stats['inline_opens'], 1)
+        self.assert_equal(interface.stats['inline_saves'], 1)
+        self.assert_equal(self.executor.stats['offloaded'], 0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BoundedExecutorTestCase))
+    suite.addTest(unittest.makeSuite(OffloadingSessionInterfaceTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_revocation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests session ids and revoking sessions.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+import flask
+from flask.testsuite import FlaskTestCase
+from keyczar import keyczar
+
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+from flask_encryptedsession.revocation import BloomFilter, RevocationList
+from flask_encryptedsession.tests.test_cache import CountingCrypter
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+
+
+class BloomFilterTestCase(FlaskTestCase):
+
+    def test_membership(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('id%d' % i)
+        for i in range(1000):
+            assert 'id%d' % i in bloom
+        false_positives = sum(1 for i in range(10000)
+                              if 'other%d' % i in bloom)
+        assert false_positives < 300
+
+
+class RevocationListTestCase(FlaskTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'revoked.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check_revoke(self, revoked):
+        assert not revoked.is_revoked('a')
+        revoked.revoke('a', time.time() + 60)
+        revoked.revoke('b', time.time() - 60)
+        revoked.revoke('c')
+        assert revoked.is_revoked('a')
+        assert revoked.is_revoked('b')
+        assert not revoked.is_revoked('d')
+        self.assert_equal(revoked.compact(), 1)
+        self.assert_equal(len(revoked), 2)
+        assert not revoked.is_revoked('b')
+        assert revoked.is_revoked('c')
+
+    def test_memory(self):
+        self.check_revoke(RevocationList())
+
+    def test_sqlite(self):
+        self.check_revoke(RevocationList(self.path))
+
+    def test_reload(self):
+        first = RevocationList(self.path, reload_interval=0)
+        second = RevocationList(self.path, reload_interval=None)
+        second.revoke('a')
+        assert first.is_revoked('a')
+        second.revoke('b')
+        first.reload()
+        self.assert_equal(first.stats['reloads'], 2)
+        assert 'b' in first._bloom
+
+    def test_concurrent_reload(self):
+        revoked = RevocationList(self.path, reload_interval=60)
+        revoked._next_reload = 0
+        # threads waiting for the lock find the reload done
+        revoked._lock.acquire()
+        threads = [threading.Thread(target=revoked.is_revoked, args=('a',))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        revoked._schedule_reload()
+        revoked._lock.release()
+        for thread in threads:
+            thread.join()
+        self.assert_equal(revoked.stats['reloads'], 0)
+        revoked.reload()
+        self.assert_equal(revoked.stats['reloads'], 1)
+
+    def test_forked(self):
+        revoked = RevocationList(self.path, reload_interval=0)
+        revoked.revoke('a')
+        connection = revoked._connection()
+        # a lock held by a thread of the parent when the process forked
+        revoked._lock.acquire()
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            # a deadlocked child dies instead of hanging the test
+            signal.alarm(10)
+            try:
+                ok = revoked.is_revoked('a') and \
+                    revoked._connection() is not connection
+                revoked.revoke('b')
+                os.write(write, ok and '1' or '0')
+            finally:
+                os._exit(0)
+        os.close(write)
+        result = os.read(read, 1)
+        os.close(read)
+        os.waitpid(pid, 0)
+        revoked._lock.release()
+        self.assert_equal(result, '1')
+        assert revoked.is_revoked('b')
+
+    def test_grow(self):
+        revoked = RevocationList(capacity=10)
+        for i in range(25):
+            revoked.revoke('id%d' % i)
+        assert revoked._bloom.capacity >= 25
+        for i in range(25):
+            assert revoked.is_revoked('id%d' % i)
+
+
+class SessionIdTestCase(FlaskTestCase):
+
+    def setUp(self):
+        self.revoked = RevocationList()
+
+        class RevocableCookie(EncryptedCookie):
+            session_ids = True
+            revocation_list = self.revoked
+        self.cookie_class = RevocableCookie
+
+    def test_session_id(self):
+        c = self.cookie_class({'x': 42}, KEYS_DIR)
+        s = c.serialize()
+        version, expires, session_id, ciphertext = s.split('.')
+        self.assert_equal(version, '2')
+        self.assert_equal(session_id, c.session_id)
+        c2 = self.cookie_class.unserialize(s, KEYS_DIR)
+        self.assert_equal(c2.session_id, c.session_id)
+        self.assert_equal(c2, {'x': 42})
+        # the id is kept when the session is saved again
+        c2['y'] = 23
+        assert c2.serialize().split('.')[2] == c.session_id
+        # plain cookie classes read the new format too
+        self.assert_equal(EncryptedCookie.unserialize(s, KEYS_DIR),
+                          {'x': 42})
+        # the session id is authenticated
+        forged = '.'.join((version, expires, 'A' * len(session_id),
+                           ciphertext))
+        self.assert_equal(self.cookie_class.unserialize(forged, KEYS_DIR),
+                          {})
+
+    def test_revoked(self):
+        crypter = CountingCrypter(keyczar.Crypter.Read(KEYS_DIR))
+        c = self.cookie_class({'x': 42}, crypter)
+        s = c.serialize()
+        self.revoked.revoke(c.session_id)
+        c2 = self.cookie_class.unserialize(s, crypter)
+        self.assert_equal(c2, {})
+        self.assert_equal(c2.rejected_reason, 'revoked')
+        self.assert_equal(crypter.decrypts, 0)
+
+
+class RevokeSessionTestCase(FlaskTestCase):
+
+    def test_revoke_session(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, revocation_list=RevocationList())
+
+        @app.route('/login')
+        def login():
+            flask.session['user'] = 42
+            return ''
+
+        @app.route('/user')
+        def user():
+            return str(flask.session.get('user'))
+
+        @app.route('/logout')
+        def logout():
+            app.session_interface.revoke_session(flask.session)
+            return ''
+
+        c = app.test_client()
+        rv = c.get('/login')
+        stolen = rv.headers['set-cookie'].split(';')[0]
+        self.assert_equal(c.get('/user').data, '42')
+        c.get('/logout')
+        self.assert_equal(c.get('/user').data, 'None')
+        rv = app.test_client().get('/user', headers={'Cookie': stolen})
+        self.assert_equal(rv.data, 'None')
+        self.assert_equal(app.session_interface.stats['revoked_sessions'], 1)
+        self.assert_equal(app.session_interface.stats['rejected:revoked'], 1)
+
+        app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR)
+        with app.test_request_context():
+            self.assert_raises(RuntimeError,
+                               app.session_interface.revoke_session,
+                               flask.session)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BloomFilterTestCase))
+    suite.addTest(unittest.makeSuite(RevocationListTestCase))
+    suite.addTest(unittest.makeSuite(SessionIdTestCase))
+    suite.addTest(unittest.makeSuite(RevokeSessionTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
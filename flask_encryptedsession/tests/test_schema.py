@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_schema
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests sessions with a declared schema.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import unittest
+
+import flask
+from flask.testsuite import FlaskTestCase
+from keyczar import keyczar
+
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSession, EncryptedCookieSessionInterface,
+    LazyEncryptedCookieSession)
+from flask_encryptedsession.schema import Field, SessionSchema
+from flask_encryptedsession.serializers import JSONSerializer
+from flask_encryptedsession.stores import MemoryStore
+from flask_encryptedsession.tests.test_cache import CountingCrypter
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+
+SCHEMA = SessionSchema([
+    Field('user_id', (int, long)),
+    ('csrf_token', str, None),
+    Field('locale', str, 'en'),
+    Field('_permanent', bool, False),
+])
+
+
+class SchemaSessionTestCase(FlaskTestCase):
+
+    def setUp(self):
+        self.crypter = CountingCrypter(keyczar.Crypter.Read(KEYS_DIR))
+        self.session_class = SCHEMA.session_class(EncryptedCookieSession)
+
+    def test_round_trip(self):
+        session = self.session_class({'user_id': 42, 'other': [1, 2]},
+                                     self.crypter)
+        assert not session.modified
+        session['csrf_token'] = 'abc'
+        assert session.modified
+        s = session.serialize()
+        payload = session._dumps()
+        assert 'user_id' not in payload
+        assert 'other' in payload
+        assert len(payload) < len(
+            EncryptedCookieSession(dict(session), self.crypter)._dumps())
+
+        loaded = self.session_class.unserialize(s, self.crypter)
+        self.assert_equal(loaded, {'user_id': 42, 'csrf_token': 'abc',
+                                   'other': [1, 2]})
+        assert not loaded.modified
+        self.assert_equal(dict(loaded), {'user_id': 42, 'csrf_token': 'abc',
+                                         'other': [1, 2]})
+        # other cookie classes cannot read the payload
+        rejected = EncryptedCookieSession.unserialize(s, self.crypter)
+        self.assert_equal(rejected.rejected_reason, 'deserialize')
+
+    def test_mapping(self):
+        session = self.session_class({'user_id': 42, 'other': 1})
+        self.assert_equal(len(session), 2)
+        self.assert_equal(sorted(session), ['other', 'user_id'])
+        self.assert_equal(session['user_id'], 42)
+        assert 'user_id' in session
+        assert 'locale' not in session
+        self.assert_raises(KeyError, lambda: session['locale'])
+        self.assert_equal(session.get('locale', 'fr'), 'fr')
+        self.assert_equal(session.setdefault('locale', 'de'), 'de')
+        self.assert_equal(session.setdefault('locale', 'fr'), 'de')
+        session.update({'csrf_token': 'abc'}, other=2)
+        self.assert_equal(session, {'user_id': 42, 'locale': 'de',
+                                    'csrf_token': 'abc', 'other': 2})
+        self.assert_equal(session.pop('locale'), 'de')
+        self.assert_equal(session.pop('locale', None), None)
+        self.assert_raises(KeyError, session.pop, 'locale')
+        del session['csrf_token']
+        self.assert_raises(KeyError, session.__delitem__, 'csrf_token')
+        session.clear()
+        self.assert_equal(session, {})
+        assert not session
+
+    def test_types_and_defaults(self):
+        session = self.session_class()
+        self.assert_raises(TypeError, session.__setitem__, 'user_id', '42')
+        session['user_id'] = None
+        self.assert_equal(session.locale, 'en')
+        assert 'locale' not in session
+        session.locale = 'de'
+        self.assert_equal(session['locale'], 'de')
+        del session.locale
+        self.assert_equal(session.locale, 'en')
+        # names taken by the session class stay what they are
+        assert not session.permanent
+        session.permanent = True
+        self.assert_equal(session['_permanent'], True)
+
+    def test_accessed(self):
+        session = self.session_class({'user_id': 42, 'other': 1})
+        session['locale'] = 'de'
+        session.user_id = 23
+        del session['other']
+        assert not session.accessed
+        for read in (lambda s: s['user_id'], lambda s: s.locale):
+            session = self.session_class({'user_id': 42})
+            read(session)
+            assert session.accessed
+
+    def test_taken_names(self):
+        schema = SessionSchema([Field(name) for name in (
+            'key_id', 'crypter', 'session_id', 'expires_at', 'user_id')])
+        for base in (EncryptedCookieSession, LazyEncryptedCookieSession):
+            cls = schema.session_class(base)
+            session = cls({'key_id': 'k', 'session_id': 's'}, self.crypter)
+            assert not session.modified
+            self.assert_equal(session.key_id, None)
+            assert session.crypter is not None
+            session = cls.unserialize(session.serialize(), self.crypter)
+            self.assert_equal(session, {'key_id': 'k', 'session_id': 's'})
+            assert session.key_id != 'k'
+            assert not session.modified
+            self.assert_equal(session.user_id, None)
+
+    def test_versions(self):
+        s = self.session_class({'user_id': 42}, self.crypter).serialize()
+        appended = SessionSchema(SCHEMA.fields + (Field('cart', list),))
+        cls = appended.session_class(EncryptedCookieSession)
+        self.assert_equal(cls.unserialize(s, self.crypter), {'user_id': 42})
+
+        changed = SessionSchema(SCHEMA.fields[1:], version=2)
+        cls = changed.session_class(EncryptedCookieSession)
+        session = cls.unserialize(s, self.crypter)
+        self.assert_equal(session, {})
+        self.assert_equal(session.rejected_reason, 'deserialize')
+
+        # cookies written before the schema was introduced still load
+        s = EncryptedCookieSession({'user_id': 42, 'x': 1},
+                                   self.crypter).serialize()
+        session = self.session_class.unserialize(s, self.crypter)
+        self.assert_equal(session, {'user_id': 42, 'x': 1})
+
+    def test_inner_serializer(self):
+        json_class = type('JSONSession', (EncryptedCookieSession,),
+                          {'serializer': JSONSerializer()})
+        cls = SCHEMA.session_class(json_class)
+        s = cls({'user_id': 42, 'x': 1}, self.crypter).serialize()
+        self.assert_equal(cls.unserialize(s, self.crypter),
+                          {'user_id': 42, u'x': 1})
+        self.assert_equal(self.session_class.unserialize(s, self.crypter),
+                          {'user_id': 42, u'x': 1})
+
+    def test_lazy(self):
+        cls = SCHEMA.session_class(LazyEncryptedCookieSession)
+        s = cls({'user_id': 42, 'x': 1}, self.crypter).serialize()
+        session = cls.unserialize(s, self.crypter)
+        assert not session.loaded
+        self.assert_equal(session.user_id, 42)
+        assert session.loaded
+        self.assert_equal(session, {'user_id': 42, 'x': 1})
+
+        session = cls.unserialize(s, self.crypter)
+        self.assert_equal(cls.unserialize(session.serialize(), self.crypter),
+                          {'user_id': 42, 'x': 1})
+
+    def test_interface(self):
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, schema=SCHEMA, lazy=True)
+
+        @app.route('/login')
+        def login():
+            flask.session['user_id'] = 42
+            flask.session.permanent = True
+            flask.flash('Welcome')
+            return ''
+
+        @app.route('/')
+        def index():
+            return '%s %s %s %s' % (
+                flask.session.user_id, flask.session.locale,
+                flask.session.permanent,
+                ', '.join(flask.get_flashed_messages()))
+
+        c = app.test_client()
+        c.get('/login')
+        self.assert_equal(c.get('/').data, '42 en True Welcome')
+        self.assert_equal(c.get('/').data, '42 en True ')
+
+        self.assert_raises(ValueError, EncryptedCookieSessionInterface,
+                           KEYS_DIR, schema=SCHEMA, spill_store=MemoryStore())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SchemaSessionTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
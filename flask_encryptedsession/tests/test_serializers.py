@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_serializers
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the payload serializers.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import cPickle as pickle
+import unittest
+from datetime import datetime
+
+from werkzeug.testsuite import WerkzeugTestCase
+
+from flask_encryptedsession import serializers
+from flask_encryptedsession.serializers import (
+    JSONSerializer, MsgpackSerializer, PickleSerializer, Serializer,
+    TaggedBinarySerializer, compress_payload, dump_payload, load_payload,
+    register_serializer)
+
+
+SESSION = {
+    'user_id': 42,
+    'name': u'J\xfcrgen',
+    'token': '\x00\xffbytes',
+    'ratio': 0.25,
+    'negative': -1234567890123456789012,
+    'flags': [True, False, None],
+    '_flashes': [('message', 'Saved.')],
+    'nested': {'a': (1, (2, 3)), 'b': []},
+    'last_seen': datetime(2012, 5, 17, 13, 37, 0, 123456),
+}
+
+
+class SerializerTestCase(WerkzeugTestCase):
+
+    def test_binary_round_trip(self):
+        s = TaggedBinarySerializer()
+        loaded = s.loads(s.dumps(SESSION))
+        self.assert_equal(loaded, SESSION)
+        assert isinstance(loaded['_flashes'][0], tuple)
+        assert isinstance(loaded['token'], str)
+        assert isinstance(loaded['name'], unicode)
+        self.assert_equal(s.dumps({'b': 1, 'a': 2}), s.dumps({'a': 2, 'b': 1}))
+
+    def test_binary_errors(self):
+        s = TaggedBinarySerializer()
+        data = s.dumps(SESSION)
+        self.assert_raises(ValueError, s.loads, data[:-3])
+        self.assert_raises(ValueError, s.loads, data + 'N')
+        self.assert_raises(ValueError, s.loads, '?')
+        self.assert_raises(TypeError, s.dumps, {'x': object()})
+
+    def test_smaller_than_legacy_pickle(self):
+        data = dict(SESSION)
+        del data['last_seen']
+        for s in (PickleSerializer(), TaggedBinarySerializer()):
+            assert len(s.dumps(data)) < len(pickle.dumps(data))
+
+    def test_other_round_trips(self):
+        data = {'user_id': 42, 'name': u'J\xfcrgen', 'flags': [True, None]}
+        for s in (JSONSerializer(), PickleSerializer()):
+            self.assert_equal(s.loads(s.dumps(data)), data)
+        self.assert_equal(PickleSerializer().loads(
+            PickleSerializer().dumps(SESSION)), SESSION)
+        if serializers.msgpack is not None:
+            s = MsgpackSerializer()
+            self.assert_equal(s.loads(s.dumps(data)), data)
+
+    def test_payload(self):
+        for s in (JSONSerializer(), PickleSerializer(),
+                  TaggedBinarySerializer()):
+            payload = dump_payload(s, {'x': 42})
+            assert payload.startswith(serializers.PAYLOAD_MARKER + s.tag)
+            self.assert_equal(load_payload(payload), {'x': 42})
+        self.assert_raises(ValueError, load_payload, '\x00?foo')
+
+    def test_legacy_pickle(self):
+        for protocol in (0, 2):
+            data = pickle.dumps({'x': (1, 2)}, protocol)
+            self.assert_equal(load_payload(data, pickle), {'x': (1, 2)})
+            self.assert_raises(ValueError, load_payload, data)
+
+    def test_compression(self):
+        payload = dump_payload(PickleSerializer(), {'x': 'a' * 1000})
+        compressed = compress_payload(payload)
+        assert compressed.startswith(serializers.COMPRESSED_MARKER + 'z')
+        assert len(compressed) < len(payload) / 10
+        self.assert_equal(load_payload(compressed), {'x': 'a' * 1000})
+        payload = dump_payload(PickleSerializer(), {'x': 1})
+        assert compress_payload(payload) is payload
+        self.assert_raises(ValueError, load_payload, '\x01?' + payload)
+
+    def test_decompression_limit(self):
+        payload = dump_payload(PickleSerializer(), {'x': 'a' * 100000})
+        compressed = compress_payload(payload, 9)
+        assert len(compressed) < 1000
+        self.assert_raises(ValueError, load_payload, compressed)
+        self.assert_raises(ValueError, load_payload, compressed, None, 50000)
+        self.assert_equal(load_payload(compressed, None, 200000),
+                          {'x': 'a' * 100000})
+        # compressed payloads must not hide untagged pickles
+        compressed = compress_payload(pickle.dumps({'x': 'a' * 100}))
+        self.assert_raises(ValueError, load_payload, compressed, pickle)
+
+    def test_register(self):
+        class ReprSerializer(Serializer):
+            tag = 'r'
+
+            def dumps(self, obj):
+                return repr(obj)
+
+            def loads(self, data):
+                return eval(data, {})
+
+        register_serializer(ReprSerializer())
+        self.assert_equal(load_payload(dump_payload(ReprSerializer(), [1])),
+                          [1])
+        del serializers._serializers['r']
+
+        class ConflictingSerializer(JSONSerializer):
+            pass
+        self.assert_raises(ValueError, register_serializer,
+                           ConflictingSerializer())
+        ConflictingSerializer.tag = 'rr'
+        self.assert_raises(ValueError, register_serializer,
+                           ConflictingSerializer())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SerializerTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_signals
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the instrumentation signals and timings.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os.path
+import unittest
+
+import flask
+from flask.testsuite import FlaskTestCase
+
+from flask_encryptedsession.backends import get_backend
+from flask_encryptedsession.encryptedcookie import EncryptedCookie
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+from flask_encryptedsession.signals import (
+    cookie_encrypted, cookie_loaded, cookie_oversized, cookie_rejected,
+    session_timed)
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+KEYS_DIR_BADKEY = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys_badkey')
+
+
+def tamper(value):
+    """Change one character in the middle of the ciphertext of `value`."""
+    middle = len(value) // 2
+    return value[:middle] + (value[middle] == 'A' and 'B' or 'A') + \
+        value[middle + 1:]
+
+
+def make_app(**options):
+    app = flask.Flask(__name__)
+    app.session_interface = EncryptedCookieSessionInterface(KEYS_DIR,
+                                                            **options)
+
+    @app.route('/set')
+    def set():
+        flask.session['value'] = 42
+        return 'value set'
+
+    @app.route('/get')
+    def get():
+        return unicode(flask.session.get('value'))
+
+    return app
+
+
+class TimingTestCase(FlaskTestCase):
+
+    def test_rejected_reasons(self):
+        backend = get_backend(KEYS_DIR)
+        cookies = [
+            ('malformed', '2.0.abc'),
+            ('expired', EncryptedCookie({'x': 1}, KEYS_DIR).serialize(
+                expires=1)),
+            ('malformed', 'garbage'),
+            ('malformed', '1..' + 'x' * 10000 * 7),
+            ('unknown_key',
+             EncryptedCookie({'x': 1}, KEYS_DIR_BADKEY).serialize()),
+            ('decrypt', tamper(EncryptedCookie({'x': 1}, KEYS_DIR).serialize())),
+            ('deserialize', '1..' + backend.encrypt('\x00?junk', '1.')),
+        ]
+        for reason, value in cookies:
+            c = EncryptedCookie.unserialize(value, KEYS_DIR)
+            self.assert_equal(c, {})
+            self.assert_equal(c.rejected_reason, reason)
+        c = EncryptedCookie.unserialize(
+            EncryptedCookie({'x': 1}, KEYS_DIR).serialize(), KEYS_DIR)
+        self.assert_equal(c.rejected_reason, None)
+
+    def test_timings(self):
+        value = EncryptedCookie({'x': 1}, KEYS_DIR).serialize()
+        timings = {}
+        c = EncryptedCookie.unserialize(value, KEYS_DIR, timings=timings)
+        assert c.timings is timings
+        self.assert_equal(sorted(timings), ['decrypt', 'deserialize'])
+        c.serialize()
+        self.assert_equal(sorted(timings),
+                          ['decrypt', 'deserialize', 'encrypt', 'serialize'])
+        # nothing is measured without a timings dict
+        c = EncryptedCookie.unserialize(value, KEYS_DIR)
+        c.serialize()
+        self.assert_equal(c.timings, None)
+
+    def test_server_timing(self):
+        app = make_app(timing_sample_rate=1.0, server_timing=True)
+        c = app.test_client()
+        c.get('/set')
+        rv = c.get('/get')
+        header = rv.headers['Server-Timing']
+        self.assert_('session-decrypt;dur=' in header)
+        self.assert_('session-deserialize;dur=' in header)
+        self.assert_equal(app.session_interface.stats['timed_requests'], 2)
+
+        app = make_app(timing_sample_rate=1.0)
+        rv = app.test_client().get('/set')
+        self.assert_('Server-Timing' not in rv.headers)
+
+    def test_sampling(self):
+        app = make_app(timing_sample_rate=0.0, server_timing=True)
+        c = app.test_client()
+        c.get('/set')
+        rv = c.get('/get')
+        self.assert_('Server-Timing' not in rv.headers)
+        self.assert_equal(app.session_interface.stats['timed_requests'], 0)
+
+    def test_rejected_counters(self):
+        app = make_app()
+        c = app.test_client()
+        c.set_cookie('localhost', 'session', '1.1.abc')
+        c.get('/get')
+        c.set_cookie('localhost', 'session', 'garbage')
+        c.get('/get')
+        stats = app.session_interface.stats
+        self.assert_equal(stats['rejected:expired'], 1)
+        self.assert_equal(stats['rejected:malformed'], 1)
+
+
+class SignalsTestCase(FlaskTestCase):
+
+    def record(self, signal):
+        recorded = []
+
+        def receiver(sender, **kwargs):
+            recorded.append((sender, kwargs))
+        signal.connect(receiver)
+        self.addCleanup(signal.disconnect, receiver)
+        return recorded
+
+    def test_cookie_signals(self):
+        loaded = self.record(cookie_loaded)
+        encrypted = self.record(cookie_encrypted)
+        rejected = self.record(cookie_rejected)
+        value = EncryptedCookie({'x': 1}, KEYS_DIR).serialize()
+        self.assert_equal(encrypted, [])
+        c = EncryptedCookie.unserialize(value, KEYS_DIR, timings={})
+        self.assert_equal(len(loaded), 1)
+        self.assert_equal(loaded[0][0], EncryptedCookie)
+        self.assert_equal(loaded[0][1]['cookie_size'], len(value))
+        new_value = c.serialize()
+        self.assert_equal(len(encrypted), 1)
+        assert encrypted[0][0] is c
+        self.assert_equal(encrypted[0][1]['cookie_size'], len(new_value))
+        EncryptedCookie.unserialize(value, KEYS_DIR_BADKEY)
+        self.assert_equal(rejected,
+                          [(EncryptedCookie, {'reason': 'unknown_key'})])
+
+    def test_cookie_oversized(self):
+        oversized = self.record(cookie_oversized)
+        app = make_app(size_budget=300, evictable_keys=['cache'])
+
+        @app.route('/fill/<int:size>')
+        def fill(size):
+            flask.session['cache'] = 'x' * size
+            flask.session['value'] = 'y' * size
+            return ''
+
+        c = app.test_client()
+        c.get('/fill/10')
+        self.assert_equal(oversized, [])
+        c.get('/fill/100')
+        self.assert_equal(len(oversized), 1)
+        self.assert_equal(oversized[0][1]['evicted'], ['cache'])
+        self.assert_equal(oversized[0][1]['key_sizes'], None)
+        c.get('/fill/300')
+        kwargs = oversized[1][1]
+        assert kwargs['size'] > kwargs['budget'] == 300
+        self.assert_equal(kwargs['key_sizes'][0][0], 'value')
+        stats = app.session_interface.stats
+        self.assert_equal(stats['evicted_keys'], 2)
+        self.assert_equal(stats['over_budget'], 1)
+
+    def test_session_timed(self):
+        timed = self.record(session_timed)
+        app = make_app(timing_sample_rate=1.0)
+        app.test_client().get('/set')
+        self.assert_equal(len(timed), 1)
+        sender, kwargs = timed[0]
+        assert sender is app
+        self.assert_equal(kwargs['session'], {'value': 42})
+        self.assert_equal(sorted(kwargs['timings']), ['encrypt', 'serialize'])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TimingTestCase))
+    if flask.signals_available:
+        suite.addTest(unittest.makeSuite(SignalsTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_encryptedsession.tests.test_stores
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the server side stores and spilling session values to them.
+
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import flask
+from flask.testsuite import FlaskTestCase
+from werkzeug.wrappers import Response
+
+from flask_encryptedsession.encryptedcookie import (
+    SPILLED_KEY, EncryptedCookie, SpilledValue, SpillingCookieMixin)
+from flask_encryptedsession.encryptedsession import (
+    EncryptedCookieSessionInterface)
+from flask_encryptedsession.stores import MemoryStore, SQLiteStore
+
+
+KEYS_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), 'testkeys')
+
+
+class StoreTests(object):
+
+    def test_get_set_delete(self):
+        store = self.make_store()
+        self.assert_equal(store.get_many([]), {})
+        store.set_many({'a.1': 'x' * 100, 'b.1': '\x00\xff'})
+        self.assert_equal(store.get_many(['a.1', 'b.1', 'c.1']),
+                          {'a.1': 'x' * 100, 'b.1': '\x00\xff'})
+        store.delete_many(['a.1', 'c.1'])
+        self.assert_equal(store.get_many(['a.1', 'b.1']), {'b.1': '\x00\xff'})
+        self.assert_equal(store.stats['hits'], 3)
+        self.assert_equal(store.stats['misses'], 2)
+
+    def test_ttl(self):
+        store = self.make_store(ttl=-1)
+        store.set_many({'a.1': 'x'})
+        self.assert_equal(store.get_many(['a.1']), {})
+        store.prune()
+
+
+class MemoryStoreTestCase(FlaskTestCase, StoreTests):
+
+    def make_store(self, ttl=None):
+        return MemoryStore(ttl)
+
+
+class SQLiteStoreTestCase(FlaskTestCase, StoreTests):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_store(self, ttl=None):
+        return SQLiteStore(os.path.join(self.tempdir, 'sessions.db'), ttl)
+
+    def test_shared_file(self):
+        self.make_store().set_many({'a.1': 'x'})
+        self.assert_equal(self.make_store().get_many(['a.1']), {'a.1': 'x'})
+
+    def test_forked(self):
+        store = self.make_store()
+        store.set_many({'a.1': 'x'})
+        connection = store._connection()
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            try:
+                ok = store._connection() is not connection and \
+                    store.get_many(['a.1']) == {'a.1': 'x'}
+                store.set_many({'b.1': 'y'})
+                os.write(write, ok and '1' or '0')
+            finally:
+                os._exit(0)
+        os.close(write)
+        result = os.read(read, 1)
+        os.close(read)
+        os.waitpid(pid, 0)
+        self.assert_equal(result, '1')
+        self.assert_(store._connection() is connection)
+        self.assert_equal(store.get_many(['b.1']), {'b.1': 'y'})
+
+
+class SpillingCookieTestCase(FlaskTestCase):
+
+    def setUp(self):
+        store = self.store = MemoryStore()
+
+        class HybridCookie(SpillingCookieMixin, EncryptedCookie):
+            spill_store = store
+            spill_threshold = 100
+            spill_keys = frozenset(['draft'])
+        self.cookie_class = HybridCookie
+
+    def test_spill(self):
+        c = self.cookie_class({'big': 'x' * 500, 'draft': {'a': 1},
+                               'small': 42}, KEYS_DIR)
+        s = c.serialize()
+        assert len(s) < 500
+        self.assert_equal(len(self.store), 2)
+        self.assert_equal(
+            EncryptedCookie.unserialize(s, KEYS_DIR)['small'], 42)
+
+        c2 = self.cookie_class.unserialize(s, KEYS_DIR)
+        assert isinstance(dict.__getitem__(c2, 'big'), SpilledValue)
+        self.assert_equal(c2['small'], 42)
+        self.assert_equal(self.store.stats['gets'], 0)
+        self.assert_equal(sorted(c2), ['big', 'draft', 'small'])
+        self.assert_equal(c2['draft'], {'a': 1})
+        # all spilled values are fetched at once
+        self.assert_equal(self.store.stats['gets'], 1)
+        self.assert_equal(c2.get('big'), 'x' * 500)
+        self.assert_equal(c2, c)
+        self.assert_equal(self.store.stats['gets'], 1)
+
+    def test_versions(self):
+        c = self.cookie_class({'big': 'x' * 500, 'draft': {'a': 1}},
+                              KEYS_DIR)
+        s = c.serialize()
+        entries = set(self.store._entries)
+
+        # unchanged values are not written again
+        c2 = self.cookie_class.unserialize(s, KEYS_DIR)
+        c2['big']
+        c2['small'] = 1
+        c2.serialize()
+        self.assert_equal(set(self.store._entries), entries)
+        self.assert_equal(self.store.stats['writes'], 2)
+
+        # a changed value gets a new version, the old one is kept for
+        # requests that still carry the old cookie
+        c2 = self.cookie_class.unserialize(s, KEYS_DIR)
+        c2['draft']['b'] = 2
+        s2 = c2.serialize()
+        self.assert_equal(len(self.store), 3)
+        assert entries < set(self.store._entries)
+        self.assert_equal(self.cookie_class.unserialize(s2, KEYS_DIR)['draft'],
+                          {'a': 1, 'b': 2})
+        c3 = self.cookie_class.unserialize(s, KEYS_DIR)
+        self.assert_equal(c3['draft'], {'a': 1})
+        assert not c3.modified
+
+        # replaced or deleted values are not fetched or written
+        gets = self.store.stats['gets']
+        c2 = self.cookie_class.unserialize(s2, KEYS_DIR)
+        del c2['draft']
+        c2['big'] = 'small'
+        s2 = c2.serialize()
+        self.assert_equal(len(self.store), 3)
+        self.assert_equal(self.store.stats['gets'], gets)
+        self.assert_equal(self.cookie_class.unserialize(s2, KEYS_DIR),
+                          {'big': 'small'})
+
+        # deleting the cookie removes its values
+        c2 = self.cookie_class.unserialize(s, KEYS_DIR)
+        c2.delete_cookie(Response())
+        assert not entries & set(self.store._entries)
+
+    def test_missing_value(self):
+        s = self.cookie_class({'big': 'x' * 500, 'y': 1}, KEYS_DIR).serialize()
+        self.store.delete_many(list(self.store._entries))
+        c = self.cookie_class.unserialize(s, KEYS_DIR)
+        self.assert_equal(c.get('big'), None)
+        self.assert_equal(c, {'y': 1})
+        assert not c.modified
+
+    def test_tampered_value(self):
+        s = self.cookie_class({'big': 'x' * 500, 'y': 1}, KEYS_DIR).serialize()
+        key, = self.store._entries
+        forged = self.cookie_class({}, KEYS_DIR)._dump_value('y' * 500)
+        self.store.set_many({key: forged})
+        c = self.cookie_class.unserialize(s, KEYS_DIR)
+        self.assert_equal(c.get('big'), None)
+        self.assert_equal(c, {'y': 1})
+        self.assert_equal(self.store.stats['mismatches'], 1)
+
+    def test_reserved_key(self):
+        # only spilling cookies reserve the key
+        c = EncryptedCookie({SPILLED_KEY: ['a'], 'y': 1}, KEYS_DIR)
+        self.assert_equal(EncryptedCookie.unserialize(c.serialize(), KEYS_DIR),
+                          {SPILLED_KEY: ['a'], 'y': 1})
+
+        for spilled in (['a'], {'big': 'ref'}, {'big': ['ref', 'x', 'd']},
+                        {'big': [1, 2, 'd']}, {'big': ['ref', 1]}):
+            s = EncryptedCookie({SPILLED_KEY: spilled}, KEYS_DIR).serialize()
+            c = self.cookie_class.unserialize(s, KEYS_DIR)
+            self.assert_equal(c, {})
+            self.assert_equal(c.rejected_reason, 'deserialize')
+
+
+class SpillingSessionTestCase(FlaskTestCase):
+
+    def test_session(self):
+        store = MemoryStore()
+        app = flask.Flask(__name__)
+        app.session_interface = EncryptedCookieSessionInterface(
+            KEYS_DIR, lazy=True, spill_store=store, spill_threshold=200)
+
+        @app.route('/set')
+        def set():
+            flask.session['results'] = range(1000)
+            flask.session['user'] = 42
+            return ''
+
+        @app.route('/user')
+        def user():
+            return str(flask.session['user'])
+
+        @app.route('/count')
+        def count():
+            return str(len(flask.session['results']))
+
+        @app.route('/clear')
+        def clear():
+            flask.session.clear()
+            return ''
+
+        c = app.test_client()
+        rv = c.get('/set')
+        assert len(rv.headers['set-cookie']) < 1000
+        self.assert_equal(len(store), 1)
+        self.assert_equal(c.get('/user').data, '42')
+        self.assert_equal(store.stats['gets'], 0)
+        self.assert_equal(c.get('/count').data, '1000')
+        self.assert_equal(store.stats['gets'], 1)
+        c.get('/clear')
+        self.assert_equal(len(store), 0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MemoryStoreTestCase))
+    suite.addTest(unittest.makeSuite(SQLiteStoreTestCase))
+    suite.addTest(unittest.makeSuite(SpillingCookieTestCase))
+    suite.addTest(unittest.makeSuite(SpillingSessionTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,6 +19,15 @@ setup(
         'PyCrypto>=2.5',
         'python-keyczar>=0.71b',
     ],
+    extras_require={
+        'msgpack': ['msgpack>=0.5.2'],
+        'aead': ['cryptography>=2.0'],
+    },
+    entry_points={
+        'console_scripts': [
+            'flask-encryptedsession-batch = flask_encryptedsession.batch:main',
+        ],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Web Environment',